@@ -0,0 +1,129 @@
+"""Журнал попыток: каждый ход в задаче и первый исход задачи.
+
+Строки JSON дописываются в сегменты attempts/attempts-<время>-<pid>.jsonl;
+сегмент закрывается, когда вырастает до segment_bytes, и больше не
+меняется. Ход только кладётся в буфер в памяти, сериализация и запись
+идут пачками в потоке раз в flush_interval секунд. Из журнала
+replay_attempts.py заново считает счётчики и рейтинг игроков.
+
+Регистрация: {"t", "user", "registered"}
+Ход:         {"t", "user", "puzzle", "ply", "move", "correct", "latency", "solved", "rating"}
+Исход:       {"t", "user", "puzzle", "result", "rating"}
+"""
+import asyncio
+import glob
+import heapq
+import json
+import os
+import time
+from collections import OrderedDict
+
+SEGMENT_BYTES = 64 * 2 ** 20
+# пользователей, для которых помним время последней подсказки
+MAX_PROMPTS = 100_000
+
+
+class AttemptLog:
+    def __init__(self, directory="attempts", flush_interval=1.0, segment_bytes=SEGMENT_BYTES):
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self.segment_bytes = segment_bytes
+        self._buffer = []
+        # telegram_id -> time.monotonic(), когда игроку показали позицию для хода
+        self._prompted = OrderedDict()
+        self._file = None
+        self._task = None
+        self._flush_lock = asyncio.Lock()
+
+    def backlog(self):
+        return len(self._buffer)
+
+    def prompted(self, telegram_id):
+        """Игроку показали позицию: от этого момента считается время на ход."""
+        self._prompted[telegram_id] = time.monotonic()
+        self._prompted.move_to_end(telegram_id)
+        while len(self._prompted) > MAX_PROMPTS:
+            self._prompted.popitem(last=False)
+
+    def registered(self, telegram_id):
+        """Новый игрок: с этого события журнал покрывает всю его историю."""
+        self._buffer.append({"t": time.time(), "user": telegram_id, "registered": True})
+
+    def move(self, telegram_id, puzzle_id, ply, move, correct, solved, rating):
+        started = self._prompted.get(telegram_id)
+        latency = round(time.monotonic() - started, 3) if started is not None else None
+        self._buffer.append({
+            "t": time.time(), "user": telegram_id, "puzzle": puzzle_id, "ply": ply, "move": move,
+            "correct": correct, "latency": latency, "solved": solved, "rating": rating,
+        })
+
+    def result(self, telegram_id, puzzle_id, solved, rating):
+        """Первый исход задачи - то, что меняет рейтинг игрока."""
+        self._buffer.append({
+            "t": time.time(), "user": telegram_id, "puzzle": puzzle_id, "result": solved, "rating": rating,
+        })
+
+    async def start(self):
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                print(f"Ошибка записи журнала попыток: {e}")
+
+    async def flush(self):
+        async with self._flush_lock:
+            if not self._buffer:
+                return
+            batch, self._buffer = self._buffer, []
+            try:
+                await asyncio.get_running_loop().run_in_executor(None, self._write, batch)
+            except Exception:
+                self._buffer[:0] = batch
+                raise
+
+    def _write(self, batch):
+        data = "".join(json.dumps(event, ensure_ascii=False, separators=(",", ":")) + "\n" for event in batch)
+        if self._file is None or self._file.tell() >= self.segment_bytes:
+            self._rotate()
+        self._file.write(data)
+        self._file.flush()
+
+    def _rotate(self):
+        if self._file is not None:
+            self._file.close()
+        os.makedirs(self.directory, exist_ok=True)
+        name = f"attempts-{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}.jsonl"
+        self._file = open(os.path.join(self.directory, name), "a", encoding="utf-8")
+
+
+def _read_segment(path):
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                yield json.loads(line)
+            except ValueError:
+                # оборванная последняя строка после падения процесса
+                continue
+
+
+def iter_events(directory="attempts"):
+    """События всех сегментов по времени; в каждом сегменте они уже по порядку."""
+    paths = sorted(glob.glob(os.path.join(directory, "attempts-*.jsonl")))
+    return heapq.merge(*map(_read_segment, paths), key=lambda event: event["t"])
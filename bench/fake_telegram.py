@@ -0,0 +1,97 @@
+"""Локальная замена Bot API для бенчмарков: ничего не уходит в сеть."""
+import asyncio
+import itertools
+import json
+import time
+
+from telegram.request import BaseRequest
+
+BOT_USER = {"id": 1, "is_bot": True, "first_name": "bench", "username": "bench_bot"}
+
+# методы, на которые Bot API отвечает просто true
+TRUE_METHODS = {
+    "answerCallbackQuery", "setWebhook", "deleteWebhook", "setMyCommands", "deleteMessage",
+}
+
+
+class FakeRequest(BaseRequest):
+    """Отвечает на запросы бота правдоподобным JSON и считает вызовы."""
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.calls = {}
+        self._message_ids = itertools.count(1000)
+
+    @property
+    def read_timeout(self):
+        return None
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    async def do_request(self, url, method, request_data=None, read_timeout=None,
+                         write_timeout=None, connect_timeout=None, pool_timeout=None):
+        api_method = url.rsplit("/", 1)[-1]
+        self.calls[api_method] = self.calls.get(api_method, 0) + 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+        params = request_data.parameters if request_data is not None else {}
+        if api_method == "getMe":
+            result = BOT_USER
+        elif api_method == "getUpdates":
+            result = []
+        elif api_method in TRUE_METHODS:
+            result = True
+        else:
+            chat_id = int(params.get("chat_id", 0) or 0)
+            result = bot_message(next(self._message_ids), chat_id, params.get("text", ""))
+        return 200, json.dumps({"ok": True, "result": result}).encode()
+
+
+def user(user_id):
+    return {"id": user_id, "is_bot": False, "first_name": f"user{user_id}", "username": f"user{user_id}"}
+
+
+def chat(user_id):
+    return {"id": user_id, "type": "private"}
+
+
+def bot_message(message_id, chat_id, text=""):
+    return {"message_id": message_id, "date": int(time.time()), "chat": chat(chat_id),
+            "from": BOT_USER, "text": text}
+
+
+class UpdateFactory:
+    """Собирает JSON апдейтов так, как их присылает Telegram."""
+
+    def __init__(self):
+        self._update_ids = itertools.count(1)
+        self._message_ids = itertools.count(1)
+
+    def message(self, user_id, text):
+        message = {
+            "message_id": next(self._message_ids),
+            "date": int(time.time()),
+            "chat": chat(user_id),
+            "from": user(user_id),
+            "text": text,
+        }
+        if text.startswith("/"):
+            message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+        return {"update_id": next(self._update_ids), "message": message}
+
+    def callback(self, user_id, data, text=""):
+        return {
+            "update_id": next(self._update_ids),
+            "callback_query": {
+                "id": str(next(self._message_ids)),
+                "from": user(user_id),
+                "chat_instance": str(user_id),
+                "data": data,
+                "message": bot_message(next(self._message_ids), user_id, text),
+            },
+        }
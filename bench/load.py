@@ -0,0 +1,122 @@
+"""Нагрузочный тест: тысячи пользователей решают задачи через настоящие обработчики.
+
+    python bench/load.py --users 2000 --concurrency 200
+    python bench/load.py --users 500 --api-latency 0.02
+
+Application собирается так же, как в main(), но запросы к Bot API уходят в
+FakeRequest. Каждый пользователь проходит /start -> /game -> выбор уровня ->
+показать/скрыть доску -> ходы решения -> /stats. В конце печатаются p50/p99
+по обработчикам и апдейты в секунду.
+"""
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+LEVELS = ["Средняя", "Сложная", "Очень сложная"]
+
+
+def percentile(values, q):
+    if len(values) == 1:
+        return values[0]
+    return statistics.quantiles(values, n=100, method="inclusive")[q - 1]
+
+
+class Recorder:
+    def __init__(self):
+        self.latencies = {}
+
+    async def send(self, app, name, data):
+        from telegram import Update
+
+        update = Update.de_json(data, app.bot)
+        started = time.perf_counter()
+        await app.process_update(update)
+        self.latencies.setdefault(name, []).append(time.perf_counter() - started)
+
+    def total(self):
+        return sum(len(values) for values in self.latencies.values())
+
+    def report(self, elapsed):
+        print(f"{'обработчик':<14}{'апдейтов':>10}{'p50, мс':>10}{'p99, мс':>10}")
+        for name, values in sorted(self.latencies.items()):
+            print(f"{name:<14}{len(values):>10}{percentile(values, 50) * 1000:>10.2f}"
+                  f"{percentile(values, 99) * 1000:>10.2f}")
+        print(f"\nВсего апдейтов: {self.total()} за {elapsed:.2f} с, "
+              f"{self.total() / elapsed:.0f} апдейтов/с")
+
+
+async def user_session(app, main, factory, recorder, user_id):
+    await recorder.send(app, "start", factory.message(user_id, "/start"))
+    await recorder.send(app, "game", factory.message(user_id, "/game"))
+    await recorder.send(app, "level_choice", factory.callback(user_id, f"level_{random.choice(LEVELS)}"))
+    await recorder.send(app, "show_board", factory.callback(user_id, "show_board"))
+    await recorder.send(app, "hide_board", factory.callback(user_id, "hide_board"))
+
+    # решение подсматриваем в сессии: нагрузка должна идти по верным ходам
+    task_data = await main.active_games.get(user_id)
+    if task_data is not None:
+        solution = task_data["solution"]
+        for ply in range(0, len(solution) - 1, 2):
+            move = solution[ply]
+            await recorder.send(app, "text_handler", factory.message(user_id, f"{move[:2]} {move[2:]}"))
+            if await main.active_games.get(user_id) is None:
+                break
+
+    await recorder.send(app, "stats", factory.message(user_id, "/stats"))
+
+
+async def run(args):
+    from fake_telegram import FakeRequest, UpdateFactory
+    import main
+
+    request = FakeRequest(latency=args.api_latency)
+    # без лимитов: меряем обработчики, а не ожидание маркеров
+    app = main.build_application("123456:BENCH", request=request, api_rate=0)
+    factory = UpdateFactory()
+    recorder = Recorder()
+    limit = asyncio.Semaphore(args.concurrency)
+
+    async def limited(user_id):
+        async with limit:
+            await user_session(app, main, factory, recorder, user_id)
+
+    async with app:
+        await main.post_init(app)
+        try:
+            started = time.perf_counter()
+            await asyncio.gather(*(limited(10_000 + i) for i in range(args.users)))
+            elapsed = time.perf_counter() - started
+        finally:
+            await main.post_shutdown(app)
+
+    recorder.report(elapsed)
+    print("Вызовы Bot API:", ", ".join(f"{name}={count}" for name, count in sorted(request.calls.items())))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Нагрузочный тест обработчиков бота")
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, default=100, help="одновременно активных пользователей")
+    parser.add_argument("--api-latency", type=float, default=0.0, help="задержка ответа Bot API, с")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    os.chdir(ROOT)
+    # отдельная база, чтобы не трогать user_progress.db
+    tmp = tempfile.mkdtemp(prefix="bench-")
+    os.environ.setdefault("DATABASE_URL", f"sqlite+aiosqlite:///{tmp}/bench.db")
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
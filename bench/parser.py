@@ -0,0 +1,87 @@
+"""Сколько стоит разбор одного сообщения с ходом.
+
+    python bench/parser.py
+    python bench/parser.py --repeat 20
+
+Для каждой позиции из решений задач готовит ходы во всех записях
+(UCI, "e2 e4", SAN, SAN строчными) и меряет parse_move: первый проход
+строит таблицы ходов, повторные - только поиск в кэше. Для сравнения -
+разбор средствами python-chess (parse_san / from_uci с проверкой legal_moves).
+"""
+import argparse
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import chess  # noqa: E402
+
+from move_parser import move_table, parse_move  # noqa: E402
+from puzzle_loader import iter_records, make_task  # noqa: E402
+from solution_table import solution_line  # noqa: E402
+
+
+def samples(path):
+    """(доска, FEN, текст сообщения) по всем ходам игрока из решений."""
+    items = []
+    for record in iter_records(path):
+        line = solution_line(make_task(record))
+        for ply in range(0, line.playable, 2):
+            board = chess.Board(line.fens[ply])
+            move = line.moves[ply]
+            san = board.san(move)
+            uci = move.uci()
+            for text in (uci, f"{uci[:2]} {uci[2:]}", san, san.lower()):
+                items.append((board, line.fens[ply], text))
+    return items
+
+
+def python_chess(board, fen, text):
+    try:
+        return board.parse_san(text)
+    except ValueError:
+        move = chess.Move.from_uci(text.replace(" ", "").lower())
+        if move not in board.legal_moves:
+            raise chess.IllegalMoveError(text)
+        return move
+
+
+def measure(items, parse, repeat):
+    parsed = failed = 0
+    started = time.perf_counter()
+    for _ in range(repeat):
+        for board, fen, text in items:
+            try:
+                parse(board, fen, text)
+                parsed += 1
+            except ValueError:
+                failed += 1
+    elapsed = time.perf_counter() - started
+    return elapsed / (len(items) * repeat) * 1e6, parsed // repeat, failed // repeat
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Стоимость разбора хода")
+    parser.add_argument("--puzzles", default=os.path.join(ROOT, "puzzles_data.json"))
+    parser.add_argument("--repeat", type=int, default=10)
+    args = parser.parse_args()
+
+    items = samples(args.puzzles)
+    print(f"Сообщений: {len(items)}")
+
+    def ours(board, fen, text):
+        return parse_move(fen, text)
+
+    move_table.cache_clear()
+    cold, parsed, failed = measure(items, ours, 1)
+    print(f"parse_move, таблицы строятся: {cold:8.2f} мкс/сообщение (разобрано {parsed}, ошибок {failed})")
+    warm, parsed, failed = measure(items, ours, args.repeat)
+    print(f"parse_move, таблицы в кэше:   {warm:8.2f} мкс/сообщение (разобрано {parsed}, ошибок {failed})")
+    base, parsed, failed = measure(items, python_chess, args.repeat)
+    print(f"parse_san / from_uci:         {base:8.2f} мкс/сообщение (разобрано {parsed}, ошибок {failed})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+"""Время запуска бота: от старта процесса до ответа на первый апдейт.
+
+    python bench/startup.py
+    python bench/startup.py --runs 10 --puzzles big.json
+
+Каждый запуск - отдельный процесс python в своём временном каталоге:
+импорт main, initialize и post_init Application (запросы к Bot API
+уходят в FakeRequest), затем /start от пользователя и ответ на него.
+Первый запуск холодный: нет ни снимка задач, ни базы. Остальные идут в
+том же каталоге и берут готовые снимок и схему. Печатаются фазы каждого
+запуска и медианы тёплых.
+
+Тяжёлые пакеты импортируются отдельными фазами до main - видно, сколько
+стоит каждый и сколько остаётся на модули бота. Все три нужны раньше
+первого ответа: telegram.ext - чтобы собрать Application, sqlalchemy и
+aiosqlite - для init_db в post_init и чтения игрока в /start, chess -
+для любого хода и сессии задачи. Отложить их значит лишь перенести это
+время из импорта в init или первый обработчик.
+"""
+import time
+
+STARTED = time.time()
+
+import argparse
+import asyncio
+import importlib
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BENCH = os.path.dirname(os.path.abspath(__file__))
+
+# (фаза, модули): импортируются по очереди, раньше main
+PACKAGES = [
+    ("telegram", ["telegram.ext"]),
+    ("sqlalchemy", ["sqlalchemy.ext.asyncio", "aiosqlite"]),
+    ("chess", ["chess"]),
+]
+PHASES = ["interpreter"] + [name for name, _ in PACKAGES] + ["main", "init", "first_update", "total"]
+
+
+async def first_update():
+    sys.path.insert(0, ROOT)
+    sys.path.insert(0, BENCH)
+    stamps = {"started": STARTED}
+    for name, modules in PACKAGES:
+        for module in modules:
+            importlib.import_module(module)
+        stamps[name] = time.time()
+    import main
+    from fake_telegram import FakeRequest, UpdateFactory
+    from telegram import Update
+
+    stamps["imported"] = time.time()
+    request = FakeRequest()
+    app = main.build_application("123456:BENCH", request=request, api_rate=0)
+    async with app:
+        await main.post_init(app)
+        try:
+            stamps["initialized"] = time.time()
+            data = UpdateFactory().message(10_000, "/start")
+            await app.process_update(Update.de_json(data, app.bot))
+            stamps["answered"] = time.time()
+        finally:
+            await main.post_shutdown(app)
+    if not request.calls.get("sendMessage"):
+        raise SystemExit("бот не ответил на /start")
+    return stamps
+
+
+def run_child(directory, puzzles):
+    os.makedirs(directory, exist_ok=True)
+    link = os.path.join(directory, "puzzles_data.json")
+    if not os.path.exists(link):
+        os.symlink(os.path.abspath(puzzles), link)
+    env = dict(os.environ, DATABASE_URL=f"sqlite+aiosqlite:///{directory}/bench.db", PYTHONPATH=ROOT)
+    spawned = time.time()
+    result = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), "--child"],
+        cwd=directory, env=env, capture_output=True, text=True,
+    )
+    if result.returncode:
+        raise SystemExit(result.stdout + result.stderr)
+    stamps = json.loads(result.stdout.strip().splitlines()[-1])
+    phases = {"interpreter": stamps["started"] - spawned}
+    previous = stamps["started"]
+    for name, _ in PACKAGES:
+        phases[name] = stamps[name] - previous
+        previous = stamps[name]
+    return {
+        **phases,
+        "main": stamps["imported"] - previous,
+        "init": stamps["initialized"] - stamps["imported"],
+        "first_update": stamps["answered"] - stamps["initialized"],
+        "total": stamps["answered"] - spawned,
+    }
+
+
+def row(name, phases):
+    return f"{name:<9}" + "".join(f"{phases[phase] * 1000:>13.1f}" for phase in PHASES)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Время от запуска бота до ответа на первый апдейт")
+    parser.add_argument("--runs", type=int, default=5, help="запусков, первый из них холодный")
+    parser.add_argument("--puzzles", default=os.path.join(ROOT, "puzzles_data.json"),
+                        help="файл задач вместо puzzles_data.json")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(asyncio.run(first_update())))
+        return
+
+    directory = tempfile.mkdtemp(prefix="bench-startup-")
+    try:
+        results = [run_child(directory, args.puzzles) for _ in range(args.runs)]
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+    print(f"{'мс':<9}" + "".join(f"{phase:>13}" for phase in PHASES))
+    for number, phases in enumerate(results):
+        print(row("холодный" if number == 0 else f"#{number + 1}", phases))
+    warm = results[1:]
+    if warm:
+        print(row("медиана", {phase: statistics.median(r[phase] for r in warm) for phase in PHASES}))
+
+
+if __name__ == "__main__":
+    main()
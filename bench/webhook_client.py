@@ -0,0 +1,127 @@
+"""Гоняет режим webhook: шлёт апдейты POST-запросами, как это делает Telegram.
+
+    python bench/webhook_client.py --users 1000 --concurrency 200
+    python bench/webhook_client.py --url http://127.0.0.1:8443/telegram --users 100
+
+Без --url поднимает WebhookApp под uvicorn в этом же процессе, с FakeRequest
+вместо Bot API, и ждёт, пока очередь апдейтов не будет разобрана целиком.
+С --url только отправляет апдейты на уже запущенный сервер.
+"""
+import argparse
+import asyncio
+import os
+import random
+import sys
+import tempfile
+import time
+
+import httpx
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fake_telegram import FakeRequest, UpdateFactory  # noqa: E402
+from load import LEVELS, percentile  # noqa: E402
+
+
+async def user_session(client, url, secret, factory, user_id, latencies, main=None):
+    headers = {"X-Telegram-Bot-Api-Secret-Token": secret} if secret else {}
+
+    async def post(data):
+        started = time.perf_counter()
+        response = await client.post(url, json=data, headers=headers)
+        latencies.append(time.perf_counter() - started)
+        response.raise_for_status()
+
+    await post(factory.message(user_id, "/start"))
+    await post(factory.message(user_id, "/game"))
+    await post(factory.callback(user_id, f"level_{random.choice(LEVELS)}"))
+    await post(factory.callback(user_id, "show_board"))
+    await post(factory.callback(user_id, "hide_board"))
+
+    moves = ["e2e4", "d2d4", "g1f3"]
+    if main is not None:
+        # сервер в этом процессе: дожидаемся задачи и ходим по решению
+        for _ in range(1000):
+            task_data = await main.active_games.get(user_id)
+            if task_data is not None:
+                moves = task_data["solution"][0:-1:2]
+                break
+            await asyncio.sleep(0.001)
+    for move in moves:
+        await post(factory.message(user_id, f"{move[:2]} {move[2:]}"))
+
+    await post(factory.message(user_id, "/stats"))
+
+
+async def run(args):
+    server = None
+    main = None
+    url = args.url
+
+    if url is None:
+        import uvicorn
+
+        import main
+        from webhook import WebhookApp
+
+        # без лимитов: меряем обработку, а не ожидание маркеров
+        app = main.build_application("123456:BENCH", request=FakeRequest(args.api_latency),
+                                     polling=False, concurrent_updates=args.workers,
+                                     user_rate=0, api_rate=0)
+        webhook_app = WebhookApp(app, path="/telegram", secret_token=args.secret)
+        server = uvicorn.Server(uvicorn.Config(webhook_app, host="127.0.0.1", port=args.port,
+                                               lifespan="on", log_level="warning"))
+        server_task = asyncio.create_task(server.serve())
+        while not server.started:
+            await asyncio.sleep(0.01)
+        url = f"http://127.0.0.1:{args.port}/telegram"
+
+    factory = UpdateFactory()
+    latencies = []
+    limit = asyncio.Semaphore(args.concurrency)
+    limits = httpx.Limits(max_connections=args.concurrency)
+
+    async with httpx.AsyncClient(limits=limits, timeout=30) as client:
+        async def limited(user_id):
+            async with limit:
+                await user_session(client, url, args.secret, factory, user_id, latencies, main)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(limited(20_000 + i) for i in range(args.users)))
+        sent = time.perf_counter() - started
+        if server is not None:
+            await app.update_queue.join()
+        processed = time.perf_counter() - started
+
+    print(f"Отправлено апдейтов: {len(latencies)} за {sent:.2f} с")
+    print(f"Ответ webhook: p50 {percentile(latencies, 50) * 1000:.2f} мс, "
+          f"p99 {percentile(latencies, 99) * 1000:.2f} мс")
+    if server is not None:
+        print(f"Обработано за {processed:.2f} с, {len(latencies) / processed:.0f} апдейтов/с")
+        server.should_exit = True
+        await server_task
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Нагрузочный тест режима webhook")
+    parser.add_argument("--url", help="адрес уже запущенного webhook")
+    parser.add_argument("--secret", default="bench-secret", help="WEBHOOK_SECRET сервера")
+    parser.add_argument("--users", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=100)
+    parser.add_argument("--workers", type=int, default=64, help="concurrent_updates сервера")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--api-latency", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    os.chdir(ROOT)
+    tmp = tempfile.mkdtemp(prefix="bench-")
+    os.environ.setdefault("DATABASE_URL", f"sqlite+aiosqlite:///{tmp}/bench.db")
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+"""Доска картинкой для show_board.
+
+SVG рисует chess.svg, в PNG его переводит cairosvg (pip install cairosvg) -
+Telegram показывает как фото только растровые картинки. Без cairosvg
+available() ложно, и бот показывает доску текстом, как раньше.
+
+Картинки кэшируются по (расстановка, сторона снизу), рисуются в пуле
+потоков, а после первой отправки вместо байтов шлётся file_id Telegram.
+"""
+import asyncio
+import importlib.util
+import sys
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+IMAGE_SIZE = 400
+CACHE_SIZE = 2_000
+FILE_ID_CACHE_SIZE = 100_000
+
+
+def available() -> bool:
+    # сами chess.svg и cairosvg импортируются при первой отрисовке, не на старте бота
+    return "cairosvg" in sys.modules or importlib.util.find_spec("cairosvg") is not None
+
+
+def image_key(fen: str):
+    """(расстановка, сторона снизу): счётчики ходов на картинку не влияют."""
+    placement, turn = fen.split()[:2]
+    return placement, turn == "w"
+
+
+def render_svg(placement: str, white_bottom: bool) -> str:
+    import chess.svg
+
+    board = chess.BaseBoard(placement)
+    return chess.svg.board(board, orientation=chess.WHITE if white_bottom else chess.BLACK, size=IMAGE_SIZE)
+
+
+def render_png(placement: str, white_bottom: bool) -> bytes:
+    import cairosvg
+
+    return cairosvg.svg2png(bytestring=render_svg(placement, white_bottom).encode("utf-8"))
+
+
+class BoardImages:
+    """PNG доски по FEN: из file_id, из кэша или отрисовка в пуле потоков."""
+
+    def __init__(self, workers=2, max_size=CACHE_SIZE):
+        self.max_size = max_size
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="board-render")
+        self._images = OrderedDict()
+        # одна позиция, запрошенная несколькими игроками сразу, рисуется один раз
+        self._rendering = {}
+        self._file_ids = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    async def photo(self, fen: str):
+        """file_id, если картинка уже была в Telegram, иначе байты PNG."""
+        key = image_key(fen)
+        file_id = self._file_ids.get(key)
+        if file_id is not None:
+            self.hits += 1
+            self._file_ids.move_to_end(key)
+            return file_id
+
+        image = self._images.get(key)
+        if image is not None:
+            self.hits += 1
+            self._images.move_to_end(key)
+            return image
+
+        self.misses += 1
+        future = self._rendering.get(key)
+        if future is None:
+            loop = asyncio.get_running_loop()
+            future = self._rendering[key] = loop.run_in_executor(self._pool, render_png, *key)
+        try:
+            image = await future
+        finally:
+            self._rendering.pop(key, None)
+        self._images[key] = image
+        while len(self._images) > self.max_size:
+            self._images.popitem(last=False)
+        return image
+
+    def remember(self, fen: str, message):
+        """Запоминает file_id отправленного фото; байты больше не нужны."""
+        if not message or not message.photo:
+            return
+        key = image_key(fen)
+        self._file_ids[key] = message.photo[-1].file_id
+        self._images.pop(key, None)
+        while len(self._file_ids) > FILE_ID_CACHE_SIZE:
+            self._file_ids.popitem(last=False)
+
+    def close(self):
+        self._pool.shutdown(wait=False)
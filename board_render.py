@@ -0,0 +1,113 @@
+from collections import OrderedDict
+
+HIDDEN_TEXT = "Доска скрыта. Нажмите 'Показать доску', чтобы увидеть позицию."
+IMAGE_TEXT = "Доска - на картинке ниже."
+PROMPT_TEXT = "Введите ваш ход:"
+
+CACHE_SIZE = 50_000
+
+# (id задачи, уровень, полуход, доска показана) -> готовый текст сообщения
+_messages = OrderedDict()
+hits = 0
+misses = 0
+
+
+def ascii_board(fen: str) -> str:
+    """Доска как str(chess.Board), но прямо из FEN; за чёрных - перевёрнута."""
+    placement, turn = fen.split()[:2]
+    rows = []
+    for row in placement.split("/"):
+        squares = []
+        for c in row:
+            if c.isdigit():
+                squares.extend("." * int(c))
+            else:
+                squares.append(c)
+        rows.append(" ".join(squares))
+    text = "\n".join(rows)
+    return text[::-1] if turn == "b" else text
+
+
+def puzzle_header(task_data) -> str:
+    solution = task_data["solution"]
+    condition = task_data["condition"]
+    total_moves = len(solution)
+    color = "белые" if task_data["line"].fens[0].split()[1] == "w" else "чёрные"
+
+    moves_needed = (total_moves + 1) // 2
+    if "Мат в" in condition:
+        moves_text = condition
+    elif moves_needed == 1:
+        moves_text = "1 ход"
+    else:
+        moves_text = f"{moves_needed} ходов"
+
+    rating = task_data.get("rating")
+    rating_text = f"\nРейтинг задачи: {rating}" if rating else ""
+
+    return (
+        f"Уровень: {task_data['level']}\n"
+        f"Условие: {condition}\n"
+        f"Ходят: {color}\n"
+        f"Всего ходов в решении: {total_moves} ({moves_text})"
+        f"{rating_text}"
+    )
+
+
+def puzzle_message(task_data, shown: bool, image: bool = False) -> str:
+    """Текст сообщения задачи с доской или без, из кэша по (задача, полуход).
+
+    image - доска показана отдельной картинкой (board_image), в тексте её нет.
+    """
+    global hits, misses
+
+    line = task_data["line"]
+    ply = min(task_data["current_move"], len(line.fens) - 1)
+    key = (task_data["id"], task_data["level"], ply, shown, image)
+
+    text = _messages.get(key)
+    if text is not None:
+        hits += 1
+        _messages.move_to_end(key)
+        return text
+
+    misses += 1
+    if not shown:
+        body = HIDDEN_TEXT
+    else:
+        body = IMAGE_TEXT if image else ascii_board(line.fens[ply])
+    text = f"{puzzle_header(task_data)}\n\n{body}\n\n{PROMPT_TEXT}"
+    _messages[key] = text
+    if len(_messages) > CACHE_SIZE:
+        _messages.popitem(last=False)
+    return text
+
+
+def format_clock(seconds: float) -> str:
+    seconds = max(0, int(seconds))
+    return f"{seconds // 60}:{seconds % 60:02d}"
+
+
+def game_message(task_data, shown: bool, image: bool = False) -> str:
+    """Текст сообщения партии с ботом; позиции не повторяются, кэш не нужен."""
+    board = task_data["board"]
+    color = "белыми" if task_data["white"] else "чёрными"
+    lines = [
+        f"Партия с ботом. Вы играете {color}.",
+        f"Ход {board.fullmove_number}, ваши часы: {format_clock(task_data['clock'])}",
+    ]
+    if task_data["moves"]:
+        last = board.copy(stack=1)
+        move = last.pop()
+        lines.append(f"Последний ход бота: {last.san(move)}")
+
+    if not shown:
+        body = HIDDEN_TEXT
+    else:
+        body = IMAGE_TEXT if image else ascii_board(task_data["fen"])
+    return "\n".join(lines) + f"\n\n{body}\n\n{PROMPT_TEXT}"
+
+
+def hit_rate() -> float:
+    total = hits + misses
+    return hits / total if total else 0.0
@@ -0,0 +1,108 @@
+"""Считает другие правильные ходы игрока и пишет их в alternatives.txt.
+
+    python build_alternatives.py puzzles_data.json
+    python build_alternatives.py lichess_db_puzzle.csv.zst --workers 8 -o alternatives.txt
+
+На каждом ходе игрока, кроме хода решения, засчитываются:
+  mate - ход, который сразу ставит мат: задача решена;
+  line - ход, который после ответа соперника из решения приводит в ту же
+         позицию (перестановка ходов): задача идёт дальше по решению.
+
+Бот только ищет ход в таблице, перебора во время игры нет. Строка файла:
+id<TAB>полуход<TAB>ход UCI<TAB>вид.
+"""
+import argparse
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+
+import chess
+
+from puzzle_loader import iter_records
+from solution_table import ALT_LINE, ALT_MATE, ALTERNATIVES_FILE
+
+
+def _position(board):
+    # без счётчиков ходов: перестановка могла сбросить правило 50 ходов
+    return board.fen().rsplit(" ", 2)[0]
+
+
+def record_alternatives(record):
+    """[(id, полуход, ход, вид)] для одной задачи."""
+    try:
+        board = chess.Board(record.fen)
+        moves = [chess.Move.from_uci(uci) for uci in record.moves.split()]
+    except ValueError:
+        return []
+
+    found = []
+    # ходы игрока - чётные полуходы решения, ответы соперника - нечётные
+    for ply, move in enumerate(moves):
+        if move not in board.legal_moves:
+            break
+        if ply % 2 == 0:
+            reply = moves[ply + 1] if ply + 1 < len(moves) else None
+            if reply is not None:
+                board.push(move)
+                board.push(reply)
+                target = _position(board)
+                board.pop()
+                board.pop()
+
+            for other in board.legal_moves:
+                if other == move:
+                    continue
+                board.push(other)
+                if board.is_checkmate():
+                    found.append((record.puzzle_id, ply, other.uci(), ALT_MATE))
+                elif reply is not None and board.is_legal(reply):
+                    board.push(reply)
+                    if _position(board) == target:
+                        found.append((record.puzzle_id, ply, other.uci(), ALT_LINE))
+                    board.pop()
+                board.pop()
+        board.push(move)
+    return found
+
+
+def alternatives_batch(records):
+    return [item for record in records for item in record_alternatives(record)]
+
+
+def build(sources, workers=None, batch_size=1024):
+    records = (record for source in sources for record in iter_records(source))
+    workers = workers or os.cpu_count()
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        # как в validate_puzzles: ограниченное число пачек в работе
+        pending = deque()
+        while True:
+            while len(pending) < workers * 2:
+                batch = list(islice(records, batch_size))
+                if not batch:
+                    break
+                pending.append(pool.submit(alternatives_batch, batch))
+            if not pending:
+                break
+            yield from pending.popleft().result()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Другие правильные ходы в задачах")
+    parser.add_argument("sources", nargs="+", help=".json, .jsonl, .csv или .csv.zst")
+    parser.add_argument("-o", "--output", default=ALTERNATIVES_FILE)
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    args = parser.parse_args()
+
+    count = 0
+    with open(args.output, "w", encoding="utf-8") as f:
+        for puzzle_id, ply, uci, kind in build(args.sources, args.workers):
+            f.write(f"{puzzle_id}\t{ply}\t{uci}\t{kind}\n")
+            count += 1
+
+    print(f"Других ходов: {count}, записаны в {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+"""Собирает бинарный файл задач для BinaryPuzzleStore.
+
+    python build_puzzles.py puzzles_data.json -o puzzles.bin
+    python build_puzzles.py lichess_db_puzzle.csv.zst -o puzzles.bin
+"""
+import argparse
+import json
+
+from puzzle_binary import (
+    HEADER, MAGIC, MAX_MOVES, MAX_THEMES, ROW, VERSION, pack_fen, pack_move,
+)
+from puzzle_loader import (
+    QUARANTINE_FILE, iter_records, load_quarantine, puzzle_condition, puzzle_level,
+)
+from puzzle_store import dataset_fingerprint
+
+LEVELS = ["Средняя", "Сложная", "Очень сложная"]
+
+
+def build(sources, output, skip=None):
+    themes = {}
+    conditions = {}
+    rows = []
+    skipped = 0
+
+    for source in sources:
+        for record in iter_records(source, skip):
+            moves = record.moves.split()
+            record_themes = record.themes.split()
+            if len(moves) > MAX_MOVES:
+                skipped += 1
+                continue
+
+            mask = 0
+            for theme in record_themes:
+                if theme not in themes:
+                    if len(themes) == MAX_THEMES:
+                        raise ValueError(f"больше {MAX_THEMES} тем, формат их не вместит")
+                    themes[theme] = len(themes)
+                mask |= 1 << themes[theme]
+
+            # условие считается один раз здесь, а не при каждом запуске бота
+            condition = puzzle_condition(record_themes, len(moves))
+            condition_id = conditions.setdefault(condition, len(conditions))
+            level_id = LEVELS.index(puzzle_level(record.rating))
+
+            codes = [pack_move(move) for move in moves]
+            codes += [0] * (MAX_MOVES - len(codes))
+            row = ROW.pack(
+                record.puzzle_id.encode("ascii"), *pack_fen(record.fen), len(moves),
+                record.rating, level_id, condition_id,
+                mask & (2 ** 64 - 1), mask >> 64, *codes,
+            )
+            rows.append((level_id, record.rating, record.puzzle_id, row))
+
+    rows.sort(key=lambda item: (item[0], item[1]))
+
+    level_ranges = {}
+    for i, (level_id, _, _, _) in enumerate(rows):
+        start, _ = level_ranges.get(LEVELS[level_id], (i, i))
+        level_ranges[LEVELS[level_id]] = (start, i + 1)
+
+    meta = json.dumps({
+        "themes": list(themes),
+        "conditions": list(conditions),
+        "levels": LEVELS,
+        "level_ranges": level_ranges,
+        "fingerprint": dataset_fingerprint(puzzle_id for _, _, puzzle_id, _ in rows),
+    }, ensure_ascii=False).encode("utf-8")
+
+    with open(output, "wb") as f:
+        f.write(HEADER.pack(MAGIC, VERSION, ROW.size, len(rows), len(meta)))
+        f.write(meta)
+        for _, _, _, row in rows:
+            f.write(row)
+
+    return len(rows), skipped
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Сборка бинарного файла задач")
+    parser.add_argument("sources", nargs="+", help=".json, .jsonl, .csv или .csv.zst")
+    parser.add_argument("-o", "--output", default="puzzles.bin")
+    parser.add_argument("--quarantine", default=QUARANTINE_FILE,
+                        help="список сломанных задач от validate_puzzles.py")
+    args = parser.parse_args()
+
+    count, skipped = build(args.sources, args.output, load_quarantine(args.quarantine))
+    print(f"Записано {count} задач в {args.output}")
+    if skipped:
+        print(f"Пропущено {skipped} задач длиннее {MAX_MOVES} ходов")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,157 @@
+import asyncio
+import os
+import zlib
+
+from sqlalchemy import Boolean, Column, Float, Integer, LargeBinary, String, UniqueConstraint, event, inspect, text
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.orm import DeclarativeBase
+
+DATABASE_URL = os.environ.get("DATABASE_URL", "sqlite+aiosqlite:///user_progress.db")
+
+
+class Base(DeclarativeBase):
+    pass
+
+
+# общий пул соединений на весь бот, запросы не блокируют цикл событий
+# timeout - сколько ждать блокировку, если пишет другой процесс (режим sharded)
+engine = create_async_engine(
+    DATABASE_URL, echo=False, pool_size=5, max_overflow=10, connect_args={"timeout": 30},
+)
+Session = async_sessionmaker(engine, expire_on_commit=False)
+
+# INSERT ... ON CONFLICT у sqlite и postgresql - разные конструкции
+# SQLAlchemy; выбираем ту, что соответствует DATABASE_URL
+try:
+    insert = {"sqlite": sqlite.insert, "postgresql": postgresql.insert}[engine.dialect.name]
+except KeyError:
+    raise RuntimeError(f"СУБД {engine.dialect.name} не поддерживается: нужны sqlite или postgresql") from None
+
+# sqlite пускает одного писателя; параллельные транзакции из пула не ждут
+# друг друга, а падают с "database is locked", поэтому пишем по очереди
+write_lock = asyncio.Lock()
+
+
+@event.listens_for(engine.sync_engine, "connect")
+def _sqlite_pragmas(dbapi_connection, connection_record):
+    if engine.dialect.name != "sqlite":
+        return
+    # WAL: чтение не ждёт записи, а fsync реже
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.close()
+
+
+class User(Base):
+    __tablename__ = 'users'
+
+    id = Column(Integer, primary_key=True)
+    telegram_id = Column(Integer, unique=True, nullable=False, index=True)
+    username = Column(String, nullable=True)
+    solved_count = Column(Integer, default=0)
+    total_rating = Column(Integer, default=0)
+    current_level = Column(String, default="Средняя")
+    rating = Column(Float, default=1500.0)
+    rating_deviation = Column(Float, default=350.0)
+    # индексы показанных и решённых задач, SeenBitmap.to_bytes()
+    seen_puzzles = Column(LargeBinary, nullable=True)
+    solved_puzzles = Column(LargeBinary, nullable=True)
+    # отпечаток набора задач, к индексам которого относятся карты
+    puzzles_fingerprint = Column(String, nullable=True)
+    # time.time() последней записи строки: таблица лидеров дочитывает только изменённое
+    updated_at = Column(Float, nullable=True, index=True)
+
+
+class FailedPuzzle(Base):
+    """Нерешённая задача, которая вернётся к игроку по расписанию повторений."""
+    __tablename__ = 'failed_puzzles'
+    __table_args__ = (UniqueConstraint("telegram_id", "puzzle_id"),)
+
+    id = Column(Integer, primary_key=True)
+    telegram_id = Column(Integer, nullable=False)
+    puzzle_id = Column(String, nullable=False)
+    # индекс в хранилище задач; сверяется с puzzle_id при выдаче
+    puzzle = Column(Integer, nullable=False)
+    # ступень расписания (review.REVIEW_DAYS) и когда показать снова, unix-время
+    step = Column(Integer, default=0)
+    due_at = Column(Float, nullable=False)
+
+
+class Solve(Base):
+    """Первый исход каждой выданной задачи: история для выгрузки (export_solves.py)."""
+    __tablename__ = 'solves'
+
+    id = Column(Integer, primary_key=True)
+    telegram_id = Column(Integer, nullable=False)
+    puzzle_id = Column(String, nullable=False)
+    level = Column(String, nullable=False)
+    # рейтинг задачи и рейтинг игрока после исхода
+    puzzle_rating = Column(Integer, nullable=False)
+    user_rating = Column(Float, nullable=False)
+    solved = Column(Boolean, nullable=False)
+    # unix-время
+    created_at = Column(Float, nullable=False)
+
+
+class SolveStat(Base):
+    """Счётчики игрока по уровню или теме, растут вместе с solves."""
+    __tablename__ = 'solve_stats'
+    __table_args__ = (UniqueConstraint("telegram_id", "category", "name"),)
+
+    id = Column(Integer, primary_key=True)
+    telegram_id = Column(Integer, nullable=False)
+    # "level" или "theme"
+    category = Column(String, nullable=False)
+    name = Column(String, nullable=False)
+    attempts = Column(Integer, default=0)
+    solved = Column(Integer, default=0)
+
+
+# столбцы, добавленные после первой версии базы: (таблица, столбец, DDL)
+MIGRATIONS = [
+    ("users", "rating", "ALTER TABLE users ADD COLUMN rating FLOAT DEFAULT 1500.0"),
+    ("users", "rating_deviation", "ALTER TABLE users ADD COLUMN rating_deviation FLOAT DEFAULT 350.0"),
+    ("users", "seen_puzzles", "ALTER TABLE users ADD COLUMN seen_puzzles BLOB"),
+    ("users", "solved_puzzles", "ALTER TABLE users ADD COLUMN solved_puzzles BLOB"),
+    ("users", "puzzles_fingerprint", "ALTER TABLE users ADD COLUMN puzzles_fingerprint VARCHAR"),
+    ("users", "updated_at", "ALTER TABLE users ADD COLUMN updated_at FLOAT"),
+]
+
+
+def _migrate(sync_conn):
+    inspector = inspect(sync_conn)
+    for table, column, ddl in MIGRATIONS:
+        if column not in {item["name"] for item in inspector.get_columns(table)}:
+            sync_conn.execute(text(ddl))
+    # create_all строит индексы только вместе с таблицей
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(sync_conn, checkfirst=True)
+
+
+def _schema_version():
+    """Номер схемы по таблицам и столбцам моделей: меняется вместе с ними."""
+    schema = sorted((table.name, sorted(table.columns.keys())) for table in Base.metadata.tables.values())
+    return zlib.crc32(repr(schema).encode()) & 0x7FFFFFFF
+
+
+SCHEMA_VERSION = _schema_version()
+
+
+async def init_db():
+    async with engine.begin() as conn:
+        # в sqlite номер схемы хранится в PRAGMA user_version: если модели не
+        # менялись с прошлого запуска, таблицы и столбцы заново не сверяем
+        sqlite = engine.dialect.name == "sqlite"
+        if sqlite and (await conn.exec_driver_sql("PRAGMA user_version")).scalar() == SCHEMA_VERSION:
+            return
+        await conn.run_sync(Base.metadata.create_all)
+        await conn.run_sync(_migrate)
+        if sqlite:
+            await conn.exec_driver_sql(f"PRAGMA user_version = {SCHEMA_VERSION}")
+
+
+async def close_db():
+    await engine.dispose()
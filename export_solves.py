@@ -0,0 +1,114 @@
+"""Выгружает историю исходов задач (таблица solves) в CSV или Parquet.
+
+    python export_solves.py -o solves.csv
+    python export_solves.py -o solves.csv.gz --since 2024-01-01
+    python export_solves.py -o solves.parquet --user 123456789
+
+Строки читаются из базы потоком и пишутся пачками, так что память не
+зависит от размера истории. Для Parquet нужен pyarrow (pip install pyarrow).
+"""
+import argparse
+import asyncio
+import csv
+import gzip
+from datetime import datetime, timezone
+
+from sqlalchemy import select
+
+from db import Solve, close_db, engine
+
+COLUMNS = ["telegram_id", "puzzle_id", "level", "puzzle_rating", "user_rating", "solved", "created_at"]
+BATCH_SIZE = 10_000
+
+
+def _open_csv(path):
+    if path.endswith(".gz"):
+        return gzip.open(path, "wt", encoding="utf-8", newline="")
+    return open(path, "w", encoding="utf-8", newline="")
+
+
+class CsvSink:
+    def __init__(self, path):
+        self._file = _open_csv(path)
+        self._writer = csv.writer(self._file)
+        self._writer.writerow(COLUMNS)
+
+    def write(self, rows):
+        self._writer.writerows(rows)
+
+    def close(self):
+        self._file.close()
+
+
+class ParquetSink:
+    def __init__(self, path):
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise RuntimeError("для Parquet нужен пакет pyarrow")
+        self._pa = pa
+        self._schema = pa.schema([
+            ("telegram_id", pa.int64()),
+            ("puzzle_id", pa.string()),
+            ("level", pa.string()),
+            ("puzzle_rating", pa.int32()),
+            ("user_rating", pa.float64()),
+            ("solved", pa.bool_()),
+            ("created_at", pa.float64()),
+        ])
+        self._writer = pq.ParquetWriter(path, self._schema)
+
+    def write(self, rows):
+        # каждая пачка - отдельная группа строк в файле
+        columns = list(zip(*rows))
+        self._writer.write_table(self._pa.Table.from_arrays(
+            [self._pa.array(column, type=field.type) for column, field in zip(columns, self._schema)],
+            schema=self._schema,
+        ))
+
+    def close(self):
+        self._writer.close()
+
+
+async def export(path, since=None, telegram_id=None, batch_size=BATCH_SIZE):
+    query = select(*(getattr(Solve, name) for name in COLUMNS)).order_by(Solve.id)
+    if since is not None:
+        query = query.where(Solve.created_at >= since)
+    if telegram_id is not None:
+        query = query.where(Solve.telegram_id == telegram_id)
+
+    sink = ParquetSink(path) if path.endswith(".parquet") else CsvSink(path)
+    count = 0
+    try:
+        async with engine.connect() as conn:
+            result = await conn.stream(query.execution_options(yield_per=batch_size))
+            async for rows in result.partitions(batch_size):
+                sink.write(rows)
+                count += len(rows)
+    finally:
+        sink.close()
+        await close_db()
+    return count
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Выгрузка истории исходов задач")
+    parser.add_argument("-o", "--output", default="solves.csv", help=".csv, .csv.gz или .parquet")
+    parser.add_argument("--since", help="дата YYYY-MM-DD (UTC), с которой выгружать")
+    parser.add_argument("--user", type=int, help="telegram_id игрока")
+    args = parser.parse_args()
+
+    since = None
+    if args.since:
+        since = datetime.strptime(args.since, "%Y-%m-%d").replace(tzinfo=timezone.utc).timestamp()
+
+    try:
+        count = asyncio.run(export(args.output, since, args.user))
+    except RuntimeError as e:
+        parser.exit(1, f"Ошибка: {e}\n")
+    print(f"Выгружено строк: {count}, файл {args.output}")
+
+
+if __name__ == "__main__":
+    main()
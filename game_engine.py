@@ -0,0 +1,290 @@
+"""Соперник для партии вслепую (/play).
+
+Ход ищет UCI-движок (GAME_ENGINE=/usr/bin/stockfish) или встроенный
+перебор: альфа-бета с итеративным углублением, таблицей транспозиций и
+форсированными взятиями на концах. Поиск ограничен временем и числом
+узлов на ход.
+
+Считают ходы процессы EnginePool: они запускаются при первой партии и
+обслуживают всех игроков, UCI-движок открывается в каждом процессе один
+раз. Цикл событий бота только ждёт результат.
+"""
+import asyncio
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import chess
+import chess.engine
+import chess.polyglot
+
+MATE = 100_000
+INF = 1_000_000
+# записей в таблице транспозиций процесса; при переполнении она очищается
+TT_SIZE = 500_000
+MAX_DEPTH = 32
+
+PIECE_VALUES = {
+    chess.PAWN: 100, chess.KNIGHT: 320, chess.BISHOP: 330,
+    chess.ROOK: 500, chess.QUEEN: 900, chess.KING: 0,
+}
+
+# бонусы за поле для белых, a1 = 0; для чёрных поле отражается
+_PST = {
+    chess.PAWN: (
+        0, 0, 0, 0, 0, 0, 0, 0,
+        5, 10, 10, -20, -20, 10, 10, 5,
+        5, -5, -10, 0, 0, -10, -5, 5,
+        0, 0, 0, 20, 20, 0, 0, 0,
+        5, 5, 10, 25, 25, 10, 5, 5,
+        10, 10, 20, 30, 30, 20, 10, 10,
+        50, 50, 50, 50, 50, 50, 50, 50,
+        0, 0, 0, 0, 0, 0, 0, 0,
+    ),
+    chess.KNIGHT: (
+        -50, -40, -30, -30, -30, -30, -40, -50,
+        -40, -20, 0, 5, 5, 0, -20, -40,
+        -30, 5, 10, 15, 15, 10, 5, -30,
+        -30, 0, 15, 20, 20, 15, 0, -30,
+        -30, 5, 15, 20, 20, 15, 5, -30,
+        -30, 0, 10, 15, 15, 10, 0, -30,
+        -40, -20, 0, 0, 0, 0, -20, -40,
+        -50, -40, -30, -30, -30, -30, -40, -50,
+    ),
+    chess.BISHOP: (
+        -20, -10, -10, -10, -10, -10, -10, -20,
+        -10, 5, 0, 0, 0, 0, 5, -10,
+        -10, 10, 10, 10, 10, 10, 10, -10,
+        -10, 0, 10, 10, 10, 10, 0, -10,
+        -10, 5, 5, 10, 10, 5, 5, -10,
+        -10, 0, 5, 10, 10, 5, 0, -10,
+        -10, 0, 0, 0, 0, 0, 0, -10,
+        -20, -10, -10, -10, -10, -10, -10, -20,
+    ),
+    chess.ROOK: (
+        0, 0, 0, 5, 5, 0, 0, 0,
+        -5, 0, 0, 0, 0, 0, 0, -5,
+        -5, 0, 0, 0, 0, 0, 0, -5,
+        -5, 0, 0, 0, 0, 0, 0, -5,
+        -5, 0, 0, 0, 0, 0, 0, -5,
+        -5, 0, 0, 0, 0, 0, 0, -5,
+        5, 10, 10, 10, 10, 10, 10, 5,
+        0, 0, 0, 0, 0, 0, 0, 0,
+    ),
+    chess.QUEEN: (
+        -20, -10, -10, -5, -5, -10, -10, -20,
+        -10, 0, 5, 0, 0, 0, 0, -10,
+        -10, 5, 5, 5, 5, 5, 0, -10,
+        0, 0, 5, 5, 5, 5, 0, -5,
+        -5, 0, 5, 5, 5, 5, 0, -5,
+        -10, 0, 5, 5, 5, 5, 0, -10,
+        -10, 0, 0, 0, 0, 0, 0, -10,
+        -20, -10, -10, -5, -5, -10, -10, -20,
+    ),
+    chess.KING: (
+        20, 30, 10, 0, 0, 10, 30, 20,
+        20, 20, 0, 0, 0, 0, 20, 20,
+        -10, -20, -20, -20, -20, -20, -20, -10,
+        -20, -30, -30, -40, -40, -30, -30, -20,
+        -30, -40, -40, -50, -50, -40, -40, -30,
+        -30, -40, -40, -50, -50, -40, -40, -30,
+        -30, -40, -40, -50, -50, -40, -40, -30,
+        -30, -40, -40, -50, -50, -40, -40, -30,
+    ),
+}
+
+# (фигура, цвет) -> вес по полям, чтобы оценка была одним проходом
+_SQUARE_VALUES = {}
+for _piece, _table in _PST.items():
+    _SQUARE_VALUES[_piece, chess.WHITE] = tuple(PIECE_VALUES[_piece] + v for v in _table)
+    _SQUARE_VALUES[_piece, chess.BLACK] = tuple(
+        PIECE_VALUES[_piece] + _table[chess.square_mirror(sq)] for sq in chess.SQUARES)
+
+# таблица транспозиций: ключ Zobrist -> (глубина, оценка, граница, лучший ход)
+EXACT, LOWER, UPPER = 0, 1, 2
+_tt = {}
+
+# процесс пула: UCI-движок, если задан
+_engine = None
+
+
+class _Budget(Exception):
+    """Кончились время или узлы - поиск текущей глубины прерывается."""
+
+
+def evaluate(board: chess.Board) -> int:
+    """Оценка в сантипешках с точки зрения стороны, которая ходит."""
+    score = 0
+    for square, piece in board.piece_map().items():
+        value = _SQUARE_VALUES[piece.piece_type, piece.color][square]
+        score += value if piece.color == chess.WHITE else -value
+    return score if board.turn == chess.WHITE else -score
+
+
+def _ordered(board, moves, first=None):
+    """Сначала ход из таблицы, потом взятия (ценная жертва, дешёвый нападающий)."""
+    def key(move):
+        if move == first:
+            return -INF
+        victim = board.piece_type_at(move.to_square)
+        if victim is None:
+            return 0 if move.promotion is None else -PIECE_VALUES[move.promotion]
+        return -10 * PIECE_VALUES[victim] + PIECE_VALUES[board.piece_type_at(move.from_square)] // 10
+
+    return sorted(moves, key=key)
+
+
+class Search:
+    def __init__(self, board: chess.Board, max_time: float, max_nodes: int):
+        self.board = board
+        self.deadline = time.monotonic() + max_time
+        self.max_nodes = max_nodes
+        self.nodes = 0
+        self.root_stack = len(board.move_stack)
+
+    def _tick(self):
+        self.nodes += 1
+        if self.nodes >= self.max_nodes or (self.nodes & 255 == 0 and time.monotonic() >= self.deadline):
+            raise _Budget
+
+    def quiesce(self, alpha, beta):
+        self._tick()
+        board = self.board
+        stand_pat = evaluate(board)
+        if stand_pat >= beta:
+            return stand_pat
+        alpha = max(alpha, stand_pat)
+        for move in _ordered(board, board.generate_legal_captures()):
+            board.push(move)
+            score = -self.quiesce(-beta, -alpha)
+            board.pop()
+            if score >= beta:
+                return score
+            alpha = max(alpha, score)
+        return alpha
+
+    def negamax(self, depth, alpha, beta, ply):
+        self._tick()
+        board = self.board
+        if ply and (board.halfmove_clock >= 100 or board.is_repetition(2)):
+            return 0
+
+        key = chess.polyglot.zobrist_hash(board)
+        entry = _tt.get(key)
+        tt_move = None
+        if entry is not None:
+            tt_depth, tt_score, bound, tt_move = entry
+            if ply and tt_depth >= depth:
+                if bound == EXACT:
+                    return tt_score
+                if bound == LOWER and tt_score >= beta:
+                    return tt_score
+                if bound == UPPER and tt_score <= alpha:
+                    return tt_score
+
+        moves = list(board.legal_moves)
+        if not moves:
+            return -MATE + ply if board.is_check() else 0
+        if depth <= 0:
+            return self.quiesce(alpha, beta)
+
+        original_alpha = alpha
+        best, best_move = -INF, None
+        for move in _ordered(board, moves, tt_move):
+            board.push(move)
+            score = -self.negamax(depth - 1, -beta, -alpha, ply + 1)
+            board.pop()
+            if score > best:
+                best, best_move = score, move
+            alpha = max(alpha, score)
+            if alpha >= beta:
+                break
+
+        bound = UPPER if best <= original_alpha else LOWER if best >= beta else EXACT
+        if len(_tt) >= TT_SIZE:
+            _tt.clear()
+        _tt[key] = (depth, best, bound, best_move)
+        return best
+
+    def best_move(self) -> chess.Move:
+        """Итеративное углубление: ход последней глубины, просчитанной целиком."""
+        best = None
+        for depth in range(1, MAX_DEPTH + 1):
+            try:
+                score = self.negamax(depth, -INF, INF, 0)
+            except _Budget:
+                # прерванный поиск мог оставить позицию не в корне
+                while len(self.board.move_stack) > self.root_stack:
+                    self.board.pop()
+                break
+            best = _tt[chess.polyglot.zobrist_hash(self.board)][3]
+            # мат найден, глубже искать нечего
+            if abs(score) >= MATE - MAX_DEPTH:
+                break
+        return best
+
+
+def _board(start_fen: str, moves) -> chess.Board:
+    # доска с историей: без неё не видно повторений позиции
+    board = chess.Board(start_fen)
+    for uci in moves:
+        board.push(chess.Move.from_uci(uci))
+    return board
+
+
+def search(board: chess.Board, max_time: float, max_nodes: int) -> chess.Move:
+    move = Search(board, max_time, max_nodes).best_move()
+    # бюджета не хватило даже на первую глубину
+    return move or _ordered(board, list(board.legal_moves))[0]
+
+
+def _init_worker(engine_path):
+    global _engine
+    if engine_path:
+        import atexit
+
+        _engine = chess.engine.SimpleEngine.popen_uci(engine_path)
+        atexit.register(_engine.quit)
+
+
+def think(start_fen: str, moves, max_time: float, max_nodes: int) -> str:
+    """Ход после moves (UCI) из start_fen, тоже в UCI; выполняется в процессе пула."""
+    board = _board(start_fen, moves)
+    if _engine is not None:
+        # движку уходят начальная позиция и ходы, а не только последний FEN
+        result = _engine.play(board, chess.engine.Limit(time=max_time, nodes=max_nodes))
+        return result.move.uci()
+    return search(board, max_time, max_nodes).uci()
+
+
+class EnginePool:
+    """Общий на всех игроков пул процессов, считающих ходы бота."""
+
+    def __init__(self, workers=1, engine_path=None, move_time=1.0, move_nodes=50_000):
+        self.workers = workers
+        self.engine_path = engine_path
+        self.move_time = move_time
+        self.move_nodes = move_nodes
+        self._pool = None
+
+    def _executor(self):
+        if self._pool is None:
+            # spawn: форк процесса бота с его потоками и соединениями ненадёжен
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_worker,
+                initargs=(self.engine_path,),
+            )
+        return self._pool
+
+    async def best_move(self, start_fen: str, moves) -> chess.Move:
+        loop = asyncio.get_running_loop()
+        uci = await loop.run_in_executor(self._executor(), think, start_fen, list(moves),
+                                         self.move_time, self.move_nodes)
+        return chess.Move.from_uci(uci)
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
@@ -0,0 +1,140 @@
+"""Таблица лидеров по рейтингу для /top.
+
+Все игроки с рейтингом лежат в памяти в отсортированном списке, поэтому
+первая десятка и место игрока считаются без запросов к базе. Целиком
+список читается из базы один раз при старте. В режиме sharded у каждого
+воркера своя копия: раз в refresh_interval секунд он дочитывает строки,
+изменённые с прошлого чтения (users.updated_at), чтобы увидеть игроков
+других воркеров.
+"""
+import asyncio
+import time
+from bisect import bisect_left, insort
+
+from sqlalchemy import select
+
+from db import User
+from rating import START_DEVIATION
+
+# запас на метки updated_at, поставленные раньше коммита: пачка могла
+# ждать блокировку базы (timeout в db.py) и закоммититься позже
+CLOCK_SLACK = 60
+# столько изменений за раз переставляются по одному, больше - пересортировка
+RESORT_CHANGES = 256
+
+
+class Leaderboard:
+    def __init__(self, session_factory, writer, refresh_interval=0):
+        self.session_factory = session_factory
+        # StatsWriter: рейтинг, который он ещё не записал, свежее строки из базы
+        self.writer = writer
+        self.refresh_interval = refresh_interval
+        # (-рейтинг, telegram_id) по возрастанию - лучшие в начале
+        self._order = []
+        # telegram_id -> его ключ в _order
+        self._keys = {}
+        self._names = {}
+        # игроки, чей рейтинг менялся в этом процессе и мог ещё не дойти до базы
+        self._local = set()
+        # time.time() начала последнего удачного чтения; None - читать всё
+        self._loaded_at = None
+        self._task = None
+
+    def __len__(self):
+        return len(self._order)
+
+    async def load(self):
+        """Игроки, сыгравшие хотя бы одну задачу на рейтинг.
+
+        Первый вызов читает всех, следующие - только изменённые строки.
+        """
+        started = time.time()
+        query = select(User.telegram_id, User.username, User.rating, User.rating_deviation)
+        if self._loaded_at is None:
+            query = query.where(User.rating_deviation < START_DEVIATION)
+        else:
+            query = query.where(User.updated_at >= self._loaded_at - CLOCK_SLACK)
+        generation = self.writer.generation
+        flushing = self.writer.flushing
+        async with self.session_factory() as session:
+            rows = (await session.execute(query)).all()
+        # пока читали, пачка могла уйти в базу: тогда строки могли устареть
+        settled = not flushing and not self.writer.flushing and self.writer.generation == generation
+
+        changes = {}
+        for telegram_id, username, rating, deviation in rows:
+            # свои изменения, которые ещё не дошли до базы, не теряем
+            if telegram_id in self._local and not self._settled(telegram_id, settled):
+                continue
+            if deviation is not None and deviation < START_DEVIATION:
+                changes[telegram_id] = (-rating, telegram_id)
+                self._names[telegram_id] = username
+            else:
+                changes[telegram_id] = None
+                self._names.pop(telegram_id, None)
+        self._apply(changes)
+        self._local = {telegram_id for telegram_id in self._local if not self._settled(telegram_id, settled)}
+        self._loaded_at = started
+
+    def _settled(self, telegram_id, settled):
+        pending = self.writer.pending(telegram_id)
+        return settled and (pending is None or pending.rating is None)
+
+    def _apply(self, changes):
+        """Ставит новые ключи игроков; None - убрать из таблицы."""
+        if len(changes) > RESORT_CHANGES:
+            for telegram_id, key in changes.items():
+                if key is None:
+                    self._keys.pop(telegram_id, None)
+                else:
+                    self._keys[telegram_id] = key
+            self._order = sorted(self._keys.values())
+            return
+        for telegram_id, key in changes.items():
+            old = self._keys.pop(telegram_id, None)
+            if old is not None:
+                del self._order[bisect_left(self._order, old)]
+            if key is not None:
+                self._keys[telegram_id] = key
+                insort(self._order, key)
+
+    def update(self, telegram_id, username, rating):
+        self._apply({telegram_id: (-rating, telegram_id)})
+        self._names[telegram_id] = username
+        self._local.add(telegram_id)
+
+    def rank(self, telegram_id):
+        """Место игрока (с 1) или None, если он ещё не играл на рейтинг."""
+        key = self._keys.get(telegram_id)
+        if key is None:
+            return None
+        return bisect_left(self._order, key) + 1
+
+    def top(self, count=10):
+        """[(место, telegram_id, имя, рейтинг)] первых count игроков."""
+        return [
+            (place, telegram_id, self._names.get(telegram_id), -rating)
+            for place, (rating, telegram_id) in enumerate(self._order[:count], 1)
+        ]
+
+    async def start(self):
+        await self.load()
+        if self.refresh_interval:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.refresh_interval)
+            try:
+                await self.load()
+            except Exception as e:
+                print(f"Ошибка чтения таблицы лидеров: {e}")
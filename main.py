@@ -1,162 +1,159 @@
 from telegram.ext import Application, CommandHandler, MessageHandler, filters, CallbackQueryHandler
 from telegram import ReplyKeyboardMarkup, InlineKeyboardMarkup, InlineKeyboardButton, Update
+from telegram.error import TelegramError
 import chess
-import random
-from sqlalchemy import create_engine, Column, Integer, String, select
-from sqlalchemy.orm import DeclarativeBase, sessionmaker
 import json
+import os
+import time
+import board_image
+import board_render
+from attempt_log import AttemptLog
+from board_render import format_clock, game_message, puzzle_message
+from db import Session, close_db, engine, init_db
+from leaderboard import Leaderboard
+from metrics import ENGINE_MOVE_SECONDS, REGISTRY, MetricsServer, instrument_engine, timed
+import move_parser
+from move_parser import parse_board_move, parse_move
+from puzzle_binary import BinaryPuzzleStore
+from puzzle_loader import QUARANTINE_FILE, iter_records, load_quarantine
+import puzzle_snapshot
+from puzzle_store import PuzzleStore
+from rating import update as update_rating
+from review import ReviewScheduler
+from session_store import MemorySessionStore, SqliteSessionStore
+from solution_table import ALT_MATE, expected_move, load_alternatives
+from solve_stats import SolveStats
+from stats_writer import StatsWriter
+from throttle import GlobalRateLimiter, UserRateLimiter
+from user_cache import UserCache
 
 BOT_TOKEN = ""
 
+# polling (по умолчанию), webhook за локальным HTTP-сервером
+# или sharded - несколько процессов-обработчиков
+BOT_MODE = os.environ.get("BOT_MODE", "polling")
+WEBHOOK_URL = os.environ.get("WEBHOOK_URL", "")
+WEBHOOK_HOST = os.environ.get("WEBHOOK_HOST", "0.0.0.0")
+WEBHOOK_PORT = int(os.environ.get("WEBHOOK_PORT", "8443"))
+WEBHOOK_PATH = os.environ.get("WEBHOOK_PATH", "/telegram")
+WEBHOOK_SECRET = os.environ.get("WEBHOOK_SECRET") or None
+# сколько апдейтов обрабатывается одновременно в режиме webhook
+WEBHOOK_CONCURRENCY = int(os.environ.get("WEBHOOK_CONCURRENCY", "64"))
+# режим sharded: число процессов-обработчиков
+BOT_WORKERS = int(os.environ.get("BOT_WORKERS", str(os.cpu_count() or 1)))
+# апдейтов в секунду от одного пользователя (0 - без ограничения), размер
+# всплеска и сколько секунд апдейт может ждать, прежде чем его отбросят
+USER_RATE = float(os.environ.get("USER_RATE", "2"))
+USER_BURST = int(os.environ.get("USER_BURST", "5"))
+USER_MAX_DELAY = float(os.environ.get("USER_MAX_DELAY", "5"))
+# потолок запросов к Bot API в секунду на весь бот (0 - без ограничения)
+BOT_API_RATE = float(os.environ.get("BOT_API_RATE", "30"))
+# доска картинкой (нужен cairosvg), иначе текстом
+BOARD_IMAGES = os.environ.get("BOARD_IMAGES", "1") == "1" and board_image.available()
+# локальная страница /metrics для Prometheus; без порта не поднимается
+METRICS_HOST = os.environ.get("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.environ.get("METRICS_PORT", "0"))
+# партия с ботом (/play): UCI-движок (иначе встроенный перебор), число
+# процессов, считающих ходы, бюджет на ход бота, часы игрока и добавка за ход
+GAME_ENGINE = os.environ.get("GAME_ENGINE") or None
+GAME_WORKERS = int(os.environ.get("GAME_WORKERS", "1"))
+GAME_MOVE_TIME = float(os.environ.get("GAME_MOVE_TIME", "1.0"))
+GAME_MOVE_NODES = int(os.environ.get("GAME_MOVE_NODES", "50000"))
+GAME_CLOCK = float(os.environ.get("GAME_CLOCK", "900"))
+GAME_INCREMENT = float(os.environ.get("GAME_INCREMENT", "10"))
+# журнал попыток (attempt_log.py): каталог сегментов
+ATTEMPT_LOG_DIR = os.environ.get("ATTEMPT_LOG_DIR", "attempts")
 
-class Base(DeclarativeBase):
-    pass
-
-engine = create_engine('sqlite:///user_progress.db', echo=False)
-Session = sessionmaker(bind=engine)
-
-class User(Base):
-    __tablename__ = 'users'
-    
-    id = Column(Integer, primary_key=True)
-    telegram_id = Column(Integer, unique=True, nullable=False, index=True)
-    username = Column(String, nullable=True)
-    solved_count = Column(Integer, default=0)
-    total_rating = Column(Integer, default=0)
-    current_level = Column(String, default="Средняя")
-
-Base.metadata.create_all(engine)
 
 # клавиатурка
 reply_keyboard = [
-    ["/start", "/help", "/game", "/stats", "/reset"]
+    ["/start", "/help", "/game", "/play", "/stats", "/top", "/reset"]
 ]
 markup = ReplyKeyboardMarkup(reply_keyboard, resize_keyboard=True)
 
-active_games = {}
-
 # грузим задачке
+PUZZLES_FILE = 'puzzles_data.json'
+# собирается build_puzzles.py, если есть - берём его вместо json
+PUZZLES_BIN = 'puzzles.bin'
+# разобранный PUZZLES_FILE с индексами, пересобирается при его изменении
+PUZZLES_SNAPSHOT = 'puzzles.snapshot'
+
+puzzle_store = PuzzleStore()
 try:
-    with open('puzzles_data.json', 'r', encoding='utf-8') as f:
-        puzzles_data = json.load(f)
-    
-    puzzles = []
-    for puzzle in puzzles_data:
-        rating = puzzle.get("Rating", 1500)
-        
-        if rating < 2600:
-            level = "Средняя"
-        elif rating < 3000:
-            level = "Сложная"
-        else:
-            level = "Очень сложная"
-        
-        moves = puzzle["Moves"].split() if "Moves" in puzzle else []
-        
-        themes = puzzle.get("Themes", "").split()
-        condition = ""
-        
-        if "mate" in themes or "mateIn2" in themes or "mateIn3" in themes:
-            total_moves = len(moves)
-            if total_moves == 1:
-                condition = "Мат в 1 ход"
-            elif total_moves == 2:
-                condition = "Мат в 2 хода"
-            elif total_moves == 3:
-                condition = "Мат в 3 хода"
-            else:
-                condition = f"Мат в {total_moves // 2 + 1} ходов"
-        else:
-            if "advancedPawn" in themes or "promotion" in themes:
-                condition = "Продвините пешку"
-            elif "endgame" in themes:
-                condition = "Эндшпиль"
-            elif "crushing" in themes:
-                condition = "Решающая атака"
-            elif "attraction" in themes:
-                condition = "Привлечение фигуры"
-            else:
-                condition = "Выиграйте материал"
-        
-        puzzles.append({
-            "fen": puzzle["FEN"],
-            "solution": moves,
-            "level": level,
-            "condition": condition,
-            "rating": rating,
-            "themes": themes
-        })
-    
-    print(f"Загружено {len(puzzles)} задач")
-    
+    if os.path.exists(PUZZLES_BIN):
+        puzzle_store = BinaryPuzzleStore(PUZZLES_BIN)
+    else:
+        puzzle_store = puzzle_snapshot.load(
+            PUZZLES_SNAPSHOT, [PUZZLES_FILE, QUARANTINE_FILE],
+            lambda: PuzzleStore(iter_records(PUZZLES_FILE, load_quarantine())),
+        )
+
+    print(f"Загружено {len(puzzle_store)} задач")
+
 except FileNotFoundError:
-    print("Ошибка: файл puzzles_data.json не найден.")
-    puzzles = []
+    print(f"Ошибка: файл {PUZZLES_FILE} не найден.")
 except json.JSONDecodeError:
-    print("Ошибка: неверный формат JSON в puzzles_data.json")
-    puzzles = []
+    print(f"Ошибка: неверный формат JSON в {PUZZLES_FILE}")
 except KeyError as e:
-    print(f"Ошибка: отсутствует ключ {e} в puzzles_data.json")
-    puzzles = []
-
-
-def ascii_board(fen: str) -> str:
-    board = chess.Board(fen)
-    if board.turn == chess.BLACK:
-        return str(board)[::-1]
-    return str(board)
-
-def print_debug_info(task):
-    print("\n" + "="*50)
-    print("ИНФОРМАЦИЯ О ЗАДАЧЕ:")
-    print(f"FEN: {task['fen']}")
-    print(f"Уровень: {task['level']} (рейтинг: {task.get('rating', 'N/A')})")
-    print(f"Условие: {task['condition']}")
-    print(f"Решение: {task['solution']}")
-    
-    board = chess.Board(task['fen'])
-    print("\nДоска с координатами:")
-    print(board.unicode(borders=True, empty_square='.'))
-    
-    test_board = chess.Board(task['fen'])
-    move_number = 1
-    
-    for i, move_uci in enumerate(task['solution']):
-        try:
-            move = chess.Move.from_uci(move_uci)
-            player = "Белые" if test_board.turn == chess.WHITE else "Чёрные"
-            
-            if move in test_board.legal_moves:
-                test_board.push(move)
-                print(f"{move_number}. {player}: {move_uci}")
-                
-                if test_board.is_checkmate():
-                    print("   -> МАТ")
-                elif test_board.is_check():
-                    print("   -> ШАХ")
-                
-                if i % 2 == 1:
-                    move_number += 1
-            else:
-                print(f"ОШИБКА: Ход {move_uci} невозможен!")
-                break
-                
-        except Exception as e:
-            print(f"ОШИБКА в ходе {move_uci}: {e}")
-    
-    print("="*50 + "\n")
+    print(f"Ошибка: отсутствует ключ {e} в {PUZZLES_FILE}")
+
+# другие правильные ходы (build_alternatives.py), проверка хода - поиск в словаре
+alternatives = load_alternatives()
+if alternatives:
+    print(f"Других правильных ходов: {len(alternatives)}")
+
+# активные задачи: в памяти (по умолчанию) или в sqlite, чтобы пережить перезапуск
+SESSION_BACKEND = os.environ.get("SESSION_BACKEND", "memory")
+SESSION_TTL = 24 * 60 * 60
+
+if SESSION_BACKEND == "sqlite":
+    active_games = SqliteSessionStore(puzzle_store.get, "sessions.db", ttl=SESSION_TTL)
+else:
+    active_games = MemorySessionStore(puzzle_store.get, ttl=SESSION_TTL)
+
+# счётчики и уровень пишутся в базу пачками, а не на каждую задачу
+stats_writer = StatsWriter(Session, flush_interval=1.0, max_pending=500)
+# профили горячих пользователей; все изменения счётчиков идут через него
+user_cache = UserCache(Session, stats_writer, max_size=10_000, puzzles_fingerprint=puzzle_store.fingerprint)
+# нерешённые задачи возвращаются по расписанию в режиме "По рейтингу"
+reviews = ReviewScheduler(Session, stats_writer)
+# история исходов и счётчики по уровням и темам для /stats
+solve_stats = SolveStats(Session, stats_writer)
+# каждый ход в задаче и первый исход - в журнал, пачками в фоне
+attempt_log = AttemptLog(ATTEMPT_LOG_DIR)
+# места по рейтингу для /top; воркеры sharded перечитывают его из базы
+leaderboard = Leaderboard(Session, stats_writer, refresh_interval=60 if BOT_MODE == "sharded" else 0)
+# картинки досок и file_id уже отправленных
+board_images = board_image.BoardImages() if BOARD_IMAGES else None
+# процессы с ходами бота, общие для всех партий; game_engine (и chess.engine)
+# импортируется и пул создаётся при первой партии, см. get_engine_pool
+engine_pool = None
+
+# метрики: время запросов к базе и датчики, которые считаются при сборе
+instrument_engine(engine)
+metrics_server = MetricsServer(REGISTRY, METRICS_HOST, METRICS_PORT)
+REGISTRY.gauge("bot_active_sessions", "Активные задачи", lambda: len(active_games))
+REGISTRY.gauge("bot_puzzles", "Задач в хранилище", lambda: len(puzzle_store))
+REGISTRY.gauge("bot_user_cache_size", "Пользователей в кэше", lambda: len(user_cache))
+REGISTRY.gauge("bot_user_cache_hit_ratio", "Доля чтений профиля из кэша", user_cache.hit_rate)
+REGISTRY.gauge("bot_render_cache_hit_ratio", "Доля сообщений с задачей из кэша", board_render.hit_rate)
+REGISTRY.gauge("bot_move_table_hit_ratio", "Доля разборов хода с готовой таблицей", move_parser.hit_rate)
+if board_images is not None:
+    REGISTRY.gauge("bot_board_image_hit_ratio", "Доля картинок доски без отрисовки", board_images.hit_rate)
+REGISTRY.gauge("bot_stats_backlog", "Изменения, ждущие записи в базу", stats_writer.backlog)
+REGISTRY.gauge("bot_leaderboard_size", "Игроков в таблице лидеров", lambda: len(leaderboard))
+REGISTRY.gauge("bot_attempt_log_backlog", "Попытки, ждущие записи в журнал", attempt_log.backlog)
+
 
 # команди 
 async def start(update, context):
     user_id = update.effective_user.id
     username = update.effective_user.username
 
-    session = Session()
-    user = session.scalar(select(User).where(User.telegram_id == user_id))
+    user = await user_cache.get(user_id)
     if not user:
-        user = User(telegram_id=user_id, username=username)
-        session.add(user)
-        session.commit()
+        user_cache.register(user_id, username)
+        attempt_log.registered(user_id)
         text = (
             "Добро пожаловать в шахматный тренажёр!\n"
             "Вы зарегистрированы.\n"
@@ -164,7 +161,6 @@ async def start(update, context):
         )
     else:
         text = f"Ты уже зарегистрирован!\nРешено задач: {user.solved_count}"
-    session.close()
 
     await update.message.reply_text(text, reply_markup=markup)
 
@@ -174,10 +170,14 @@ async def help_command(update, context):
         "Команды:\n"
         "/start - регистрация\n"
         "/game - начать задачу\n"
+        "/play - партия вслепую с ботом\n"
+        "   /play чёрные, /play e4 e5 Nf3, /play <FEN>\n"
         "/stats - статистика\n"
+        "/top - лучшие по рейтингу\n"
         "/help - справка\n\n"
         "Формат хода:\n"
-        "e2 e4  (ход с e2 на e4)\n"
+        "e2 e4  (ход с e2 на e4, можно e2e4)\n"
+        "Nf3    (запись SAN, можно exd5, e8=Q)\n"
         "O-O    (короткая рокировка)\n"
         "O-O-O  (длинная рокировка)"
     )
@@ -185,9 +185,7 @@ async def help_command(update, context):
 
 async def stats(update, context):
     user_id = update.effective_user.id
-    session = Session()
-    user = session.scalar(select(User).where(User.telegram_id == user_id))
-    session.close()
+    user = await user_cache.get(user_id)
 
     if not user:
         await update.message.reply_text("Сначала зарегистрируйтесь: /start")
@@ -198,15 +196,51 @@ async def stats(update, context):
     text = (
         f"Ваша статистика:\n"
         f"Решено задач: {user.solved_count}\n"
+        f"Средний рейтинг решённых: {avg_rating}\n"
         f"Текущий уровень: {user.current_level}\n"
+        f"Рейтинг: {round(user.rating)}\n"
     )
+    place = leaderboard.rank(user_id)
+    if place is not None:
+        text += f"Место: {place} из {len(leaderboard)}\n"
+
+    counts = await solve_stats.get(user_id)
+    levels = [(name, c) for (category, name), c in counts.items() if category == "level"]
+    if levels:
+        text += "\nПо уровням:\n"
+        for name, (attempts, solved) in sorted(levels):
+            text += f"{name}: {solved} из {attempts}\n"
+    # слабые темы: где доля решённых ниже всего, если попыток хватает для вывода
+    themes = [(solved / attempts, name) for (category, name), (attempts, solved) in counts.items()
+              if category == "theme" and attempts >= 3]
+    if themes:
+        weak = ", ".join(f"{name} ({share:.0%})" for share, name in sorted(themes)[:3])
+        text += f"\nСлабые темы: {weak}\n"
+
     await update.message.reply_text(text, reply_markup=markup)
 
+async def top(update, context):
+    user_id = update.effective_user.id
+    leaders = leaderboard.top(10)
+    if not leaders:
+        await update.message.reply_text("Пока никто не решал задачи на рейтинг.", reply_markup=markup)
+        return
+
+    lines = ["Лучшие по рейтингу:"]
+    for place, telegram_id, username, rating in leaders:
+        name = f"@{username}" if username else f"игрок {telegram_id}"
+        lines.append(f"{place}. {name} - {round(rating)}")
+    place = leaderboard.rank(user_id)
+    if place is not None and place > len(leaders):
+        lines.append(f"\nВаше место: {place} из {len(leaderboard)}")
+    await update.message.reply_text("\n".join(lines), reply_markup=markup)
+
 async def game(update, context):
     buttons = [
         [InlineKeyboardButton("Средняя (<2600)", callback_data="level_Средняя")],
         [InlineKeyboardButton("Сложная (2600-3000)", callback_data="level_Сложная")],
         [InlineKeyboardButton("Очень сложная (>3000)", callback_data="level_Очень сложная")],
+        [InlineKeyboardButton("По рейтингу", callback_data="adaptive")],
     ]
     keyboard = InlineKeyboardMarkup(buttons)
     await update.message.reply_text("Выберите уровень сложности задачи:", reply_markup=keyboard)
@@ -216,65 +250,212 @@ async def level_choice(update, context):
     await query.answer()
 
     level = query.data.replace("level_", "")
+    user_id = query.from_user.id
+    user = await user_cache.get(user_id)
     
-    level_tasks = [task for task in puzzles if task.get('level') == level]
+    # сначала задачи, которых игрок ещё не видел
+    index = puzzle_store.random_index(level=level, exclude=user.seen.__contains__ if user else None)
+    if index is None and user:
+        index = puzzle_store.random_index(level=level)
     
-    if not level_tasks:
+    if index is None:
         await query.edit_message_text(f"Для уровня '{level}' задач пока нет.")
         return
 
-    task = random.choice(level_tasks)
+    user_cache.set_level(user_id, level)
+    await start_puzzle(query, user_id, index)
+
+async def adaptive_choice(update, context):
+    """Задача под рейтинг игрока, а если подошло время - повторение нерешённой."""
+    query = update.callback_query
+    await query.answer()
 
     user_id = query.from_user.id
-    board = chess.Board(task["fen"])
+    user = await user_cache.get(user_id)
+    if not user:
+        await query.edit_message_text("Сначала зарегистрируйтесь: /start")
+        return
+
+    due = await reviews.next_due(user_id)
+    if due is not None:
+        index, puzzle_id, step = due
+        if index < len(puzzle_store) and puzzle_store.get(index)["id"] == puzzle_id:
+            await start_puzzle(query, user_id, index, review=step)
+            return
+        # набор задач пересобрали, повторять нечего
+        reviews.drop(user_id, puzzle_id)
+
+    index = puzzle_store.random_near(user.rating, exclude=user.seen.__contains__)
+    if index is None:
+        index = puzzle_store.random_near(user.rating)
+    if index is None:
+        await query.edit_message_text("Задач пока нет.")
+        return
+    await start_puzzle(query, user_id, index)
+
+async def start_puzzle(query, user_id, index, review=None):
+    task = puzzle_store.get(index)
+    active_games.evict_expired()
     active_games[user_id] = {
-        "board": board,
-        "solution": task["solution"].copy(),
-        "level": level,
-        "condition": task["condition"],
-        "rating": task.get("rating", 1500),
+        "mode": "puzzle",
+        "puzzle": index,
+        "id": task["id"],
+        "level": task["level"],
         "current_move": 0,
-        "history": [],
-        "show_board": False
+        "show_board": False,
+        "failed": False,
+        "review": review,
     }
-
-    session = Session()
-    user = session.scalar(select(User).where(User.telegram_id == user_id))
+    user = await user_cache.get(user_id)
     if user:
-        user.current_level = level
-        session.commit()
-    session.close()
+        user_cache.mark_seen(user, index)
 
-    total_moves = len(task["solution"])
-    color = "белые" if board.turn == chess.WHITE else "чёрные"
-    
-    moves_needed = (total_moves + 1) // 2
-    if "Мат в" in task["condition"]:
-        moves_text = task["condition"]
-    elif moves_needed == 1:
-        moves_text = "1 ход"
-    else:
-        moves_text = f"{moves_needed} ходов"
-    
-    rating_text = f"\nРейтинг задачи: {task.get('rating', 'N/A')}" if task.get('rating') else ""
-    
-    text = (
-        f"Уровень: {level}\n"
-        f"Условие: {task['condition']}\n"
-        f"Ходят: {color}\n"
-        f"Всего ходов в решении: {total_moves} ({moves_text})"
-        f"{rating_text}\n\n"
-        "Доска скрыта. Нажмите 'Показать доску', чтобы увидеть позицию.\n\n"
-        "Введите ваш ход:"
-    )
+    text = puzzle_message(await active_games.get(user_id), shown=False)
     
     buttons = [
         [InlineKeyboardButton("Показать доску", callback_data="show_board")],
     ]
     keyboard = InlineKeyboardMarkup(buttons)
     await query.edit_message_text(text, reply_markup=keyboard)
-    
-    print_debug_info(task)
+    attempt_log.prompted(user_id)
+
+async def record_result(user_id, task_data, solved):
+    """Первый исход задачи: меняет рейтинг игрока и расписание повторений."""
+    user = await user_cache.get(user_id)
+    if user:
+        rating, deviation = update_rating(user.rating, user.rating_deviation, task_data["rating"], solved)
+        user_cache.set_rating(user_id, rating, deviation)
+        leaderboard.update(user_id, user.username, rating)
+        solve_stats.record(user_id, puzzle_store.get(task_data["puzzle"]), solved, rating)
+        attempt_log.result(user_id, task_data["id"], solved, task_data["rating"])
+
+    if not solved:
+        reviews.failed(user_id, task_data["puzzle"], task_data["id"])
+    elif task_data["review"] is not None:
+        reviews.passed(user_id, task_data["puzzle"], task_data["id"], task_data["review"])
+
+# партия с ботом
+COLOR_WORDS = {"белые": True, "white": True, "чёрные": False, "черные": False, "black": False}
+
+async def play(update, context):
+    """/play [белые|чёрные] [ходы дебюта или FEN] - партия вслепую с ботом."""
+    user_id = update.effective_user.id
+    args = list(context.args or [])
+
+    white = True
+    if args and args[0].lower() in COLOR_WORDS:
+        white = COLOR_WORDS[args.pop(0).lower()]
+
+    board = chess.Board()
+    try:
+        if args and "/" in args[0]:
+            # с позиции играет тот, чья очередь ходить
+            board = chess.Board(" ".join(args))
+            white = board.turn == chess.WHITE
+        else:
+            for text in args:
+                board.push(parse_board_move(board, text))
+    except ValueError:
+        await update.message.reply_text("Не удалось разобрать позицию или ходы дебюта.", reply_markup=markup)
+        return
+    if board.is_game_over():
+        await update.message.reply_text("В этой позиции партия уже окончена.", reply_markup=markup)
+        return
+
+    task_data = {
+        "mode": "game",
+        "board": board,
+        "fen": board.fen(),
+        # ходы дебюта тоже в истории: по ней считаются повторения
+        "start_fen": board.root().fen(),
+        "moves": [move.uci() for move in board.move_stack],
+        "white": white,
+        "clock": GAME_CLOCK,
+        "turn_started": time.time(),
+        "show_board": False,
+    }
+    if board.turn != white:
+        await engine_reply(task_data)
+    task_data["turn_started"] = time.time()
+    active_games[user_id] = task_data
+
+    buttons = [
+        [InlineKeyboardButton("Показать доску", callback_data="show_board")],
+    ]
+    keyboard = InlineKeyboardMarkup(buttons)
+    await update.message.reply_text(game_message(task_data, shown=False), reply_markup=keyboard)
+
+def get_engine_pool():
+    global engine_pool
+    if engine_pool is None:
+        from game_engine import EnginePool
+
+        engine_pool = EnginePool(GAME_WORKERS, GAME_ENGINE, GAME_MOVE_TIME, GAME_MOVE_NODES)
+    return engine_pool
+
+async def engine_reply(task_data):
+    """Ход бота: считается в пуле процессов, цикл событий не ждёт. Возвращает SAN."""
+    board = task_data["board"]
+    started = time.perf_counter()
+    move = await get_engine_pool().best_move(task_data["start_fen"], task_data["moves"])
+    ENGINE_MOVE_SECONDS.observe(time.perf_counter() - started)
+
+    san = board.san(move)
+    board.push(move)
+    task_data["moves"].append(move.uci())
+    task_data["fen"] = board.fen()
+    return san
+
+def game_result(board, white):
+    outcome = board.outcome(claim_draw=True)
+    if outcome.winner is None:
+        reasons = {
+            chess.Termination.STALEMATE: "пат",
+            chess.Termination.INSUFFICIENT_MATERIAL: "недостаточно материала",
+            chess.Termination.THREEFOLD_REPETITION: "троекратное повторение",
+            chess.Termination.FIVEFOLD_REPETITION: "пятикратное повторение",
+            chess.Termination.FIFTY_MOVES: "правило 50 ходов",
+            chess.Termination.SEVENTYFIVE_MOVES: "правило 75 ходов",
+        }
+        return f"Ничья ({reasons.get(outcome.termination, 'партия окончена')})."
+    if outcome.winner == white:
+        return "Мат! Вы победили."
+    return "Мат. Победил бот."
+
+async def game_move(update, user_id, task_data, move):
+    board = task_data["board"]
+    # часы игрока идут с ответа бота до его сообщения
+    clock = task_data["clock"] - (time.time() - task_data["turn_started"])
+    if clock <= 0:
+        del active_games[user_id]
+        await update.message.reply_text("Время вышло - партия проиграна.", reply_markup=markup)
+        return
+
+    san = board.san(move)
+    board.push(move)
+    task_data["moves"].append(move.uci())
+    if board.is_game_over(claim_draw=True):
+        del active_games[user_id]
+        await update.message.reply_text(f"Ваш ход: {san}\n{game_result(board, task_data['white'])}", reply_markup=markup)
+        return
+
+    reply = await engine_reply(task_data)
+    if board.is_game_over(claim_draw=True):
+        del active_games[user_id]
+        await update.message.reply_text(f"Бот ответил: {reply}\n{game_result(board, task_data['white'])}", reply_markup=markup)
+        return
+
+    task_data["clock"] = clock + GAME_INCREMENT
+    task_data["turn_started"] = time.time()
+    active_games[user_id] = task_data
+
+    check = "\nШах!" if board.is_check() else ""
+    await update.message.reply_text(
+        f"Бот ответил: {reply}{check}\n"
+        f"Ваши часы: {format_clock(task_data['clock'])}\n\n"
+        f"Ваш ход ({'белые' if board.turn == chess.WHITE else 'чёрные'}):",
+        reply_markup=markup
+    )
 
 async def reset_game(update, context):
     """Обработчик кнопки сброса задачи - вызывает команду reset"""
@@ -284,12 +465,14 @@ async def reset_game(update, context):
     user_id = query.from_user.id
     username = query.from_user.username or "игрок"
 
-    if user_id in active_games:
-        del active_games[user_id]
+    task_data = await active_games.pop(user_id)
+    if task_data is not None and task_data["mode"] == "game":
+        await query.edit_message_text("Партия с ботом прервана.", reply_markup=markup)
+        return
+    if task_data is not None and not task_data["failed"]:
+        await record_result(user_id, task_data, solved=False)
 
-    session = Session()
-    user = session.scalar(select(User).where(User.telegram_id == user_id))
-    session.close()
+    user = await user_cache.get(user_id)
 
     solved = user.solved_count if user else 0
 
@@ -306,28 +489,18 @@ async def show_board(update, context):
     await query.answer()
     
     user_id = query.from_user.id
-    if user_id not in active_games:
+    task_data = await active_games.get(user_id)
+    if task_data is None:
         return
     
-    task_data = active_games[user_id]
     task_data["show_board"] = True
+    active_games[user_id] = task_data
     
-    board = task_data["board"]
-    board_ascii = ascii_board(board.fen())
-    
-    current_text = query.message.text
-    lines = current_text.split('\n')
-    
-    header_lines = []
-    for line in lines:
-        if "Доска скрыта" not in line:
-            header_lines.append(line)
-        else:
-            break
-    
-    header_text = '\n'.join(header_lines[:6])
-    
-    text = f"{header_text}\n\n{board_ascii}\n\nВведите ваш ход:"
+    photo = await board_images.photo(task_data["fen"]) if board_images is not None else None
+    if task_data["mode"] == "game":
+        text = game_message(task_data, shown=True, image=photo is not None)
+    else:
+        text = puzzle_message(task_data, shown=True, image=photo is not None)
     
     buttons = [
         [InlineKeyboardButton("Скрыть доску", callback_data="hide_board")],
@@ -335,42 +508,52 @@ async def show_board(update, context):
     keyboard = InlineKeyboardMarkup(buttons)
     await query.edit_message_text(text, reply_markup=keyboard)
 
+    # повторное "Показать доску": прошлую картинку не оставляем в чате
+    await delete_board_photo(context)
+    if photo is not None:
+        sent = await query.message.reply_photo(photo)
+        board_images.remember(task_data["fen"], sent)
+        # при "Скрыть доску" картинку удалим
+        context.user_data["board_photo"] = (sent.chat_id, sent.message_id)
+
 async def hide_board(update, context):
     query = update.callback_query
     await query.answer()
     
     user_id = query.from_user.id
-    if user_id not in active_games:
+    task_data = await active_games.get(user_id)
+    if task_data is None:
         return
     
-    task_data = active_games[user_id]
     task_data["show_board"] = False
+    active_games[user_id] = task_data
     
-    current_text = query.message.text
-    lines = current_text.split('\n')
-    
-    header_lines = []
-    board_started = False
-    for line in lines:
-        if any(piece in line for piece in ['K', 'Q', 'R', 'B', 'N', 'P', '.', ' ']) and len(line.strip()) > 0:
-            board_started = True
-            continue
-        if not board_started:
-            header_lines.append(line)
-    
-    header_text = '\n'.join(header_lines[:6])
-    
-    text = f"{header_text}\n\nДоска скрыта. Нажмите 'Показать доску', чтобы увидеть позицию.\n\nВведите ваш ход:"
+    if task_data["mode"] == "game":
+        text = game_message(task_data, shown=False)
+    else:
+        text = puzzle_message(task_data, shown=False)
     
     buttons = [
         [InlineKeyboardButton("Показать доску", callback_data="show_board")],
     ]
     keyboard = InlineKeyboardMarkup(buttons)
     await query.edit_message_text(text, reply_markup=keyboard)
+    await delete_board_photo(context)
+
+async def delete_board_photo(context):
+    """Удаляет из чата картинку доски, отправленную show_board."""
+    photo_message = context.user_data.pop("board_photo", None)
+    if photo_message is not None:
+        try:
+            await context.bot.delete_message(*photo_message)
+        except TelegramError:
+            # сообщение уже удалили или оно слишком старое
+            pass
 
 # ходы
 def check_solution(board, move, task_data):
     solution = task_data["solution"]
+    line = task_data["line"]
     current_move = task_data["current_move"]
     condition = task_data["condition"]
     history = task_data["history"]
@@ -378,14 +561,17 @@ def check_solution(board, move, task_data):
     if current_move >= len(solution):
         return True, "Задача уже решена!", True
     
-    expected_move = solution[current_move]
-    
-    if move.uci() != expected_move:
-        correct_move = chess.Move.from_uci(expected_move)
-        if move == correct_move:
-            pass
-        else:
+    # ходы решения разобраны и проверены заранее, тут только сравнение
+    if move != expected_move(line, current_move):
+        # другой правильный ход посчитан заранее в alternatives
+        kind = alternatives.get((task_data["id"], current_move, move.uci()))
+        if kind is None:
             return False, f"Неправильный ход", False
+        if kind == ALT_MATE:
+            board.push(move)
+            history.append(move.uci())
+            task_data["current_move"] = len(solution) - 1
+            return True, "Мат! Задача решена правильно!", True
 
     board.push(move)
     history.append(move.uci())
@@ -398,9 +584,9 @@ def check_solution(board, move, task_data):
 
     if current_move < len(solution):
         opponent_move_uci = solution[current_move]
-        opponent_move = chess.Move.from_uci(opponent_move_uci)
+        opponent_move = expected_move(line, current_move)
         
-        if opponent_move in board.legal_moves:
+        if opponent_move is not None:
             board.push(opponent_move)
             history.append(opponent_move_uci)
             current_move += 1
@@ -422,10 +608,7 @@ def check_solution(board, move, task_data):
             return True, message, False
         else:
             #ход противника невозможен
-            for _ in range(2):
-                if history:
-                    board.pop()
-                    history.pop()
+            board.set_fen(line.fens[0])
             task_data["current_move"] = 0
             task_data["history"] = []
             return False, f"Ошибка в задаче: ход противника {opponent_move_uci} невозможен", False
@@ -434,186 +617,95 @@ def check_solution(board, move, task_data):
 
 async def text_handler(update, context):
     user_id = update.effective_user.id
-    if user_id not in active_games:
+    task_data = await active_games.get(user_id)
+    if task_data is None:
         await update.message.reply_text("Сначала выберите задачу: /game", reply_markup=markup)
         return
 
     raw_text = update.message.text.strip()
-    text = raw_text.upper()
 
     if not all(c.isascii() for c in raw_text):
         await update.message.reply_text("Используйте английскую раскладку клавиатуры.", reply_markup=markup)
         return
 
-    board = active_games[user_id]["board"]
-    task_data = active_games[user_id]
+    board = task_data["board"]
 
-    move_uci = None
-    
-    if text == "O-O":
-        if board.turn == chess.WHITE:
-            move_uci = "e1g1" if chess.Move.from_uci("e1g1") in board.legal_moves else None
-        else:
-            move_uci = "e8g8" if chess.Move.from_uci("e8g8") in board.legal_moves else None
-            
-    elif text == "O-O-O":
-        if board.turn == chess.WHITE:
-            move_uci = "e1c1" if chess.Move.from_uci("e1c1") in board.legal_moves else None
+    try:
+        if task_data["mode"] == "game":
+            move = parse_board_move(board, raw_text)
         else:
-            move_uci = "e8c8" if chess.Move.from_uci("e8c8") in board.legal_moves else None
-            
-    elif " " in text:
-        try:
-            a, b = text.split()
-            move_uci = a.lower() + b.lower()
-        except:
-            pass
-    elif len(text) == 4 and text.isalpha():
-        move_uci = text.lower()
-    elif len(text) == 5 and text[4] in "nbrq":
-        move_uci = text.lower()
-
-    if not move_uci:
+            move = parse_move(task_data["fen"], raw_text)
+    except chess.AmbiguousMoveError:
         await update.message.reply_text(
-            "Неверный формат хода. Используйте:\n"
-            "e2 e4\n"
-            "e2e4\n"
-            "O-O\n"
-            "O-O-O\n"
-            "e7e8q",
+            "Ход можно понять по-разному. Укажите фигуру заглавной буквой (Bc3), "
+            "её вертикаль (Nbd2) или поля (b2 c3).",
             reply_markup=markup
         )
         return
-
-    try:
-        move = chess.Move.from_uci(move_uci)
-    except ValueError:
-        await update.message.reply_text("Некорректный ход. (возможно вы ввели некорректные координаты)", reply_markup=markup)
-        return
-
-    if move not in board.legal_moves:
+    except chess.IllegalMoveError:
         await update.message.reply_text("Этот ход невозможен по правилам шахмат.", reply_markup=markup)
         return
-
-    is_correct, message, solved = check_solution(board, move, task_data)
-    
-    if is_correct and solved:
-        #задача решена
-        await update.message.reply_text(message, reply_markup=markup)
-        
-        #обновляем
-        session = Session()
-        user = session.scalar(select(User).where(User.telegram_id == user_id))
-        if user:
-            user.solved_count += 1
-            user.total_rating += task_data.get("rating", 1000)
-            session.commit()
-        session.close()
-        
-        del active_games[user_id]
-        
-    elif is_correct and not solved:
-        # верный ход
-        await update.message.reply_text(message, reply_markup=markup)
-        
-    else:
-        # неверно
-        await update.message.reply_text(message, reply_markup=markup)
-
-async def text_handler(update, context):
-    user_id = update.effective_user.id
-    if user_id not in active_games:
-        await update.message.reply_text("Сначала выберите задачу: /game", reply_markup=markup)
-        return
-
-    raw_text = update.message.text.strip()
-    text = raw_text.upper()
-
-    if not all(c.isascii() for c in raw_text):
-        await update.message.reply_text("Используйте английскую раскладку клавиатуры.", reply_markup=markup)
-        return
-
-    board = active_games[user_id]["board"]
-    task_data = active_games[user_id]
-
-    move_uci = None
-    
-    if text == "O-O":
-        if board.turn == chess.WHITE:
-            move_uci = "e1g1" if chess.Move.from_uci("e1g1") in board.legal_moves else None
-        else:
-            move_uci = "e8g8" if chess.Move.from_uci("e8g8") in board.legal_moves else None
-            
-    elif text == "O-O-O":
-        if board.turn == chess.WHITE:
-            move_uci = "e1c1" if chess.Move.from_uci("e1c1") in board.legal_moves else None
-        else:
-            move_uci = "e8c8" if chess.Move.from_uci("e8c8") in board.legal_moves else None
-            
-    elif " " in text:
-        try:
-            a, b = text.split()
-            move_uci = a.lower() + b.lower()
-        except:
-            pass
-    elif len(text) == 4 and text.isalpha():
-        move_uci = text.lower()
-    elif len(text) == 5 and text[4] in "nbrq":
-        move_uci = text.lower()
-
-    if not move_uci:
+    except chess.InvalidMoveError:
         await update.message.reply_text(
             "Неверный формат хода. Используйте:\n"
             "e2 e4\n"
             "e2e4\n"
+            "Nf3\n"
             "O-O\n"
             "O-O-O\n"
-            "e7e8q",
+            "e8=Q",
             reply_markup=markup
         )
         return
 
-    try:
-        move = chess.Move.from_uci(move_uci)
-    except ValueError:
-        await update.message.reply_text("Некорректные координаты.", reply_markup=markup)
+    if task_data["mode"] == "game":
+        await game_move(update, user_id, task_data, move)
         return
 
-    if move not in board.legal_moves:
-        await update.message.reply_text("Этот ход невозможен по правилам шахмат.", reply_markup=markup)
-        return
+    ply = task_data["current_move"]
+    expected = expected_move(task_data["line"], ply)
 
     is_correct, message, solved = check_solution(board, move, task_data)
+    attempt_log.move(user_id, task_data["id"], ply, move.uci(), is_correct,
+                     is_correct and solved, task_data.get("rating", 1000))
     
     if is_correct and solved:
         await update.message.reply_text(message, reply_markup=markup)
         
-        session = Session()
-        user = session.scalar(select(User).where(User.telegram_id == user_id))
+        user_cache.record_solve(user_id, task_data.get("rating", 1000))
+        user = await user_cache.get(user_id)
         if user:
-            user.solved_count += 1
-            user.total_rating += task_data.get("rating", 1000)
-            session.commit()
-        session.close()
+            user_cache.mark_solved(user, task_data["puzzle"])
+        if not task_data["failed"]:
+            await record_result(user_id, task_data, solved=True)
         
         del active_games[user_id]
         
     elif is_correct and not solved:
+        active_games[user_id] = task_data
         await update.message.reply_text(message, reply_markup=markup)
+        attempt_log.prompted(user_id)
         
     else:
+        # неверный ход ничего не меняет, но задача могла откатиться к началу
+        if move != expected and not task_data["failed"]:
+            task_data["failed"] = True
+            await record_result(user_id, task_data, solved=False)
+        active_games[user_id] = task_data
         await update.message.reply_text(message, reply_markup=markup)
 
 async def reset(update, context):
     user_id = update.effective_user.id
     username = update.effective_user.username or "игрок"
 
-    if user_id in active_games:
-        del active_games[user_id]
+    task_data = await active_games.pop(user_id)
+    if task_data is not None and task_data["mode"] == "game":
+        await update.message.reply_text("Партия с ботом прервана.", reply_markup=markup)
+        return
+    if task_data is not None and not task_data["failed"]:
+        await record_result(user_id, task_data, solved=False)
 
-    session = Session()
-    user = session.scalar(select(User).where(User.telegram_id == user_id))
-    session.close()
+    user = await user_cache.get(user_id)
 
     solved = user.solved_count if user else 0
 
@@ -625,19 +717,95 @@ async def reset(update, context):
 
     await update.message.reply_text(text, reply_markup=markup)
 
+async def post_init(application):
+    await init_db()
+    await stats_writer.start()
+    await leaderboard.start()
+    await attempt_log.start()
+    await active_games.start()
+    if METRICS_PORT:
+        metrics_server.port = METRICS_PORT
+        await metrics_server.start()
+
+async def post_shutdown(application):
+    await metrics_server.stop()
+    await leaderboard.stop()
+    if board_images is not None:
+        board_images.close()
+    if engine_pool is not None:
+        engine_pool.close()
+    await active_games.stop()
+    await attempt_log.stop()
+    await stats_writer.stop()
+    await close_db()
+
+def build_application(token=BOT_TOKEN, request=None, polling=True, concurrent_updates=False,
+                      user_rate=USER_RATE, api_rate=BOT_API_RATE):
+    """Собирает Application со всеми обработчиками.
+
+    request подменяет транспорт до Bot API (например, в bench/load.py).
+    Без polling апдейты кладут в update_queue снаружи (WebhookApp или
+    воркер sharding.py), Updater не нужен. concurrent_updates - сколько
+    апдейтов разных пользователей обрабатывается одновременно; только в
+    этом случае работает и user_rate - лимит апдейтов от пользователя.
+    api_rate - общий лимит запросов к Bot API в секунду.
+    """
+    from webhook import PerUserUpdateProcessor
+
+    builder = (
+        Application.builder()
+        .token(token)
+        .post_init(post_init)
+        .post_shutdown(post_shutdown)
+    )
+    if request is not None:
+        builder = builder.request(request).get_updates_request(request)
+    if not polling:
+        builder = builder.updater(None)
+    if concurrent_updates:
+        limiter = UserRateLimiter(user_rate, USER_BURST, USER_MAX_DELAY) if user_rate else None
+        builder = builder.concurrent_updates(PerUserUpdateProcessor(concurrent_updates, limiter))
+    if api_rate:
+        builder = builder.rate_limiter(GlobalRateLimiter(api_rate, burst=max(1, int(api_rate))))
+    app = builder.build()
+
+    # timed - время и ошибки каждого обработчика в metrics
+    app.add_handler(CommandHandler("start", timed(start)))
+    app.add_handler(CommandHandler("help", timed(help_command)))
+    app.add_handler(CommandHandler("stats", timed(stats)))
+    app.add_handler(CommandHandler("top", timed(top)))
+    app.add_handler(CommandHandler("game", timed(game)))
+    app.add_handler(CommandHandler("play", timed(play)))
+    app.add_handler(CommandHandler("reset", timed(reset)))
+    app.add_handler(CallbackQueryHandler(timed(level_choice), pattern="^level_"))
+    app.add_handler(CallbackQueryHandler(timed(adaptive_choice), pattern="^adaptive$"))
+    app.add_handler(CallbackQueryHandler(timed(reset_game), pattern="^reset_game$"))
+    app.add_handler(CallbackQueryHandler(timed(show_board), pattern="^show_board$"))
+    app.add_handler(CallbackQueryHandler(timed(hide_board), pattern="^hide_board$"))
+    app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, timed(text_handler)))
+    return app
+
 def main():
-    app = Application.builder().token(BOT_TOKEN).build()
-
-    app.add_handler(CommandHandler("start", start))
-    app.add_handler(CommandHandler("help", help_command))
-    app.add_handler(CommandHandler("stats", stats))
-    app.add_handler(CommandHandler("game", game))
-    app.add_handler(CommandHandler("reset", reset))
-    app.add_handler(CallbackQueryHandler(level_choice, pattern="^level_"))
-    app.add_handler(CallbackQueryHandler(reset_game, pattern="^reset_game$"))
-    app.add_handler(CallbackQueryHandler(show_board, pattern="^show_board$"))
-    app.add_handler(CallbackQueryHandler(hide_board, pattern="^hide_board$"))
-    app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, text_handler))
+    if BOT_MODE == "webhook":
+        from webhook import run_webhook
+
+        app = build_application(polling=False, concurrent_updates=WEBHOOK_CONCURRENCY)
+        print(f"Бот запущен (webhook, порт {WEBHOOK_PORT}).")
+        run_webhook(
+            app, WEBHOOK_HOST, WEBHOOK_PORT,
+            path=WEBHOOK_PATH, secret_token=WEBHOOK_SECRET, webhook_url=WEBHOOK_URL or None,
+        )
+        return
+
+    if BOT_MODE == "sharded":
+        from sharding import run_sharded
+
+        run_sharded(BOT_TOKEN, BOT_WORKERS, WEBHOOK_CONCURRENCY)
+        return
+
+    # апдейты разных пользователей - параллельно, иначе ожидание лимита
+    # одного пользователя задерживало бы всех
+    app = build_application(concurrent_updates=WEBHOOK_CONCURRENCY)
 
     print("Бот запущен.")
     app.run_polling()
@@ -0,0 +1,227 @@
+"""Метрики бота в текстовом формате Prometheus.
+
+Время обработчиков и запросов к базе - гистограммы, ошибки - счётчики,
+размеры и доли попаданий в кэши - датчики, которые считаются при каждом
+запросе /metrics. Сервер метрик - голый asyncio, без зависимостей.
+
+Профилирование: PROFILE_HANDLERS=level_choice,text_handler (или all) и
+PROFILE_RATE=0.01 - каждый сотый вызов этих обработчиков пишется в
+PROFILE_DIR/<обработчик>-<время>.prof (смотреть через python -m pstats).
+"""
+import asyncio
+import cProfile
+import functools
+import os
+import random
+import time
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+PROFILE_HANDLERS = set(filter(None, os.environ.get("PROFILE_HANDLERS", "").split(",")))
+PROFILE_RATE = float(os.environ.get("PROFILE_RATE", "0.01"))
+PROFILE_DIR = os.environ.get("PROFILE_DIR", "profiles")
+
+
+def _labels(names, values):
+    if not names:
+        return ""
+    pairs = ",".join(f'{name}="{value}"' for name, value in zip(names, values))
+    return "{" + pairs + "}"
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values = {}
+
+    def inc(self, *labels, amount=1):
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def samples(self):
+        for labels, value in sorted(self._values.items()):
+            yield self.name, _labels(self.labels, labels), value
+
+
+class Gauge:
+    """Значение считается функцией в момент сбора метрик."""
+
+    kind = "gauge"
+
+    def __init__(self, name, help, function):
+        self.name = name
+        self.help = help
+        self.function = function
+
+    def samples(self):
+        yield self.name, "", self.function()
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        # метки -> [счётчики по корзинам, сумма, количество]
+        self._values = {}
+
+    def observe(self, value, *labels):
+        item = self._values.get(labels)
+        if item is None:
+            item = self._values[labels] = [[0] * len(self.buckets), 0.0, 0]
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                item[0][i] += 1
+                break
+        item[1] += value
+        item[2] += 1
+
+    def samples(self):
+        for labels, (counts, total, count) in sorted(self._values.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                yield (f"{self.name}_bucket", _labels(self.labels + ("le",), labels + (bound,)), cumulative)
+            yield f"{self.name}_bucket", _labels(self.labels + ("le",), labels + ("+Inf",)), count
+            yield f"{self.name}_sum", _labels(self.labels, labels), total
+            yield f"{self.name}_count", _labels(self.labels, labels), count
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+
+    def register(self, metric):
+        self._metrics[metric.name] = metric
+        return metric
+
+    def gauge(self, name, help, function):
+        return self.register(Gauge(name, help, function))
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics.values():
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            try:
+                for name, labels, value in metric.samples():
+                    lines.append(f"{name}{labels} {value}")
+            except Exception as e:
+                # сломанный датчик не должен ронять всю страницу
+                lines.append(f"# ошибка {metric.name}: {e}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+HANDLER_SECONDS = REGISTRY.register(Histogram(
+    "bot_handler_seconds", "Время обработки апдейта", ["handler"]))
+HANDLER_ERRORS = REGISTRY.register(Counter(
+    "bot_handler_errors_total", "Исключения в обработчиках", ["handler"]))
+DB_QUERY_SECONDS = REGISTRY.register(Histogram(
+    "bot_db_query_seconds", "Время запроса к базе", ["statement"]))
+ENGINE_MOVE_SECONDS = REGISTRY.register(Histogram(
+    "bot_engine_move_seconds", "Время хода бота в партии (/play)"))
+THROTTLED = REGISTRY.register(Counter(
+    "bot_throttled_total", "Придержанные, отброшенные и схлопнутые апдейты, повторы запросов", ["reason"]))
+
+
+# cProfile не умеет профилировать несколько вызовов сразу
+_profiling = False
+
+
+def _profile_enabled(name):
+    return (name in PROFILE_HANDLERS or "all" in PROFILE_HANDLERS) and random.random() < PROFILE_RATE
+
+
+def timed(handler):
+    """Обёртка обработчика: время в bot_handler_seconds, ошибки в счётчик."""
+    name = handler.__name__
+
+    @functools.wraps(handler)
+    async def wrapper(update, context):
+        global _profiling
+        profiler = None
+        if PROFILE_HANDLERS and not _profiling and _profile_enabled(name):
+            # в профиль попадёт и то, что цикл событий делал во время await
+            _profiling = True
+            profiler = cProfile.Profile()
+            profiler.enable()
+
+        started = time.perf_counter()
+        try:
+            return await handler(update, context)
+        except Exception:
+            HANDLER_ERRORS.inc(name)
+            raise
+        finally:
+            HANDLER_SECONDS.observe(time.perf_counter() - started, name)
+            if profiler is not None:
+                profiler.disable()
+                _profiling = False
+                os.makedirs(PROFILE_DIR, exist_ok=True)
+                profiler.dump_stats(os.path.join(PROFILE_DIR, f"{name}-{time.time_ns()}.prof"))
+
+    return wrapper
+
+
+def instrument_engine(engine):
+    """Время каждого SQL-запроса в bot_db_query_seconds по первому слову запроса."""
+    # sqlalchemy нужен только вместе с engine: throttle и webhook берут
+    # отсюда счётчики и не должны его тянуть
+    from sqlalchemy import event
+
+    @event.listens_for(engine.sync_engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+    @event.listens_for(engine.sync_engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        started = conn.info["query_started"].pop()
+        DB_QUERY_SECONDS.observe(time.perf_counter() - started, statement.split(None, 1)[0].upper())
+
+
+class MetricsServer:
+    """Отдаёт REGISTRY по GET /metrics."""
+
+    def __init__(self, registry=REGISTRY, host="127.0.0.1", port=9108):
+        self.registry = registry
+        self.host = host
+        self.port = port
+        self._server = None
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    async def _handle(self, reader, writer):
+        try:
+            request = await reader.readline()
+            # заголовки не нужны, но их надо дочитать
+            while (await reader.readline()).strip():
+                pass
+            parts = request.decode("latin-1").split()
+            if len(parts) >= 2 and parts[0] == "GET" and parts[1].split("?")[0] == "/metrics":
+                status, body = "200 OK", self.registry.render().encode()
+            else:
+                status, body = "404 Not Found", b""
+            writer.write(
+                f"HTTP/1.1 {status}\r\n"
+                "Content-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+                f"Content-Length: {len(body)}\r\n"
+                "Connection: close\r\n\r\n".encode() + body
+            )
+            await writer.drain()
+        finally:
+            writer.close()
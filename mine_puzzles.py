@@ -0,0 +1,355 @@
+"""Ищет новые задачи в партиях из PGN и пишет их в формате Lichess (.jsonl).
+
+    python mine_puzzles.py games.pgn -o mined.jsonl
+    python mine_puzzles.py lichess_db_standard_rated_2024-01.pgn.zst -o mined.jsonl --workers 8
+    python mine_puzzles.py games.pgn -o mined.jsonl --engine /usr/bin/stockfish --depth 14
+
+Партии читаются потоком и пачками уходят в пул процессов. Без --engine
+ищется только форсированный мат встроенным перебором (атакующая сторона
+перебирает шахи, защищающаяся - все ответы). С UCI-движком находятся и
+позиции с единственным выигрывающим ходом.
+
+Задача - позиция до ошибочного хода соперника: FEN, затем Moves =
+ошибка соперника + решение, как в базе Lichess. Прогресс пишется в
+<output>.checkpoint после каждой пачки; повторный запуск продолжает с
+того же места. Собранный файл подключается к build_puzzles.py как обычный
+.jsonl.
+"""
+import argparse
+import hashlib
+import io
+import json
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import chess
+import chess.engine
+import chess.pgn
+
+# первые полуходы - дебют, задач там почти нет
+MIN_PLY = 12
+# сколько партий уходит в процесс за раз
+GAMES_PER_CHUNK = 200
+
+# UCI-движок: лучший ход должен давать столько сантипешек и быть
+# на столько лучше второго, иначе решение не единственное
+WINNING_CP = 200
+UNIQUE_GAP_CP = 200
+MAX_SOLUTION_PLIES = 7
+
+# движок открывается в каждом процессе пула один раз
+_engine = None
+_engine_options = None
+
+
+def _open_pgn(path: str):
+    if path.endswith(".zst"):
+        try:
+            import zstandard
+        except ImportError:
+            raise RuntimeError("для чтения .zst нужен пакет zstandard")
+        return zstandard.ZstdDecompressor().stream_reader(open(path, "rb"), closefd=True)
+    return open(path, "rb")
+
+
+def iter_chunks(path: str, offset: int = 0, games_per_chunk: int = GAMES_PER_CHUNK):
+    """Пачки партий как текст PGN: (текст, смещение в байтах после пачки).
+
+    Смещение считается по распакованному потоку, для .zst продолжение -
+    это перечитывание до него.
+    """
+    with _open_pgn(path) as raw:
+        f = io.BufferedReader(raw) if path.endswith(".zst") else raw
+        if offset and f is raw:
+            f.seek(offset)
+        elif offset:
+            left = offset
+            while left:
+                chunk = f.read(min(left, 1 << 20))
+                if not chunk:
+                    break
+                left -= len(chunk)
+
+        lines = []
+        games = 0
+        in_moves = False
+        position = offset
+        for line in f:
+            # новая партия - заголовок после ходов предыдущей
+            if line.startswith(b"[") and in_moves:
+                games += 1
+                in_moves = False
+                if games >= games_per_chunk:
+                    yield b"".join(lines).decode("utf-8", "replace"), position
+                    lines = []
+                    games = 0
+            elif line.strip() and not line.startswith(b"["):
+                in_moves = True
+            lines.append(line)
+            position += len(line)
+        if lines:
+            yield b"".join(lines).decode("utf-8", "replace"), position
+
+
+def _mate_in(board: chess.Board, depth: int) -> int:
+    """Кратчайший форсированный мат стороны, которая ходит, не длиннее depth; 0 - нет."""
+    for n in range(1, depth + 1):
+        if _mating_moves(board, n, first_only=True):
+            return n
+    return 0
+
+
+def _mating_moves(board: chess.Board, n: int, first_only=False):
+    """Ходы, после которых мат не позже чем в n ходов. Мат всегда с шахом,
+    поэтому атакующая сторона перебирает только шахи."""
+    found = []
+    for move in board.legal_moves:
+        if not board.gives_check(move):
+            continue
+        board.push(move)
+        mates = board.is_checkmate() or (n > 1 and _all_replies_lose(board, n - 1))
+        board.pop()
+        if mates:
+            found.append(move)
+            if first_only:
+                break
+    return found
+
+
+def _all_replies_lose(board: chess.Board, n: int) -> bool:
+    replies = list(board.legal_moves)
+    if not replies:
+        return False
+    for reply in replies:
+        board.push(reply)
+        mates = bool(_mating_moves(board, n, first_only=True))
+        board.pop()
+        if not mates:
+            return False
+    return True
+
+
+def mate_solution(board: chess.Board, max_mate: int):
+    """Решение-мат: ходы от стороны, которая ходит, или None.
+
+    Каждый ход атакующей стороны, кроме последнего, должен быть
+    единственным, иначе задача не однозначна. Защищающаяся сторона
+    выбирает ответ, дольше всего оттягивающий мат.
+    """
+    n = _mate_in(board, max_mate)
+    if not n:
+        return None
+
+    board = board.copy(stack=False)
+    solution = []
+    while True:
+        moves = _mating_moves(board, n)
+        if n > 1 and len(moves) != 1:
+            return None
+        board.push(moves[0])
+        solution.append(moves[0])
+        if board.is_checkmate():
+            return solution
+
+        best_reply, best_n = None, 0
+        for reply in board.legal_moves:
+            board.push(reply)
+            reply_n = _mate_in(board, n - 1)
+            board.pop()
+            if reply_n > best_n:
+                best_reply, best_n = reply, reply_n
+        board.push(best_reply)
+        solution.append(best_reply)
+        n = best_n
+
+
+def puzzle_rating(game_elo: int, solution_plies: int) -> int:
+    """Стартовый рейтинг задачи: уровень партии плюс длина решения."""
+    return max(600, min(3300, game_elo + 150 * ((solution_plies + 1) // 2)))
+
+
+def puzzle_id(fen: str, moves: str) -> str:
+    return "m" + hashlib.sha1(f"{fen} {moves}".encode()).hexdigest()[:7]
+
+
+def _game_elo(game) -> int:
+    ratings = []
+    for name in ("WhiteElo", "BlackElo"):
+        try:
+            ratings.append(int(game.headers.get(name, "")))
+        except ValueError:
+            pass
+    return sum(ratings) // len(ratings) if ratings else 1500
+
+
+def _score(info, color):
+    return info["score"].pov(color).score(mate_score=100_000)
+
+
+def engine_solution(board: chess.Board):
+    """Решение по движку: (ходы, мат в N или None, оценка) или (None, None, 0)."""
+    limit = chess.engine.Limit(depth=_engine_options["depth"])
+    infos = _engine.analyse(board, limit, multipv=2)
+    if not infos or "pv" not in infos[0]:
+        return None, None, 0
+    best = _score(infos[0], board.turn)
+    second = _score(infos[1], board.turn) if len(infos) > 1 else -100_000
+    if best < WINNING_CP or best - second < UNIQUE_GAP_CP:
+        return None, None, 0
+
+    # решение заканчивается ходом игрока
+    pv = infos[0]["pv"][:MAX_SOLUTION_PLIES]
+    if len(pv) % 2 == 0:
+        pv = pv[:-1]
+    mate = infos[0]["score"].pov(board.turn).mate()
+    return pv, mate, best
+
+
+def analyse_game(game, max_mate: int):
+    rows = []
+    if game.headers.get("Variant", "Standard") not in ("Standard", "Chess"):
+        return rows
+
+    elo = _game_elo(game)
+    site = game.headers.get("Site", "")
+    board = game.board()
+    for ply, node in enumerate(game.mainline()):
+        before = board.fen()
+        setup = node.move
+        board.push(setup)
+        if ply < MIN_PLY or board.is_game_over():
+            continue
+
+        themes = []
+        if _engine is not None:
+            solution, mate, score = engine_solution(board)
+            if solution is None:
+                continue
+            if mate and mate > 0:
+                themes = ["mate", f"mateIn{mate}"]
+            else:
+                themes = ["crushing" if score >= 500 else "advantage"]
+        else:
+            solution = mate_solution(board, max_mate)
+            if solution is None:
+                continue
+            themes = ["mate", f"mateIn{(len(solution) + 1) // 2}"]
+
+        moves = " ".join(move.uci() for move in [setup, *solution])
+        themes.append("short" if len(solution) <= 3 else "long")
+        rows.append({
+            "PuzzleId": puzzle_id(before, moves),
+            "FEN": before,
+            "Moves": moves,
+            "Rating": puzzle_rating(elo, len(solution)),
+            "Themes": " ".join(themes),
+            "GameUrl": f"{site}#{ply + 1}" if site.startswith("http") else "",
+        })
+    return rows
+
+
+def _init_worker(engine_path, depth):
+    global _engine, _engine_options
+    _engine_options = {"depth": depth}
+    if engine_path:
+        import atexit
+
+        _engine = chess.engine.SimpleEngine.popen_uci(engine_path)
+        atexit.register(_engine.quit)
+
+
+def analyse_chunk(text: str, max_mate: int):
+    rows = []
+    pgn = io.StringIO(text)
+    while True:
+        try:
+            game = chess.pgn.read_game(pgn)
+        except (ValueError, UnicodeDecodeError):
+            continue
+        if game is None:
+            break
+        rows.extend(analyse_game(game, max_mate))
+    return rows
+
+
+def _load_checkpoint(path, source):
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            state = json.load(f)
+    except FileNotFoundError:
+        return 0, 0, 0
+    if state.get("source") != os.path.abspath(source):
+        raise RuntimeError(f"{path} относится к другому файлу: {state.get('source')}")
+    return state["offset"], state["found"], state["written"]
+
+
+def _save_checkpoint(path, source, offset, found, written):
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump({"source": os.path.abspath(source), "offset": offset,
+                   "found": found, "written": written}, f)
+    os.replace(tmp, path)
+
+
+def mine(source, output, workers=None, engine=None, depth=12, max_mate=2,
+         games_per_chunk=GAMES_PER_CHUNK):
+    checkpoint = output + ".checkpoint"
+    offset, found, written = _load_checkpoint(checkpoint, source)
+    seen = set()
+    if offset:
+        # хвост, дописанный после последнего checkpoint, будет записан заново
+        os.truncate(output, written)
+        with open(output, "r", encoding="utf-8") as f:
+            seen = {json.loads(line)["PuzzleId"] for line in f}
+
+    workers = workers or os.cpu_count()
+    chunks = iter_chunks(source, offset, games_per_chunk)
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                             initargs=(engine, depth)) as pool, \
+            open(output, "ab" if offset else "wb") as out:
+        # как в validate_puzzles: в работе ограниченное число пачек, результаты -
+        # по порядку, чтобы смещение в checkpoint всегда было честным
+        pending = deque()
+        while True:
+            while len(pending) < workers * 2:
+                chunk = next(chunks, None)
+                if chunk is None:
+                    break
+                text, end = chunk
+                pending.append((pool.submit(analyse_chunk, text, max_mate), end))
+            if not pending:
+                break
+
+            future, end = pending.popleft()
+            for row in future.result():
+                if row["PuzzleId"] in seen:
+                    continue
+                seen.add(row["PuzzleId"])
+                out.write((json.dumps(row, ensure_ascii=False) + "\n").encode("utf-8"))
+                found += 1
+            out.flush()
+            _save_checkpoint(checkpoint, source, end, found, out.tell())
+            print(f"\r{end / 2**20:.1f} МБ, задач: {found}", end="", flush=True)
+    print()
+    return found
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Поиск задач в партиях PGN")
+    parser.add_argument("source", help=".pgn или .pgn.zst")
+    parser.add_argument("-o", "--output", default="mined.jsonl")
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--engine", help="путь к UCI-движку, например stockfish")
+    parser.add_argument("--depth", type=int, default=12, help="глубина анализа движком")
+    parser.add_argument("--max-mate", type=int, default=2, help="встроенный перебор: мат не длиннее")
+    parser.add_argument("--chunk", type=int, default=GAMES_PER_CHUNK, help="партий в пачке")
+    args = parser.parse_args()
+
+    found = mine(args.source, args.output, args.workers, args.engine, args.depth,
+                 args.max_mate, args.chunk)
+    print(f"Найдено задач: {found}, записаны в {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+"""Разбор хода из сообщения игрока.
+
+Понимает SAN ("Nf3", "exd5", "e8=Q+"), UCI ("e2e4", "e7e8q"), координаты
+через пробел или дефис ("e2 e4", "e2-e4") и рокировку ("O-O", "0-0-0").
+Для позиции один раз строится таблица "нормализованная запись -> ход" по
+всем легальным ходам, дальше разбор - это чистка строки и поиск в словаре.
+Таблицы позиций задач кэшируются: игроки приходят в одни и те же позиции.
+Позиции партий с ботом не повторяются, их таблица строится по доске на
+один разбор (parse_board_move).
+"""
+import re
+from functools import lru_cache
+
+import chess
+
+# ничего не значат для разбора: взятие, превращение, шах, мат, оценки
+_NOISE = re.compile(r"[\sx:=+#!?-]")
+# запись, похожая на ход, - чтобы отличать нелегальный ход от мусора
+_MOVE_SHAPE = re.compile(r"^(?:[KQRBN]?[a-h]?[1-8]?[a-h][1-8][QRBNqrbn]?|OO|OOO)$")
+
+# в таблице: ход в нижнем регистре совпал у разных ходов ("bc3" - слон или пешка)
+_AMBIGUOUS = object()
+
+
+def normalize(text: str) -> str:
+    """Убирает из записи всё лишнее: "e8=Q+" -> "e8Q", "O-O" -> "OO", "e2 e4" -> "e2e4"."""
+    text = _NOISE.sub("", text.strip().replace("X", "x"))
+    if text in ("OO", "oo", "00"):
+        return "OO"
+    if text in ("OOO", "ooo", "000"):
+        return "OOO"
+    return text
+
+
+class MoveTable:
+    """Все легальные ходы позиции под всеми записями, которые мы понимаем."""
+
+    __slots__ = ("exact", "lower")
+
+    def __init__(self, board: chess.Board):
+        self.exact = {}
+        self.lower = {}
+        # "Nd2" без уточнения -> все ходы фигур, которые под неё подходят
+        bare = {}
+        for move in board.legal_moves:
+            uci = move.uci()
+            keys = {uci, normalize(board.san(move))}
+            piece = board.piece_at(move.from_square)
+            if piece.piece_type != chess.PAWN:
+                # полная запись фигуры: "Ng1f3", "Ng1-f3"
+                keys.add(piece.symbol().upper() + uci)
+                bare.setdefault(piece.symbol().upper() + uci[2:], []).append(move)
+            for key in keys:
+                self.exact[key] = move
+                # без учёта регистра - только если запись однозначна
+                lowered = key.lower()
+                if self.lower.get(lowered, move) != move:
+                    self.lower[lowered] = _AMBIGUOUS
+                else:
+                    self.lower[lowered] = move
+        for key, moves in bare.items():
+            # однозначная запись уже есть в таблице как SAN; если на поле идут
+            # две одинаковые фигуры, "Nd2" неоднозначен, а не невозможен
+            if len(moves) > 1:
+                self.exact[key] = _AMBIGUOUS
+                self.lower[key.lower()] = _AMBIGUOUS
+
+    def find(self, key: str):
+        move = self.exact.get(key)
+        # "Bc3" - явно фигура, а "bc3", "E2E4" или "BC3" - регистр не важен
+        if move is None and not (key[:1] in "KQRBN" and not key.isupper()):
+            move = self.lower.get(key.lower())
+        return move
+
+
+# таблица - около 15 КБ, в кэше позиции, где сейчас стоят игроки
+@lru_cache(maxsize=4096)
+def move_table(fen: str) -> MoveTable:
+    return MoveTable(chess.Board(fen))
+
+
+def parse_move(fen: str, text: str) -> chess.Move:
+    """Легальный ход из записи игрока в позиции задачи fen.
+
+    FEN берём готовый (из SolutionLine), а не board.fen(): получить его из
+    доски дороже, чем сам разбор.
+
+    Ошибки - исключения python-chess: InvalidMoveError - запись не похожа
+    на ход, IllegalMoveError - такого хода в позиции нет, AmbiguousMoveError -
+    запись подходит к нескольким ходам.
+    """
+    return _find(move_table(fen), text)
+
+
+def parse_board_move(board: chess.Board, text: str) -> chess.Move:
+    """То же для позиции партии: таблица строится по доске и не кэшируется."""
+    return _find(MoveTable(board), text)
+
+
+def _find(table: MoveTable, text: str) -> chess.Move:
+    key = normalize(text)
+    move = table.find(key)
+    if move is _AMBIGUOUS:
+        raise chess.AmbiguousMoveError(f"ambiguous move: {text!r}")
+    if move is not None:
+        return move
+    if _MOVE_SHAPE.match(key) or _MOVE_SHAPE.match(key.lower()):
+        raise chess.IllegalMoveError(f"illegal move: {text!r}")
+    raise chess.InvalidMoveError(f"invalid move: {text!r}")
+
+
+def hit_rate() -> float:
+    """Доля разборов, для которых таблица ходов уже была в кэше."""
+    info = move_table.cache_info()
+    total = info.hits + info.misses
+    return info.hits / total if total else 0.0
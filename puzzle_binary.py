@@ -0,0 +1,265 @@
+import bisect
+import json
+import mmap
+import random
+import struct
+
+from puzzle_store import MAX_TRIES, dataset_fingerprint, pick_near
+
+# Формат файла:
+#   заголовок HEADER, затем json с таблицами (темы, условия, уровни),
+#   затем count записей фиксированной длины ROW.
+# Записи отсортированы по (уровень, рейтинг), поэтому каждый уровень -
+# непрерывный диапазон строк, а поиск по рейтингу внутри него - bisect.
+
+MAGIC = b"BCPZ"
+VERSION = 1
+
+MAX_MOVES = 32
+MAX_THEMES = 128
+
+HEADER = struct.Struct("<4sHHII")
+# id, позиция (64 клетки по 4 бита), флаги, взятие на проходе, полуходы,
+# номер хода, число ходов, рейтинг, уровень, условие, маска тем, ходы
+ROW = struct.Struct(f"<8s32sBBBHBHBB2Q{MAX_MOVES}H")
+
+RATING_OFFSET = struct.calcsize("<8s32sBBBHB")
+THEMES_OFFSET = struct.calcsize("<8s32sBBBHBHBB")
+
+PIECE_CODES = {
+    "P": 1, "N": 2, "B": 3, "R": 4, "Q": 5, "K": 6,
+    "p": 9, "n": 10, "b": 11, "r": 12, "q": 13, "k": 14,
+}
+CODE_PIECES = {code: piece for piece, code in PIECE_CODES.items()}
+
+CASTLING_FLAGS = {"K": 2, "Q": 4, "k": 8, "q": 16}
+PROMOTIONS = " nbrq"
+NO_SQUARE = 255
+
+
+def square_index(name: str) -> int:
+    return (ord(name[0]) - ord("a")) + 8 * (int(name[1]) - 1)
+
+
+def square_name(index: int) -> str:
+    return "abcdefgh"[index % 8] + str(index // 8 + 1)
+
+
+def pack_fen(fen: str):
+    placement, turn, castling, ep, halfmove, fullmove = fen.split()
+
+    nibbles = []
+    for row in placement.split("/"):
+        for c in row:
+            if c.isdigit():
+                nibbles.extend([0] * int(c))
+            else:
+                nibbles.append(PIECE_CODES[c])
+    if len(nibbles) != 64:
+        raise ValueError(f"неверная расстановка в FEN: {fen}")
+    position = bytes(nibbles[i] << 4 | nibbles[i + 1] for i in range(0, 64, 2))
+
+    flags = 1 if turn == "w" else 0
+    for c in castling:
+        flags |= CASTLING_FLAGS.get(c, 0)
+    ep_square = NO_SQUARE if ep == "-" else square_index(ep)
+    return position, flags, ep_square, min(int(halfmove), 255), int(fullmove)
+
+
+def unpack_fen(position: bytes, flags: int, ep_square: int, halfmove: int, fullmove: int) -> str:
+    rows = []
+    for rank in range(8):
+        row = ""
+        empty = 0
+        for i in range(rank * 4, rank * 4 + 4):
+            for code in (position[i] >> 4, position[i] & 15):
+                if code == 0:
+                    empty += 1
+                    continue
+                if empty:
+                    row += str(empty)
+                    empty = 0
+                row += CODE_PIECES[code]
+        if empty:
+            row += str(empty)
+        rows.append(row)
+
+    castling = "".join(c for c, flag in CASTLING_FLAGS.items() if flags & flag) or "-"
+    ep = "-" if ep_square == NO_SQUARE else square_name(ep_square)
+    turn = "w" if flags & 1 else "b"
+    return f"{'/'.join(rows)} {turn} {castling} {ep} {halfmove} {fullmove}"
+
+
+def pack_move(uci: str) -> int:
+    promo = PROMOTIONS.index(uci[4]) if len(uci) > 4 else 0
+    return square_index(uci[0:2]) | square_index(uci[2:4]) << 6 | promo << 12
+
+
+def unpack_move(code: int) -> str:
+    promo = code >> 12
+    return square_name(code & 63) + square_name(code >> 6 & 63) + (PROMOTIONS[promo] if promo else "")
+
+
+class BinaryPuzzleStore:
+    """Задачи из файла, собранного build_puzzles.py, открытого через mmap.
+
+    Интерфейс тот же, что у PuzzleStore. Страницы файла общие для всех
+    процессов бота, а при старте читается только заголовок.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._file = open(path, "rb")
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, row_size, self.count, meta_size = HEADER.unpack_from(self._map, 0)
+        if magic != MAGIC or version != VERSION or row_size != ROW.size:
+            raise ValueError(f"{path}: неподдерживаемый формат файла задач")
+
+        meta = json.loads(self._map[HEADER.size:HEADER.size + meta_size].decode("utf-8"))
+        self.theme_names = meta["themes"]
+        self.conditions = meta["conditions"]
+        self.level_names = meta["levels"]
+        self.level_ranges = {level: tuple(bounds) for level, bounds in meta["level_ranges"].items()}
+        self._rows_offset = HEADER.size + meta_size
+        # в файлах старых сборок отпечатка нет - считаем по строкам
+        self.fingerprint = meta.get("fingerprint") or dataset_fingerprint(
+            self._map[offset:offset + 8].rstrip(b"\0").decode("ascii")
+            for offset in range(self._rows_offset, self._rows_offset + self.count * ROW.size, ROW.size)
+        )
+
+        # индекс по темам строится при первом запросе с темой
+        self._by_theme = None
+
+    def __len__(self):
+        return self.count
+
+    def close(self):
+        self._map.close()
+        self._file.close()
+
+    def _rating(self, index: int) -> int:
+        offset = self._rows_offset + index * ROW.size + RATING_OFFSET
+        return struct.unpack_from("<H", self._map, offset)[0]
+
+    def get(self, index: int) -> dict:
+        (puzzle_id, position, flags, ep_square, halfmove, fullmove, move_count,
+         rating, level_id, condition_id, themes_low, themes_high, *moves) = ROW.unpack_from(
+            self._map, self._rows_offset + index * ROW.size)
+
+        mask = themes_low | themes_high << 64
+        return {
+            "id": puzzle_id.rstrip(b"\0").decode("ascii"),
+            "fen": unpack_fen(position, flags, ep_square, halfmove, fullmove),
+            "solution": [unpack_move(code) for code in moves[:move_count]],
+            "level": self.level_names[level_id],
+            "condition": self.conditions[condition_id],
+            "rating": rating,
+            "themes": [name for bit, name in enumerate(self.theme_names) if mask >> bit & 1],
+        }
+
+    def levels(self):
+        return list(self.level_ranges)
+
+    def themes(self):
+        return list(self.theme_names)
+
+    def _theme_index(self):
+        if self._by_theme is None:
+            self._by_theme = {}
+            for index in range(self.count):
+                offset = self._rows_offset + index * ROW.size + THEMES_OFFSET
+                low, high = struct.unpack_from("<2Q", self._map, offset)
+                mask = low | high << 64
+                bit = 0
+                while mask:
+                    if mask & 1:
+                        self._by_theme.setdefault(self.theme_names[bit], []).append(index)
+                    mask >>= 1
+                    bit += 1
+        return self._by_theme
+
+    def _rating_range(self, start, end, rating_min, rating_max):
+        # внутри уровня строки отсортированы по рейтингу
+        ratings = _RatingView(self, start, end)
+        low = bisect.bisect_left(ratings, rating_min) if rating_min is not None else 0
+        high = bisect.bisect_right(ratings, rating_max) if rating_max is not None else end - start
+        return start + low, start + high
+
+    def _ranges(self, level, rating_min, rating_max):
+        if level is not None:
+            levels = [level] if level in self.level_ranges else []
+        else:
+            levels = list(self.level_ranges)
+        ranges = []
+        for name in levels:
+            start, end = self._rating_range(*self.level_ranges[name], rating_min, rating_max)
+            if start < end:
+                ranges.append((start, end))
+        return ranges
+
+    def random_index(self, level=None, theme=None, rating_min=None, rating_max=None, exclude=None):
+        """Случайный индекс задачи по фильтрам или None, если подходящих нет.
+
+        exclude(индекс) -> True отсеивает задачи, например уже показанные игроку.
+        """
+        ranges = self._ranges(level, rating_min, rating_max)
+        if not ranges:
+            return None
+
+        if theme is not None:
+            pool = self._theme_index().get(theme, [])
+            # индекс темы отсортирован, вырезаем из него нужные диапазоны
+            slices = [
+                (bisect.bisect_left(pool, start), bisect.bisect_left(pool, end))
+                for start, end in ranges
+            ]
+        else:
+            pool = None
+            slices = ranges
+
+        total = sum(high - low for low, high in slices)
+        if not total:
+            return None
+        for _ in range(MAX_TRIES):
+            pick = random.randrange(total)
+            for low, high in slices:
+                if pick < high - low:
+                    break
+                pick -= high - low
+            index = low + pick if pool is None else pool[low + pick]
+            if exclude is None or not exclude(index):
+                return index
+
+        # почти всё отсеялось - перебираем выбранные диапазоны целиком
+        candidates = [
+            index for low, high in slices
+            for index in (range(low, high) if pool is None else pool[low:high])
+            if not exclude(index)
+        ]
+        return random.choice(candidates) if candidates else None
+
+    def random_near(self, rating, exclude=None):
+        """Индекс задачи с рейтингом около rating; exclude(индекс) отсеивает задачи."""
+        # уровни - это диапазоны рейтинга, так что строки отсортированы по
+        # рейтингу и по всему файлу, а позиция совпадает с индексом
+        return pick_near(_RatingView(self, 0, self.count), rating, exclude)
+
+    def random(self, level=None, theme=None, rating_min=None, rating_max=None):
+        index = self.random_index(level, theme, rating_min, rating_max)
+        return self.get(index) if index is not None else None
+
+
+class _RatingView:
+    """Рейтинги строк [start, end) как последовательность для bisect."""
+
+    def __init__(self, store, start, end):
+        self.store = store
+        self.start = start
+        self.end = end
+
+    def __len__(self):
+        return self.end - self.start
+
+    def __getitem__(self, i):
+        return self.store._rating(self.start + i)
@@ -0,0 +1,112 @@
+import csv
+import io
+import json
+import sys
+from collections import namedtuple
+
+# компактная запись задачи: строки как в исходнике, разбор - только при выдаче
+PuzzleRecord = namedtuple("PuzzleRecord", "puzzle_id fen moves rating themes")
+
+# список сломанных задач, его пишет validate_puzzles.py
+QUARANTINE_FILE = "quarantine.txt"
+
+
+def puzzle_level(rating: int) -> str:
+    if rating < 2600:
+        return "Средняя"
+    elif rating < 3000:
+        return "Сложная"
+    return "Очень сложная"
+
+
+def puzzle_condition(themes, total_moves: int) -> str:
+    if "mate" in themes or "mateIn2" in themes or "mateIn3" in themes:
+        if total_moves == 1:
+            return "Мат в 1 ход"
+        elif total_moves == 2:
+            return "Мат в 2 хода"
+        elif total_moves == 3:
+            return "Мат в 3 хода"
+        return f"Мат в {total_moves // 2 + 1} ходов"
+
+    if "advancedPawn" in themes or "promotion" in themes:
+        return "Продвините пешку"
+    elif "endgame" in themes:
+        return "Эндшпиль"
+    elif "crushing" in themes:
+        return "Решающая атака"
+    elif "attraction" in themes:
+        return "Привлечение фигуры"
+    return "Выиграйте материал"
+
+
+def make_task(record: PuzzleRecord) -> dict:
+    """Разворачивает компактную запись в задачу для обработчиков."""
+    moves = record.moves.split()
+    themes = record.themes.split()
+    return {
+        "id": record.puzzle_id,
+        "fen": record.fen,
+        "solution": moves,
+        "level": puzzle_level(record.rating),
+        "condition": puzzle_condition(themes, len(moves)),
+        "rating": record.rating,
+        "themes": themes,
+    }
+
+
+def make_record(row: dict) -> PuzzleRecord:
+    return PuzzleRecord(
+        row.get("PuzzleId", ""),
+        row["FEN"],
+        row.get("Moves", ""),
+        int(row.get("Rating", 1500)),
+        # одинаковые наборы тем встречаются тысячи раз - храним одну строку
+        sys.intern(row.get("Themes", "")),
+    )
+
+
+def _open_text(path: str):
+    if path.endswith(".zst"):
+        try:
+            import zstandard
+        except ImportError:
+            raise RuntimeError("для чтения .zst нужен пакет zstandard")
+        raw = open(path, "rb")
+        reader = zstandard.ZstdDecompressor().stream_reader(raw, closefd=True)
+        return io.TextIOWrapper(reader, encoding="utf-8", newline="")
+    return open(path, "r", encoding="utf-8", newline="")
+
+
+def iter_rows(path: str):
+    """Построчно читает задачи из .json, .jsonl или Lichess .csv/.csv.zst."""
+    name = path[:-4] if path.endswith(".zst") else path
+
+    with _open_text(path) as f:
+        if name.endswith(".csv"):
+            yield from csv.DictReader(f)
+        elif name.endswith((".jsonl", ".ndjson")):
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+        else:
+            # обычный json-массив целиком не стримится, но в памяти остаются
+            # только компактные записи, сам массив сразу освобождается
+            yield from json.load(f)
+
+
+def load_quarantine(path: str = QUARANTINE_FILE) -> set:
+    """id задач из карантина; если файла нет - пустое множество."""
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return {line.split("\t", 1)[0].strip() for line in f if line.strip()}
+    except FileNotFoundError:
+        return set()
+
+
+def iter_records(path: str, skip=None):
+    for row in iter_rows(path):
+        record = make_record(row)
+        if skip and record.puzzle_id in skip:
+            continue
+        yield record
@@ -0,0 +1,190 @@
+import hashlib
+import random
+from array import array
+from bisect import bisect_left, bisect_right
+
+from puzzle_loader import make_task, puzzle_level
+
+# ширина корзины рейтинга: 2400-2499 -> 24, 2500-2599 -> 25 ...
+BUCKET_SIZE = 100
+
+# сколько раз пробуем случайный кандидат, прежде чем перебрать пул целиком
+MAX_TRIES = 16
+
+# подбор по рейтингу игрока: окно вокруг рейтинга и сколько ближайших
+# задач берём, если в окно почти ничего не попало
+NEAR_WINDOW = 100
+NEAR_MIN_CANDIDATES = 50
+
+
+def rating_bucket(rating: int) -> int:
+    return rating // BUCKET_SIZE
+
+
+def dataset_fingerprint(ids) -> str:
+    """Отпечаток набора по id задач в порядке их индексов.
+
+    Показанные и решённые задачи игрока хранятся по индексам, а при
+    пересборке набора индексы сдвигаются: по отпечатку видно, что битовые
+    карты относятся к другому набору.
+    """
+    return hashlib.sha1("\n".join(ids).encode()).hexdigest()[:16]
+
+
+def pick_near(ratings, rating, exclude=None):
+    """Случайная позиция в отсортированной ratings с рейтингом около rating.
+
+    Границы окна ищутся бинпоиском, поэтому выбор - O(log N). exclude(позиция)
+    отсеивает уже виденные задачи; если в окне всё отсеялось, окно
+    расширяется вдвое. None - подходящих задач нет.
+    """
+    count = len(ratings)
+    window = NEAR_WINDOW
+    while count:
+        low = bisect_left(ratings, rating - window)
+        high = bisect_right(ratings, rating + window)
+        if high - low < NEAR_MIN_CANDIDATES:
+            center = bisect_left(ratings, rating)
+            low = max(0, min(center - NEAR_MIN_CANDIDATES // 2, count - NEAR_MIN_CANDIDATES))
+            high = min(count, low + NEAR_MIN_CANDIDATES)
+
+        for _ in range(MAX_TRIES):
+            position = random.randrange(low, high)
+            if exclude is None or not exclude(position):
+                return position
+
+        if low == 0 and high == count:
+            # видено почти всё - перебираем целиком
+            candidates = [position for position in range(count) if not exclude(position)]
+            return random.choice(candidates) if candidates else None
+        window *= 2
+    return None
+
+
+class PuzzleStore:
+    """Задачи с индексами по уровню, корзине рейтинга и теме.
+
+    Хранятся компактные записи PuzzleRecord, задача разворачивается только
+    при выдаче. Выбор случайной задачи не перебирает весь список: берём
+    готовые пулы индексов и выбираем из них за O(1).
+    """
+
+    def __init__(self, records=()):
+        self.records = []
+        self.by_level = {}
+        # корзина рейтинга -> индексы задач
+        self.by_bucket = {}
+        # тема -> корзина рейтинга -> индексы задач
+        self.by_theme = {}
+        # индексы по возрастанию рейтинга и сами рейтинги, строятся при первом подборе
+        self._by_rating = None
+        self._ratings = None
+        self._fingerprint = None
+        for record in records:
+            self.add(record)
+        # считается сразу, чтобы попасть в снимок набора
+        self.fingerprint
+
+    @property
+    def fingerprint(self) -> str:
+        if self._fingerprint is None:
+            self._fingerprint = dataset_fingerprint(record.puzzle_id for record in self.records)
+        return self._fingerprint
+
+    def __len__(self):
+        return len(self.records)
+
+    def add(self, record) -> int:
+        index = len(self.records)
+        self.records.append(record)
+        self._by_rating = None
+        self._fingerprint = None
+
+        bucket = rating_bucket(record.rating)
+        self.by_level.setdefault(puzzle_level(record.rating), []).append(index)
+        self.by_bucket.setdefault(bucket, []).append(index)
+        for theme in record.themes.split():
+            self.by_theme.setdefault(theme, {}).setdefault(bucket, []).append(index)
+        return index
+
+    def get(self, index):
+        return make_task(self.records[index])
+
+    def levels(self):
+        return list(self.by_level)
+
+    def themes(self):
+        return list(self.by_theme)
+
+    def _pools(self, level, theme, rating_min, rating_max):
+        # выбираем самые узкие пулы, остальные условия проверяются в _matches
+        if theme is not None:
+            buckets = self.by_theme.get(theme, {})
+        elif rating_min is not None or rating_max is not None:
+            buckets = self.by_bucket
+        else:
+            return [self.by_level.get(level, [])] if level is not None else [range(len(self.records))]
+
+        low = rating_bucket(rating_min) if rating_min is not None else None
+        high = rating_bucket(rating_max) if rating_max is not None else None
+        return [
+            pool for bucket, pool in buckets.items()
+            if (low is None or bucket >= low) and (high is None or bucket <= high)
+        ]
+
+    def _matches(self, index, level, rating_min, rating_max):
+        rating = self.records[index].rating
+        if level is not None and puzzle_level(rating) != level:
+            return False
+        if rating_min is not None and rating < rating_min:
+            return False
+        if rating_max is not None and rating > rating_max:
+            return False
+        return True
+
+    def random_index(self, level=None, theme=None, rating_min=None, rating_max=None, exclude=None):
+        """Случайный индекс задачи по фильтрам или None, если подходящих нет.
+
+        exclude(индекс) -> True отсеивает задачи, например уже показанные игроку.
+        """
+        pools = [pool for pool in self._pools(level, theme, rating_min, rating_max) if pool]
+        if not pools:
+            return None
+
+        total = sum(len(pool) for pool in pools)
+        for _ in range(MAX_TRIES):
+            # пул выбираем пропорционально размеру, чтобы выбор был равномерным
+            pick = random.randrange(total)
+            for pool in pools:
+                if pick < len(pool):
+                    break
+                pick -= len(pool)
+            index = pool[pick]
+            if self._matches(index, level, rating_min, rating_max) and not (exclude and exclude(index)):
+                return index
+
+        # почти всё отсеялось по краям корзин - перебираем только выбранные пулы
+        candidates = [
+            index for pool in pools for index in pool
+            if self._matches(index, level, rating_min, rating_max) and not (exclude and exclude(index))
+        ]
+        return random.choice(candidates) if candidates else None
+
+    def _rating_order(self):
+        if self._by_rating is None:
+            order = sorted(range(len(self.records)), key=lambda index: self.records[index].rating)
+            self._by_rating = array("I", order)
+            self._ratings = array("H", (self.records[index].rating for index in order))
+        return self._by_rating, self._ratings
+
+    def random_near(self, rating, exclude=None):
+        """Индекс задачи с рейтингом около rating; exclude(индекс) отсеивает задачи."""
+        order, ratings = self._rating_order()
+        position = pick_near(
+            ratings, rating, None if exclude is None else lambda position: exclude(order[position]),
+        )
+        return order[position] if position is not None else None
+
+    def random(self, level=None, theme=None, rating_min=None, rating_max=None):
+        index = self.random_index(level, theme, rating_min, rating_max)
+        return self.get(index) if index is not None else None
@@ -0,0 +1,30 @@
+"""Рейтинг игрока по Glicko-1: каждая задача - партия против её рейтинга."""
+import math
+
+START_RATING = 1500.0
+START_DEVIATION = 350.0
+# ниже не опускаем, иначе рейтинг перестаёт заметно двигаться
+MIN_DEVIATION = 50.0
+# у задач Lichess отклонение небольшое, отдельно мы его не храним
+PUZZLE_DEVIATION = 75.0
+
+_Q = math.log(10) / 400
+
+
+def _g(deviation):
+    return 1 / math.sqrt(1 + 3 * _Q ** 2 * deviation ** 2 / math.pi ** 2)
+
+
+def expected_score(rating, puzzle_rating, puzzle_deviation=PUZZLE_DEVIATION):
+    return 1 / (1 + 10 ** (-_g(puzzle_deviation) * (rating - puzzle_rating) / 400))
+
+
+def update(rating, deviation, puzzle_rating, solved, puzzle_deviation=PUZZLE_DEVIATION):
+    """Новые (рейтинг, отклонение) после одной задачи."""
+    g = _g(puzzle_deviation)
+    expected = expected_score(rating, puzzle_rating, puzzle_deviation)
+    d2 = 1 / (_Q ** 2 * g ** 2 * expected * (1 - expected))
+    precision = 1 / deviation ** 2 + 1 / d2
+    rating += _Q / precision * g * ((1.0 if solved else 0.0) - expected)
+    deviation = max(MIN_DEVIATION, math.sqrt(1 / precision))
+    return rating, deviation
@@ -0,0 +1,122 @@
+"""Заново считает счётчики и рейтинг игроков по журналу попыток.
+
+    python replay_attempts.py
+    python replay_attempts.py attempts --apply
+
+Решённые задачи и сумма их рейтингов считаются по ходам, которыми задача
+решена, рейтинг и отклонение - по первым исходам задач, в том же порядке
+и по той же формуле, что в боте (rating.update). Без --apply скрипт только
+сравнивает результат с базой.
+
+Журнал покрывает лишь время, пока он вёлся, а рейтинг не складывается из
+частей. Поэтому с --apply пересчитанным заменяются счётчики только тех
+игроков, чья история в журнале начинается с регистрации; остальные лишь
+сравниваются. Строки users скрипт не создаёт.
+"""
+import argparse
+import asyncio
+import time
+
+from sqlalchemy import bindparam, select, update
+
+from attempt_log import iter_events
+from db import Session, User, close_db, init_db
+from rating import START_DEVIATION, START_RATING, update as update_rating
+
+COLUMNS = ("solved_count", "total_rating", "rating", "rating_deviation")
+
+
+class Aggregate:
+    __slots__ = COLUMNS + ("complete",)
+
+    def __init__(self, complete):
+        self.solved_count = 0
+        self.total_rating = 0
+        self.rating = START_RATING
+        self.rating_deviation = START_DEVIATION
+        # журнал видел регистрацию игрока, до неё счётчиков не было
+        self.complete = complete
+
+
+def replay(events):
+    """telegram_id -> Aggregate."""
+    users = {}
+    for event in events:
+        user = users.get(event["user"])
+        if user is None:
+            user = users[event["user"]] = Aggregate("registered" in event)
+        if "registered" in event:
+            continue
+        if "result" in event:
+            user.rating, user.rating_deviation = update_rating(
+                user.rating, user.rating_deviation, event["rating"], event["result"])
+        elif event["solved"]:
+            user.solved_count += 1
+            user.total_rating += event["rating"]
+    return users
+
+
+async def compare(users):
+    """Сколько игроков в базе расходятся с журналом."""
+    differ = 0
+    ids = list(users)
+    async with Session() as session:
+        # по частям: у sqlite ограничено число параметров запроса
+        for start in range(0, len(ids), 500):
+            rows = await session.execute(
+                select(User.telegram_id, User.solved_count, User.total_rating, User.rating)
+                .where(User.telegram_id.in_(ids[start:start + 500]))
+            )
+            for telegram_id, solved_count, total_rating, rating in rows:
+                user = users[telegram_id]
+                if (solved_count, total_rating) != (user.solved_count, user.total_rating) \
+                        or abs((rating or START_RATING) - user.rating) > 0.5:
+                    differ += 1
+    return differ
+
+
+async def apply(users):
+    """Заменяет счётчики игроков, которых журнал видел с регистрации; сколько их."""
+    table = User.__table__
+    stmt = (
+        update(table)
+        .where(table.c.telegram_id == bindparam("new_telegram_id"))
+        .values({name: bindparam(f"new_{name}") for name in COLUMNS + ("updated_at",)})
+    )
+    now = time.time()
+    rows = [
+        {"new_telegram_id": telegram_id, "new_updated_at": now,
+         **{f"new_{name}": getattr(user, name) for name in COLUMNS}}
+        for telegram_id, user in users.items() if user.complete
+    ]
+    async with Session() as session:
+        for start in range(0, len(rows), 1000):
+            await session.execute(stmt, rows[start:start + 1000])
+        await session.commit()
+    return len(rows)
+
+
+async def run(directory, write):
+    users = replay(iter_events(directory))
+    print(f"Игроков в журнале: {len(users)}")
+    await init_db()
+    try:
+        print(f"Расходятся с базой: {await compare(users)}")
+        if write:
+            applied = await apply(users)
+            print(f"Счётчики заменены пересчитанными у {applied} игроков, "
+                  f"остальных журнал видел не с регистрации")
+    finally:
+        await close_db()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Пересчёт счётчиков игроков по журналу попыток")
+    parser.add_argument("directory", nargs="?", default="attempts")
+    parser.add_argument("--apply", action="store_true", help="записать пересчитанное в базу")
+    args = parser.parse_args()
+    asyncio.run(run(args.directory, args.apply))
+
+
+if __name__ == "__main__":
+    main()
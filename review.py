@@ -0,0 +1,84 @@
+"""Интервальное повторение: нерешённые задачи возвращаются к игроку по расписанию."""
+import math
+import time
+
+from sqlalchemy import select
+
+from db import FailedPuzzle
+
+DAY = 24 * 60 * 60
+# через сколько дней задача вернётся на каждой ступени; после последней
+# успешной ступени задача считается выученной и удаляется
+REVIEW_DAYS = [1, 3, 7, 21, 60]
+# сколько ближайших повторений читаем за раз
+REVIEW_BATCH = 8
+
+
+class ReviewScheduler:
+    """Расписание повторений поверх таблицы failed_puzzles.
+
+    Изменения уходят в базу пачками через StatsWriter. Для каждого игрока
+    помним, раньше какого времени повторять нечего, так что подбор задачи
+    обычно обходится без запроса к базе.
+    """
+
+    def __init__(self, session_factory, writer):
+        self.session_factory = session_factory
+        self.writer = writer
+        # telegram_id -> ближайший due_at (inf - повторений нет)
+        self._quiet_until = {}
+
+    def _schedule(self, telegram_id, puzzle_id, puzzle, step, due_at):
+        self.writer.schedule_review(telegram_id, puzzle_id, puzzle, step, due_at)
+        if telegram_id in self._quiet_until:
+            self._quiet_until[telegram_id] = min(self._quiet_until[telegram_id], due_at)
+
+    async def next_due(self, telegram_id, now=None):
+        """(индекс, puzzle_id, ступень) задачи, которую пора повторить, или None."""
+        now = time.time() if now is None else now
+        if self._quiet_until.get(telegram_id, 0) > now:
+            return None
+
+        pending = self.writer.pending_reviews(telegram_id)
+        for puzzle_id, value in pending.items():
+            if value is not None and value[2] <= now:
+                return value[0], puzzle_id, value[1]
+
+        async with self.session_factory() as session:
+            rows = (await session.execute(
+                select(FailedPuzzle.puzzle, FailedPuzzle.puzzle_id, FailedPuzzle.step, FailedPuzzle.due_at)
+                .where(FailedPuzzle.telegram_id == telegram_id)
+                .order_by(FailedPuzzle.due_at)
+                .limit(REVIEW_BATCH)
+            )).all()
+
+        quiet_until = math.inf
+        for puzzle, puzzle_id, step, due_at in rows:
+            # в ещё не записанной пачке лежит более свежая версия
+            if puzzle_id in pending:
+                continue
+            if due_at <= now:
+                return puzzle, puzzle_id, step
+            quiet_until = min(quiet_until, due_at)
+        for value in pending.values():
+            if value is not None:
+                quiet_until = min(quiet_until, value[2])
+        self._quiet_until[telegram_id] = quiet_until
+        return None
+
+    def failed(self, telegram_id, puzzle, puzzle_id, now=None):
+        """Задача не решена: повторить через REVIEW_DAYS[0] дней."""
+        now = time.time() if now is None else now
+        self._schedule(telegram_id, puzzle_id, puzzle, 0, now + REVIEW_DAYS[0] * DAY)
+
+    def passed(self, telegram_id, puzzle, puzzle_id, step, now=None):
+        """Повторение решено: следующая ступень или задача выучена."""
+        now = time.time() if now is None else now
+        step += 1
+        if step >= len(REVIEW_DAYS):
+            self.drop(telegram_id, puzzle_id)
+        else:
+            self._schedule(telegram_id, puzzle_id, puzzle, step, now + REVIEW_DAYS[step] * DAY)
+
+    def drop(self, telegram_id, puzzle_id):
+        self.writer.drop_review(telegram_id, puzzle_id)
@@ -0,0 +1,120 @@
+"""Множество индексов задач в духе Roaring bitmap.
+
+Индексы делятся на блоки по 65536 по старшим битам. Редкий блок хранится
+отсортированным массивом младших 16 бит (2 байта на задачу), плотный -
+битовой картой на 8 КБ. Так и пара задач, и десятки тысяч решённых
+занимают немного памяти, а проверка - O(log 4096) или O(1).
+"""
+import struct
+from array import array
+from bisect import bisect_left
+
+# больше стольких значений массив занимает больше битовой карты
+ARRAY_LIMIT = 4096
+BITMAP_BYTES = 65536 // 8
+
+_HEADER = struct.Struct("<I")
+_CONTAINER = struct.Struct("<IBI")
+_ARRAY = 0
+_BITMAP = 1
+
+
+class SeenBitmap:
+    __slots__ = ("_containers", "_count")
+
+    def __init__(self, values=()):
+        # старшие биты -> array("H") или bytearray(BITMAP_BYTES)
+        self._containers = {}
+        self._count = 0
+        for value in values:
+            self.add(value)
+
+    def __len__(self):
+        return self._count
+
+    def __contains__(self, value):
+        container = self._containers.get(value >> 16)
+        if container is None:
+            return False
+        low = value & 0xFFFF
+        if isinstance(container, array):
+            i = bisect_left(container, low)
+            return i < len(container) and container[i] == low
+        return bool(container[low >> 3] & 1 << (low & 7))
+
+    def __iter__(self):
+        for high in sorted(self._containers):
+            container = self._containers[high]
+            if isinstance(container, array):
+                for low in container:
+                    yield high << 16 | low
+            else:
+                for byte_index, byte in enumerate(container):
+                    while byte:
+                        bit = (byte & -byte).bit_length() - 1
+                        yield high << 16 | byte_index << 3 | bit
+                        byte &= byte - 1
+
+    def add(self, value) -> bool:
+        """Добавляет индекс; False, если он уже был."""
+        high, low = value >> 16, value & 0xFFFF
+        container = self._containers.get(high)
+        if container is None:
+            self._containers[high] = array("H", [low])
+            self._count += 1
+            return True
+
+        if isinstance(container, array):
+            i = bisect_left(container, low)
+            if i < len(container) and container[i] == low:
+                return False
+            if len(container) < ARRAY_LIMIT:
+                container.insert(i, low)
+                self._count += 1
+                return True
+            # массив заполнился - переводим блок в битовую карту
+            bitmap = bytearray(BITMAP_BYTES)
+            for item in container:
+                bitmap[item >> 3] |= 1 << (item & 7)
+            self._containers[high] = container = bitmap
+
+        mask = 1 << (low & 7)
+        if container[low >> 3] & mask:
+            return False
+        container[low >> 3] |= mask
+        self._count += 1
+        return True
+
+    def to_bytes(self) -> bytes:
+        parts = [_HEADER.pack(len(self._containers))]
+        for high in sorted(self._containers):
+            container = self._containers[high]
+            if isinstance(container, array):
+                payload = container.tobytes()
+                parts.append(_CONTAINER.pack(high, _ARRAY, len(container)))
+            else:
+                payload = bytes(container)
+                parts.append(_CONTAINER.pack(high, _BITMAP, int.from_bytes(container, "little").bit_count()))
+            parts.append(payload)
+        return b"".join(parts)
+
+    @classmethod
+    def from_bytes(cls, data):
+        bitmap = cls()
+        if not data:
+            return bitmap
+        (count,) = _HEADER.unpack_from(data, 0)
+        offset = _HEADER.size
+        for _ in range(count):
+            high, kind, size = _CONTAINER.unpack_from(data, offset)
+            offset += _CONTAINER.size
+            if kind == _ARRAY:
+                container = array("H")
+                container.frombytes(data[offset:offset + size * 2])
+                offset += size * 2
+            else:
+                container = bytearray(data[offset:offset + BITMAP_BYTES])
+                offset += BITMAP_BYTES
+            bitmap._containers[high] = container
+            bitmap._count += size
+        return bitmap
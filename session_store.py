@@ -0,0 +1,375 @@
+import abc
+import asyncio
+import json
+import sqlite3
+import time
+from collections import OrderedDict, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+import chess
+
+from solution_table import solution_line
+
+# в хранилище лежит только это, доска восстанавливается из задачи и номера хода
+# failed - в этой задаче уже был неверный ход, review - ступень повторения
+# (review.REVIEW_DAYS) или None, если задача выдана не как повторение;
+# game - партия с ботом (/play), у задач None
+SessionState = namedtuple("SessionState", "puzzle puzzle_id level current_move show_board failed review game")
+# начальная позиция, сыгранные ходы в UCI через пробел, игрок за белых,
+# остаток его часов в секундах и когда начался его ход (time.time())
+GameState = namedtuple("GameState", "start_fen moves white clock turn_started")
+
+
+class SessionStore(abc.ABC):
+    """Активные задачи пользователей.
+
+    Работает как словарь telegram_id -> task_data, но хранит компактное
+    SessionState и собирает доску заново при чтении. Чтение асинхронное
+    (await get/pop): хранилищу может понадобиться диск. После изменения
+    task_data его нужно записать обратно: active_games[user_id] = task_data.
+    task_data["mode"] - "puzzle" или "game".
+    """
+
+    def __init__(self, get_puzzle):
+        # get_puzzle(index) -> задача из хранилища задач
+        self.get_puzzle = get_puzzle
+
+    @abc.abstractmethod
+    async def _load(self, user_id):
+        """SessionState или None."""
+
+    @abc.abstractmethod
+    def _save(self, user_id, state):
+        pass
+
+    @abc.abstractmethod
+    def _delete(self, user_id):
+        pass
+
+    @abc.abstractmethod
+    def __len__(self):
+        pass
+
+    async def start(self):
+        pass
+
+    async def stop(self):
+        pass
+
+    async def get(self, user_id, default=None):
+        state = await self._load(user_id)
+        if state is None:
+            return default
+        if state.game is not None:
+            return self._game_data(state)
+
+        task = self.get_puzzle(state.puzzle)
+        if task["id"] != state.puzzle_id:
+            # набор задач пересобрали, старая сессия больше не валидна
+            self._delete(user_id)
+            return default
+
+        # позиции после каждого хода решения посчитаны заранее
+        line = solution_line(task)
+        fen = line.fens[min(state.current_move, len(line.fens) - 1)]
+        board = chess.Board(fen)
+        history = task["solution"][:state.current_move]
+
+        return {
+            "mode": "puzzle",
+            "puzzle": state.puzzle,
+            "id": task["id"],
+            "board": board,
+            "fen": fen,
+            "solution": task["solution"],
+            "line": line,
+            "level": state.level,
+            "condition": task["condition"],
+            "rating": task["rating"],
+            "current_move": state.current_move,
+            "history": history,
+            "show_board": state.show_board,
+            "failed": state.failed,
+            "review": state.review,
+        }
+
+    def _game_data(self, state):
+        game = state.game
+        # доска с историей ходов: по ней считаются повторения позиции
+        board = chess.Board(game.start_fen)
+        moves = game.moves.split()
+        for uci in moves:
+            board.push(chess.Move.from_uci(uci))
+        return {
+            "mode": "game",
+            "board": board,
+            "fen": board.fen(),
+            "start_fen": game.start_fen,
+            "moves": moves,
+            "white": game.white,
+            "clock": game.clock,
+            "turn_started": game.turn_started,
+            "show_board": state.show_board,
+        }
+
+    def __setitem__(self, user_id, task_data):
+        if task_data["mode"] == "game":
+            game = GameState(
+                task_data["start_fen"],
+                " ".join(task_data["moves"]),
+                task_data["white"],
+                task_data["clock"],
+                task_data["turn_started"],
+            )
+            self._save(user_id, SessionState(-1, "", "", len(task_data["moves"]),
+                                             task_data["show_board"], False, None, game))
+            return
+        self._save(user_id, SessionState(
+            task_data["puzzle"],
+            task_data["id"],
+            task_data["level"],
+            task_data["current_move"],
+            task_data["show_board"],
+            task_data.get("failed", False),
+            task_data.get("review"),
+            None,
+        ))
+
+    def __delitem__(self, user_id):
+        self._delete(user_id)
+
+    async def pop(self, user_id, default=None):
+        task_data = await self.get(user_id, default)
+        self._delete(user_id)
+        return task_data
+
+
+class MemorySessionStore(SessionStore):
+    """Сессии в памяти процесса с вытеснением по LRU и TTL."""
+
+    def __init__(self, get_puzzle, max_size=100_000, ttl=24 * 60 * 60):
+        super().__init__(get_puzzle)
+        self.max_size = max_size
+        self.ttl = ttl
+        # user_id -> (время истечения, SessionState), порядок - от давних к свежим
+        self._sessions = OrderedDict()
+
+    def __len__(self):
+        return len(self._sessions)
+
+    async def _load(self, user_id):
+        item = self._sessions.get(user_id)
+        if item is None:
+            return None
+        expires_at, state = item
+        now = time.monotonic()
+        if expires_at <= now:
+            del self._sessions[user_id]
+            return None
+        self._sessions[user_id] = (now + self.ttl, state)
+        self._sessions.move_to_end(user_id)
+        return state
+
+    def _save(self, user_id, state):
+        self._sessions[user_id] = (time.monotonic() + self.ttl, state)
+        self._sessions.move_to_end(user_id)
+        while len(self._sessions) > self.max_size:
+            self._sessions.popitem(last=False)
+
+    def _delete(self, user_id):
+        self._sessions.pop(user_id, None)
+
+    def evict_expired(self):
+        now = time.monotonic()
+        # самые давние в начале, дальше первой живой сессии можно не смотреть
+        while self._sessions:
+            user_id, (expires_at, _) = next(iter(self._sessions.items()))
+            if expires_at > now:
+                break
+            del self._sessions[user_id]
+
+
+class SqliteSessionStore(SessionStore):
+    """Сессии в отдельном файле sqlite, переживают перезапуск бота.
+
+    Обработчики работают с копией в памяти. При старте читаются только
+    id живых сессий и сроки их истечения; сама сессия читается в потоке
+    при первом обращении к игроку, у которого она есть. Изменения раз в
+    flush_interval секунд одной транзакцией пишет другой поток со своим
+    соединением. Там же, не чаще раза в sweep_interval секунд, удаляются
+    просроченные строки. Игрока всегда обслуживает один процесс, поэтому
+    копии можно верить.
+    """
+
+    def __init__(self, get_puzzle, path="sessions.db", ttl=24 * 60 * 60, max_size=100_000,
+                 flush_interval=1.0, sweep_interval=60.0):
+        super().__init__(get_puzzle)
+        self.ttl = ttl
+        self.max_size = max_size
+        self.flush_interval = flush_interval
+        self.sweep_interval = sweep_interval
+        # у чтения и записи свои соединения и потоки
+        self._db = self._connect(path)
+        self._writer = self._connect(path)
+        self._reader = ThreadPoolExecutor(max_workers=1, thread_name_prefix="session-read")
+        # user_id -> (время истечения, SessionState или None - сессии нет)
+        self._cache = OrderedDict()
+        # ещё не записанные изменения в том же виде; None - удалить строку
+        self._dirty = {}
+        self._flushing = {}
+        self._swept_at = time.time()
+        self._task = None
+        self._flush_lock = asyncio.Lock()
+
+        columns = [row[1] for row in self._db.execute("PRAGMA table_info(sessions)")]
+        if columns and "game" not in columns:
+            # файл от прошлой версии: сессии короткоживущие, проще начать заново
+            self._db.execute("DROP TABLE sessions")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS sessions ("
+            " telegram_id INTEGER PRIMARY KEY,"
+            " puzzle INTEGER NOT NULL,"
+            " puzzle_id TEXT NOT NULL,"
+            " level TEXT NOT NULL,"
+            " current_move INTEGER NOT NULL,"
+            " show_board INTEGER NOT NULL,"
+            " failed INTEGER NOT NULL,"
+            " review INTEGER,"
+            " game TEXT,"
+            " expires_at REAL NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS sessions_expires_at ON sessions (expires_at)")
+        # user_id -> время истечения для всех живых сессий: по нему считается
+        # __len__, а к базе идём только за теми, у кого сессия есть
+        self._expiry = dict(self._db.execute(
+            "SELECT telegram_id, expires_at FROM sessions WHERE expires_at > ?", (time.time(),)
+        ))
+
+    @staticmethod
+    def _connect(path):
+        db = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("PRAGMA synchronous=NORMAL")
+        return db
+
+    def __len__(self):
+        # истёкшие убираются раз в sweep_interval
+        return len(self._expiry)
+
+    def _remember(self, user_id, item):
+        self._cache[user_id] = item
+        self._cache.move_to_end(user_id)
+        while len(self._cache) > self.max_size:
+            self._cache.popitem(last=False)
+
+    def _query(self, user_id):
+        row = self._db.execute(
+            "SELECT puzzle, puzzle_id, level, current_move, show_board, failed, review, game, expires_at"
+            " FROM sessions WHERE telegram_id = ?", (user_id,)
+        ).fetchone()
+        if row is None:
+            return 0.0, None
+        game = GameState(*json.loads(row[7])) if row[7] is not None else None
+        return row[8], SessionState(row[0], row[1], row[2], row[3], bool(row[4]), bool(row[5]), row[6], game)
+
+    async def _read(self, user_id):
+        # вытесненная из копии, но ещё не записанная сессия
+        item = self._dirty.get(user_id) or self._flushing.get(user_id)
+        if item is None and user_id in self._expiry:
+            item = await asyncio.get_running_loop().run_in_executor(self._reader, self._query, user_id)
+            # пока читали, сессию могли записать - она свежее
+            item = self._cache.get(user_id, item)
+        if item is None:
+            item = (0.0, None)
+        self._remember(user_id, item)
+        return item
+
+    async def _load(self, user_id):
+        item = self._cache.get(user_id)
+        if item is None:
+            item = await self._read(user_id)
+        else:
+            self._cache.move_to_end(user_id)
+        expires_at, state = item
+        if state is not None and expires_at <= time.time():
+            self._delete(user_id)
+            return None
+        return state
+
+    def _save(self, user_id, state):
+        item = (time.time() + self.ttl, state)
+        self._remember(user_id, item)
+        self._dirty[user_id] = item
+        self._expiry[user_id] = item[0]
+
+    def _delete(self, user_id):
+        item = (0.0, None)
+        self._remember(user_id, item)
+        self._dirty[user_id] = item
+        self._expiry.pop(user_id, None)
+
+    def evict_expired(self):
+        # просроченные строки удаляет поток записи раз в sweep_interval,
+        # а устаревшая копия в памяти отсеивается при чтении
+        pass
+
+    def backlog(self):
+        return len(self._dirty)
+
+    async def start(self):
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+        self._reader.shutdown()
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                print(f"Ошибка записи сессий: {e}")
+
+    async def flush(self):
+        async with self._flush_lock:
+            sweep = time.time() - self._swept_at >= self.sweep_interval
+            if not self._dirty and not sweep:
+                return
+            self._flushing, self._dirty = self._dirty, {}
+            try:
+                await asyncio.get_running_loop().run_in_executor(None, self._write, self._flushing, sweep)
+            except Exception:
+                # более свежие изменения, сделанные во время записи, не затираем
+                self._dirty = {**self._flushing, **self._dirty}
+                raise
+            finally:
+                self._flushing = {}
+            if sweep:
+                self._swept_at = now = time.time()
+                self._expiry = {user_id: expires_at for user_id, expires_at in self._expiry.items()
+                                if expires_at > now}
+
+    def _write(self, batch, sweep):
+        saves = [
+            (user_id, *state[:-1], json.dumps(state.game) if state.game is not None else None, expires_at)
+            for user_id, (expires_at, state) in batch.items() if state is not None
+        ]
+        deletes = [(user_id,) for user_id, (_, state) in batch.items() if state is None]
+        self._writer.execute("BEGIN")
+        try:
+            self._writer.executemany("INSERT OR REPLACE INTO sessions VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", saves)
+            self._writer.executemany("DELETE FROM sessions WHERE telegram_id = ?", deletes)
+            if sweep:
+                self._writer.execute("DELETE FROM sessions WHERE expires_at <= ?", (time.time(),))
+            self._writer.execute("COMMIT")
+        except Exception:
+            self._writer.execute("ROLLBACK")
+            raise
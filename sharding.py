@@ -0,0 +1,179 @@
+"""Несколько процессов-обработчиков: пользователь всегда попадает в один и тот же.
+
+Супервизор сам забирает апдейты через getUpdates и раскладывает их по
+очередям воркеров по telegram_id % число воркеров. Поэтому active_games
+пользователя живёт в одном процессе, а обработчики не меняются. Упавший
+воркер перезапускается, его очередь при этом сохраняется.
+"""
+import asyncio
+import multiprocessing
+import queue
+import signal
+import time
+from datetime import timedelta
+
+from telegram import Bot, Update
+from telegram.error import NetworkError, RetryAfter
+
+MONITOR_INTERVAL = 1.0
+# пауза перед повтором getUpdates после сетевой ошибки: растёт вдвое до потолка
+POLL_RETRY_DELAY = 1.0
+POLL_RETRY_MAX_DELAY = 30.0
+
+
+def shard_for(update: Update, workers: int) -> int:
+    user = update.effective_user
+    return user.id % workers if user is not None else 0
+
+
+def worker_main(index, workers, updates, token, concurrent_updates, request_factory=None):
+    # в дочернем процессе Ctrl+C обрабатывает супервизор
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    asyncio.run(_worker(index, workers, updates, token, concurrent_updates, request_factory))
+
+
+async def _worker(index, workers, updates, token, concurrent_updates, request_factory):
+    import main
+
+    if main.METRICS_PORT:
+        # у каждого воркера своя страница метрик: порт + номер воркера + 1
+        main.METRICS_PORT += index + 1
+    request = request_factory() if request_factory is not None else None
+    # общий лимит запросов к Bot API делим между воркерами поровну
+    app = main.build_application(token, request=request, polling=False,
+                                 concurrent_updates=concurrent_updates,
+                                 api_rate=main.BOT_API_RATE / workers)
+    await app.initialize()
+    await app.post_init(app)
+    await app.start()
+    print(f"Воркер {index} запущен.")
+
+    loop = asyncio.get_running_loop()
+    try:
+        while True:
+            data = await loop.run_in_executor(None, updates.get)
+            if data is None:
+                break
+            await app.update_queue.put(Update.de_json(data, app.bot))
+    finally:
+        # дорабатываем то, что уже в очереди приложения
+        await app.update_queue.join()
+        await app.stop()
+        await app.post_shutdown(app)
+        await app.shutdown()
+
+
+class Supervisor:
+    def __init__(self, token, workers, concurrent_updates=64, request_factory=None):
+        self.token = token
+        self.workers = workers
+        self.concurrent_updates = concurrent_updates
+        # вызывается в воркере, чтобы подменить транспорт до Bot API
+        self.request_factory = request_factory
+        context = multiprocessing.get_context("spawn")
+        self._context = context
+        self.queues = [context.Queue() for _ in range(workers)]
+        self.processes = [None] * workers
+        self.restarts = [0] * workers
+
+    def _start_worker(self, index):
+        process = self._context.Process(
+            target=worker_main,
+            args=(index, self.workers, self.queues[index], self.token, self.concurrent_updates, self.request_factory),
+            name=f"bot-worker-{index}",
+            daemon=True,
+        )
+        process.start()
+        self.processes[index] = process
+
+    def start(self):
+        for index in range(self.workers):
+            self._start_worker(index)
+
+    def _replace_queue(self, index):
+        # упавший процесс мог умереть, держа замок очереди, и новый воркер
+        # на ней повис бы - переносим всё, что удаётся забрать, в новую
+        old, new = self.queues[index], self._context.Queue()
+        while True:
+            try:
+                new.put(old.get_nowait())
+            except queue.Empty:
+                break
+        self.queues[index] = new
+
+    def check_workers(self):
+        for index, process in enumerate(self.processes):
+            if process is not None and not process.is_alive():
+                self.restarts[index] += 1
+                print(f"Воркер {index} упал (код {process.exitcode}), перезапуск #{self.restarts[index]}")
+                self._replace_queue(index)
+                self._start_worker(index)
+
+    def dispatch(self, update: Update):
+        self.queues[shard_for(update, self.workers)].put(update.to_dict())
+
+    def stop(self, timeout=30):
+        for updates in self.queues:
+            updates.put(None)
+        deadline = time.monotonic() + timeout
+        for process in self.processes:
+            if process is not None:
+                process.join(max(0.0, deadline - time.monotonic()))
+                if process.is_alive():
+                    process.terminate()
+
+    def backlog(self):
+        sizes = []
+        for updates in self.queues:
+            try:
+                sizes.append(updates.qsize())
+            except NotImplementedError:
+                # на macOS qsize недоступен
+                sizes.append(-1)
+        return sizes
+
+    async def monitor(self):
+        while True:
+            await asyncio.sleep(MONITOR_INTERVAL)
+            self.check_workers()
+
+    async def poll(self, poll_timeout=30):
+        offset = None
+        monitor = asyncio.get_running_loop().create_task(self.monitor())
+        try:
+            async with Bot(self.token) as bot:
+                delay = POLL_RETRY_DELAY
+                while True:
+                    # при ошибке повторяем с тем же offset: апдейты не теряются
+                    try:
+                        updates = await bot.get_updates(offset=offset, timeout=poll_timeout,
+                                                        allowed_updates=Update.ALL_TYPES)
+                    except RetryAfter as e:
+                        retry = e.retry_after
+                        await asyncio.sleep(retry.total_seconds() if isinstance(retry, timedelta) else retry)
+                        continue
+                    except NetworkError as e:
+                        # в том числе TimedOut; воркеры продолжают работать
+                        print(f"Ошибка getUpdates: {e}, повтор через {delay:.0f} с")
+                        await asyncio.sleep(delay)
+                        delay = min(delay * 2, POLL_RETRY_MAX_DELAY)
+                        continue
+                    delay = POLL_RETRY_DELAY
+                    for update in updates:
+                        self.dispatch(update)
+                        offset = update.update_id + 1
+        finally:
+            monitor.cancel()
+
+
+def run_sharded(token, workers, concurrent_updates=64):
+    supervisor = Supervisor(token, workers, concurrent_updates)
+    supervisor.start()
+    print(f"Бот запущен ({workers} воркеров).")
+    try:
+        asyncio.run(supervisor.poll())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        supervisor.stop()
+
@@ -0,0 +1,61 @@
+from collections import namedtuple
+from functools import lru_cache
+
+import chess
+
+# moves - разобранные ходы решения, fens[i] - позиция перед ходом i
+# (fens[0] - исходная), playable - сколько первых ходов легальны
+SolutionLine = namedtuple("SolutionLine", "moves fens playable")
+
+# другие правильные ходы игрока, их пишет build_alternatives.py:
+# mate - мат, задача решена; line - перестановка, решение идёт дальше
+ALTERNATIVES_FILE = "alternatives.txt"
+ALT_MATE = "mate"
+ALT_LINE = "line"
+
+
+@lru_cache(maxsize=50_000)
+def _build_line(fen: str, moves: str) -> SolutionLine:
+    board = chess.Board(fen)
+    parsed = []
+    fens = [fen]
+    playable = None
+
+    for ply, move_uci in enumerate(moves.split()):
+        try:
+            move = chess.Move.from_uci(move_uci)
+        except ValueError:
+            playable = ply
+            break
+        if move not in board.legal_moves:
+            playable = ply
+            break
+        board.push(move)
+        parsed.append(move)
+        fens.append(board.fen())
+
+    return SolutionLine(tuple(parsed), tuple(fens), len(parsed) if playable is None else playable)
+
+
+def solution_line(task) -> SolutionLine:
+    """Разобранное и проверенное решение задачи, считается один раз на задачу."""
+    return _build_line(task["fen"], " ".join(task["solution"]))
+
+
+def expected_move(line: SolutionLine, ply: int):
+    """Ход решения на этом полуходе или None, если его нет или он нелегален."""
+    return line.moves[ply] if ply < line.playable else None
+
+
+def load_alternatives(path: str = ALTERNATIVES_FILE) -> dict:
+    """(id задачи, полуход, ход UCI) -> вид хода; если файла нет - пустой словарь."""
+    alternatives = {}
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    puzzle_id, ply, uci, kind = line.rstrip("\n").split("\t")
+                    alternatives[puzzle_id, int(ply), uci] = kind
+    except FileNotFoundError:
+        pass
+    return alternatives
@@ -0,0 +1,81 @@
+"""Статистика исходов: история в solves и счётчики по уровням и темам в solve_stats."""
+import time
+from collections import OrderedDict
+
+from sqlalchemy import select
+
+from db import SolveStat
+
+
+class SolveStats:
+    """Пишет исходы задач через StatsWriter и читает счётчики игрока.
+
+    Счётчики обновляются вместе с каждым исходом (UPSERT с приращением),
+    так что для /stats хватает чтения нескольких строк игрока по индексу.
+    Прочитанные счётчики остаются в кэше и растут вместе с record, как
+    профили в UserCache: повторный /stats базу не трогает.
+    """
+
+    def __init__(self, session_factory, writer, max_size=10_000):
+        self.session_factory = session_factory
+        self.writer = writer
+        self.max_size = max_size
+        # telegram_id -> {(категория, имя): [попыток, решено]} вместе с незаписанным
+        self._stats = OrderedDict()
+
+    def record(self, telegram_id, task, solved, user_rating, now=None):
+        """Первый исход задачи task (из хранилища задач)."""
+        row = {
+            "telegram_id": telegram_id,
+            "puzzle_id": task["id"],
+            "level": task["level"],
+            "puzzle_rating": task["rating"],
+            "user_rating": user_rating,
+            "solved": bool(solved),
+            "created_at": time.time() if now is None else now,
+        }
+        categories = [("level", task["level"])] + [("theme", theme) for theme in task["themes"]]
+        stats = self._stats.get(telegram_id)
+        if stats is not None:
+            for key in categories:
+                counts = stats.setdefault(key, [0, 0])
+                counts[0] += 1
+                counts[1] += row["solved"]
+        self.writer.record_attempt(telegram_id, row, categories)
+
+    async def get(self, telegram_id):
+        """{(категория, имя): [попыток, решено]} с ещё не записанными исходами.
+
+        Словарь из кэша - только для чтения.
+        """
+        stats = self._stats.get(telegram_id)
+        if stats is not None:
+            self._stats.move_to_end(telegram_id)
+            return stats
+
+        stats = await self._read(telegram_id)
+        self._stats[telegram_id] = stats
+        while len(self._stats) > self.max_size:
+            self._stats.popitem(last=False)
+        return stats
+
+    async def _read(self, telegram_id):
+        while True:
+            # пока читали, пачка могла начать или закончить запись: её
+            # приращения уже не в pending, но, может быть, ещё не в базе
+            await self.writer.wait_flushed()
+            generation = self.writer.generation
+            async with self.session_factory() as session:
+                rows = (await session.execute(
+                    select(SolveStat.category, SolveStat.name, SolveStat.attempts, SolveStat.solved)
+                    .where(SolveStat.telegram_id == telegram_id)
+                )).all()
+            if not self.writer.flushing and self.writer.generation == generation:
+                break
+
+        stats = {(category, name): [attempts, solved] for category, name, attempts, solved in rows}
+        for key, (attempts, solved) in self.writer.pending_solve_stats(telegram_id).items():
+            counts = stats.setdefault(key, [0, 0])
+            counts[0] += attempts
+            counts[1] += solved
+        return stats
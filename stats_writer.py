@@ -0,0 +1,287 @@
+import asyncio
+import time
+
+from sqlalchemy import bindparam, delete, func, update
+
+from db import FailedPuzzle, Solve, SolveStat, User, insert, write_lock
+
+
+class _Pending:
+    __slots__ = ("registered", "solved", "total_rating", "level", "username", "rating", "bitmaps")
+
+    def __init__(self):
+        # строку users создаёт только регистрация (/start), остальные
+        # изменения лишь обновляют уже существующую
+        self.registered = False
+        self.solved = 0
+        self.total_rating = 0
+        self.level = None
+        self.username = None
+        # (рейтинг, отклонение) - последние значения, а не приращение
+        self.rating = None
+        # (показанные, решённые, отпечаток набора задач) - живые SeenBitmap,
+        # сериализуются при записи
+        self.bitmaps = None
+
+    def merge(self, older):
+        """Возвращает в пачку несохранённое older, не затирая более свежее."""
+        self.registered = self.registered or older.registered
+        self.solved += older.solved
+        self.total_rating += older.total_rating
+        for name in ("level", "username", "rating", "bitmaps"):
+            if getattr(self, name) is None:
+                setattr(self, name, getattr(older, name))
+
+
+def _update_existing(columns):
+    """UPDATE users по telegram_id: счётчики прибавляются, остальное заменяется."""
+    table = User.__table__
+    values = {}
+    for name in columns:
+        if name in ("solved_count", "total_rating"):
+            values[name] = table.c[name] + bindparam(f"new_{name}")
+        elif name != "telegram_id":
+            values[name] = bindparam(f"new_{name}")
+    return update(table).where(table.c.telegram_id == bindparam("new_telegram_id")).values(values)
+
+
+class StatsWriter:
+    """Отложенная запись счётчиков пользователей.
+
+    Регистрации, решённые задачи, смена уровня и рейтинга, расписание
+    повторения задач, история исходов и счётчики по уровням и темам копятся
+    в памяти и пишутся в базу одной транзакцией с UPSERT - по таймеру или
+    когда набралось max_pending пользователей. stop() дописывает всё,
+    что осталось.
+    """
+
+    def __init__(self, session_factory, flush_interval=1.0, max_pending=500):
+        self.session_factory = session_factory
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        # telegram_id -> _Pending
+        self._pending = {}
+        # telegram_id -> {puzzle_id: (индекс, ступень, due_at) или None - удалить}
+        self._reviews = {}
+        # строки solves и приращения solve_stats:
+        # telegram_id -> {(категория, имя): [попыток, решено]}
+        self._solves = []
+        self._solve_stats = {}
+        self._task = None
+        self._flush_lock = asyncio.Lock()
+        self._flush_task = None
+        # растёт после каждой записанной пачки, по нему кэш понимает,
+        # что прочитанная из базы строка могла устареть
+        self.generation = 0
+
+    @property
+    def flushing(self):
+        return self._flush_lock.locked()
+
+    async def wait_flushed(self):
+        """Ждёт, пока допишется идущая сейчас пачка, если она есть."""
+        if self.flushing:
+            async with self._flush_lock:
+                pass
+
+    def pending(self, telegram_id):
+        """Ещё не записанные изменения пользователя (_Pending) или None."""
+        return self._pending.get(telegram_id)
+
+    def pending_reviews(self, telegram_id):
+        """Ещё не записанные изменения расписания: {puzzle_id: ... или None}."""
+        return self._reviews.get(telegram_id, {})
+
+    def pending_solve_stats(self, telegram_id):
+        """Ещё не записанные приращения счётчиков: {(категория, имя): [попыток, решено]}."""
+        return self._solve_stats.get(telegram_id, {})
+
+    def backlog(self):
+        """Сколько пользователей, расписаний и исходов ждут записи."""
+        return len(self._pending) + len(self._reviews) + len(self._solves)
+
+    def _item(self, telegram_id):
+        item = self._pending.get(telegram_id)
+        if item is None:
+            item = self._pending[telegram_id] = _Pending()
+        return item
+
+    def register(self, telegram_id, username):
+        item = self._item(telegram_id)
+        item.registered = True
+        item.username = username
+        self._maybe_flush()
+
+    def record_solve(self, telegram_id, rating):
+        item = self._item(telegram_id)
+        item.solved += 1
+        item.total_rating += rating
+        self._maybe_flush()
+
+    def set_level(self, telegram_id, level):
+        self._item(telegram_id).level = level
+        self._maybe_flush()
+
+    def set_rating(self, telegram_id, rating, deviation):
+        self._item(telegram_id).rating = (rating, deviation)
+        self._maybe_flush()
+
+    def set_bitmaps(self, telegram_id, seen, solved, fingerprint):
+        self._item(telegram_id).bitmaps = (seen, solved, fingerprint)
+        self._maybe_flush()
+
+    def schedule_review(self, telegram_id, puzzle_id, puzzle, step, due_at):
+        self._reviews.setdefault(telegram_id, {})[puzzle_id] = (puzzle, step, due_at)
+        self._maybe_flush()
+
+    def drop_review(self, telegram_id, puzzle_id):
+        self._reviews.setdefault(telegram_id, {})[puzzle_id] = None
+        self._maybe_flush()
+
+    def record_attempt(self, telegram_id, row, categories):
+        """Исход задачи: строка solves и +1 к счётчикам (категория, имя)."""
+        self._solves.append(row)
+        user_stats = self._solve_stats.setdefault(telegram_id, {})
+        for key in categories:
+            counts = user_stats.get(key)
+            if counts is None:
+                counts = user_stats[key] = [0, 0]
+            counts[0] += 1
+            counts[1] += row["solved"]
+        self._maybe_flush()
+
+    def _maybe_flush(self):
+        if (self.backlog() >= self.max_pending
+                and (self._flush_task is None or self._flush_task.done())):
+            self._flush_task = asyncio.get_running_loop().create_task(self.flush())
+
+    async def start(self):
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                print(f"Ошибка записи статистики: {e}")
+
+    async def flush(self):
+        async with self._flush_lock:
+            if not self._pending and not self._reviews and not self._solves:
+                return
+            batch, self._pending = self._pending, {}
+            reviews, self._reviews = self._reviews, {}
+            solves, self._solves = self._solves, []
+            solve_stats, self._solve_stats = self._solve_stats, {}
+            try:
+                await self._write(batch, reviews, solves, solve_stats)
+                self.generation += 1
+            except Exception:
+                # возвращаем несохранённое, новые изменения сверху
+                for telegram_id, older in batch.items():
+                    self._item(telegram_id).merge(older)
+                for telegram_id, older in reviews.items():
+                    self._reviews[telegram_id] = {**older, **self._reviews.get(telegram_id, {})}
+                self._solves[:0] = solves
+                for telegram_id, older in solve_stats.items():
+                    user_stats = self._solve_stats.setdefault(telegram_id, {})
+                    for key, (attempts, solved) in older.items():
+                        counts = user_stats.setdefault(key, [0, 0])
+                        counts[0] += attempts
+                        counts[1] += solved
+                raise
+
+    async def _write(self, batch, reviews, solves=(), solve_stats=None):
+        # строки группируем по набору заданных полей: у каждой группы свой UPSERT
+        groups = {}
+        now = time.time()
+        for telegram_id, item in batch.items():
+            row = {"telegram_id": telegram_id, "solved_count": item.solved, "total_rating": item.total_rating,
+                   "updated_at": now}
+            if item.registered:
+                row["username"] = item.username
+            if item.level is not None:
+                row["current_level"] = item.level
+            if item.rating is not None:
+                row["rating"], row["rating_deviation"] = item.rating
+            if item.bitmaps is not None:
+                seen, solved, row["puzzles_fingerprint"] = item.bitmaps
+                row["seen_puzzles"], row["solved_puzzles"] = seen.to_bytes(), solved.to_bytes()
+            groups.setdefault((item.registered, frozenset(row)), []).append(row)
+
+        stmt = insert(User)
+        update = {
+            "solved_count": User.solved_count + stmt.excluded.solved_count,
+            "total_rating": User.total_rating + stmt.excluded.total_rating,
+            "username": func.coalesce(stmt.excluded.username, User.username),
+        }
+
+        upserts = []
+        deletes = []
+        for telegram_id, items in reviews.items():
+            for puzzle_id, value in items.items():
+                if value is None:
+                    deletes.append((telegram_id, puzzle_id))
+                else:
+                    puzzle, step, due_at = value
+                    upserts.append({"telegram_id": telegram_id, "puzzle_id": puzzle_id,
+                                    "puzzle": puzzle, "step": step, "due_at": due_at})
+
+        async with write_lock, self.session_factory() as session:
+            for (registered, columns), rows in groups.items():
+                if not registered:
+                    await session.execute(
+                        _update_existing(columns),
+                        [{f"new_{name}": value for name, value in row.items()} for row in rows],
+                    )
+                    continue
+                extra = {
+                    name: stmt.excluded[name] for name in columns
+                    if name not in update and name != "telegram_id"
+                }
+                await session.execute(
+                    stmt.on_conflict_do_update(index_elements=[User.telegram_id], set_={**update, **extra}),
+                    rows,
+                )
+            if upserts:
+                review = insert(FailedPuzzle)
+                await session.execute(
+                    review.on_conflict_do_update(
+                        index_elements=[FailedPuzzle.telegram_id, FailedPuzzle.puzzle_id],
+                        set_={name: review.excluded[name] for name in ("puzzle", "step", "due_at")},
+                    ),
+                    upserts,
+                )
+            for telegram_id, puzzle_id in deletes:
+                await session.execute(delete(FailedPuzzle).where(
+                    FailedPuzzle.telegram_id == telegram_id, FailedPuzzle.puzzle_id == puzzle_id,
+                ))
+            if solves:
+                await session.execute(insert(Solve), solves)
+            if solve_stats:
+                counters = insert(SolveStat)
+                await session.execute(
+                    counters.on_conflict_do_update(
+                        index_elements=[SolveStat.telegram_id, SolveStat.category, SolveStat.name],
+                        set_={
+                            "attempts": SolveStat.attempts + counters.excluded.attempts,
+                            "solved": SolveStat.solved + counters.excluded.solved,
+                        },
+                    ),
+                    [{"telegram_id": telegram_id, "category": category, "name": name,
+                      "attempts": attempts, "solved": solved}
+                     for telegram_id, user_stats in solve_stats.items()
+                     for (category, name), (attempts, solved) in user_stats.items()],
+                )
+            await session.commit()
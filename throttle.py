@@ -0,0 +1,121 @@
+"""Ограничение частоты: апдейты от одного пользователя и запросы к Bot API."""
+import asyncio
+import time
+from collections import OrderedDict
+from datetime import timedelta
+
+from telegram.error import RetryAfter
+from telegram.ext import BaseRateLimiter
+
+from metrics import THROTTLED
+
+# служебные запросы не тратят лимит на отправку сообщений
+UNLIMITED_ENDPOINTS = frozenset({"getUpdates", "getMe", "setWebhook", "deleteWebhook"})
+
+
+class TokenBucket:
+    """Маркерное ведро с резервированием.
+
+    reserve() забирает маркер сразу, даже в долг, и возвращает, сколько
+    ждать до его появления. Поэтому ждущие получают маркеры строго в порядке
+    обращения.
+    """
+
+    __slots__ = ("rate", "capacity", "tokens", "updated")
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def reserve(self) -> float:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        self.tokens -= 1
+        return -self.tokens / self.rate if self.tokens < 0 else 0.0
+
+    def refund(self):
+        self.tokens += 1
+
+
+class UserRateLimiter:
+    """Не больше rate апдейтов в секунду от пользователя, всплеск - до burst.
+
+    Маркер резервируется, когда апдейт пришёл, поэтому ожидание учитывает
+    всю очередь пользователя. Апдейт, которому ждать дольше max_delay,
+    отбрасывается сразу.
+    """
+
+    def __init__(self, rate=2.0, burst=5, max_delay=5.0, max_users=100_000):
+        self.rate = rate
+        self.burst = burst
+        self.max_delay = max_delay
+        self.max_users = max_users
+        self._buckets = OrderedDict()
+
+    def _bucket(self, user_id):
+        bucket = self._buckets.get(user_id)
+        if bucket is None:
+            bucket = self._buckets[user_id] = TokenBucket(self.rate, self.burst)
+            # давно молчавший пользователь начнёт с полного ведра - это не страшно
+            while len(self._buckets) > self.max_users:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(user_id)
+        return bucket
+
+    def reserve(self, user_id):
+        """Сколько секунд ждать маркера; None - апдейт надо отбросить."""
+        bucket = self._bucket(user_id)
+        wait = bucket.reserve()
+        if wait > self.max_delay:
+            bucket.refund()
+            THROTTLED.inc("dropped")
+            return None
+        if wait:
+            THROTTLED.inc("delayed")
+        return wait
+
+    def refund(self, user_id):
+        """Возвращает маркер апдейта, который так и не обработали."""
+        bucket = self._buckets.get(user_id)
+        if bucket is not None:
+            bucket.refund()
+
+
+class GlobalRateLimiter(BaseRateLimiter):
+    """Общий потолок запросов к Bot API на процесс.
+
+    Запросы ждут маркера в порядке вызова, так что ответы одному
+    пользователю не обгоняют друг друга. На RetryAfter от Telegram ждём
+    сколько сказано и повторяем до max_retries раз.
+    """
+
+    def __init__(self, rate=30.0, burst=30, max_retries=2):
+        self.bucket = TokenBucket(rate, burst)
+        self.max_retries = max_retries
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    async def process_request(self, callback, args, kwargs, endpoint, data, rate_limit_args):
+        attempt = 0
+        while True:
+            if endpoint not in UNLIMITED_ENDPOINTS:
+                wait = self.bucket.reserve()
+                if wait:
+                    await asyncio.sleep(wait)
+            try:
+                return await callback(*args, **kwargs)
+            except RetryAfter as e:
+                if attempt >= self.max_retries:
+                    raise
+                attempt += 1
+                THROTTLED.inc("retry_after")
+                delay = e.retry_after
+                await asyncio.sleep(delay.total_seconds() if isinstance(delay, timedelta) else delay)
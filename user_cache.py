@@ -0,0 +1,145 @@
+from collections import OrderedDict
+
+from sqlalchemy import select
+
+from db import User
+from rating import START_DEVIATION, START_RATING
+from seen_bitmap import SeenBitmap
+
+
+class CachedUser:
+    __slots__ = ("telegram_id", "username", "solved_count", "total_rating", "current_level",
+                 "rating", "rating_deviation", "seen", "solved")
+
+    def __init__(self, telegram_id, username, solved_count, total_rating, current_level,
+                 rating=START_RATING, rating_deviation=START_DEVIATION, seen=None, solved=None):
+        self.telegram_id = telegram_id
+        self.username = username
+        self.solved_count = solved_count
+        self.total_rating = total_rating
+        self.current_level = current_level
+        self.rating = rating
+        self.rating_deviation = rating_deviation
+        # индексы задач, которые игроку показывали и которые он решил
+        self.seen = seen if seen is not None else SeenBitmap()
+        self.solved = solved if solved is not None else SeenBitmap()
+
+
+class UserCache:
+    """Профили и статистика пользователей с чтением из базы при промахе.
+
+    Изменения проходят через кэш: он сразу обновляет свою копию и передаёт
+    их в StatsWriter, так что горячие пользователи читаются без базы.
+    """
+
+    def __init__(self, session_factory, writer, max_size=10_000, puzzles_fingerprint=None):
+        self.session_factory = session_factory
+        self.writer = writer
+        self.max_size = max_size
+        # отпечаток текущего набора задач: карты от другого набора не читаем
+        self.puzzles_fingerprint = puzzles_fingerprint
+        self._users = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._users)
+
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def _put(self, user):
+        self._users[user.telegram_id] = user
+        self._users.move_to_end(user.telegram_id)
+        while len(self._users) > self.max_size:
+            self._users.popitem(last=False)
+
+    def _from_row(self, user):
+        # к строке из базы добавляем то, что StatsWriter ещё не записал
+        if user.puzzles_fingerprint == self.puzzles_fingerprint:
+            seen, solved = SeenBitmap.from_bytes(user.seen_puzzles), SeenBitmap.from_bytes(user.solved_puzzles)
+        else:
+            # набор пересобрали, индексы в картах указывают на другие задачи
+            seen, solved = SeenBitmap(), SeenBitmap()
+        cached = CachedUser(
+            user.telegram_id,
+            user.username,
+            user.solved_count or 0,
+            user.total_rating or 0,
+            user.current_level,
+            user.rating if user.rating is not None else START_RATING,
+            user.rating_deviation if user.rating_deviation is not None else START_DEVIATION,
+            seen,
+            solved,
+        )
+        pending = self.writer.pending(user.telegram_id)
+        if pending is not None:
+            cached.solved_count += pending.solved
+            cached.total_rating += pending.total_rating
+            cached.current_level = pending.level or cached.current_level
+            if pending.rating is not None:
+                cached.rating, cached.rating_deviation = pending.rating
+            if pending.bitmaps is not None:
+                cached.seen, cached.solved, _ = pending.bitmaps
+        return cached
+
+    async def get(self, telegram_id):
+        cached = self._users.get(telegram_id)
+        if cached is not None:
+            self.hits += 1
+            self._users.move_to_end(telegram_id)
+            return cached
+
+        self.misses += 1
+        generation = self.writer.generation
+        async with self.session_factory() as session:
+            user = await session.scalar(select(User).where(User.telegram_id == telegram_id))
+        if user is None:
+            return None
+
+        cached = self._from_row(user)
+        # пока читали, пачка могла уйти в базу: такую копию не запоминаем
+        if not self.writer.flushing and self.writer.generation == generation:
+            self._put(cached)
+        return cached
+
+    def register(self, telegram_id, username, level="Средняя"):
+        """Новый пользователь: сразу виден в кэше, а в базу попадёт с пачкой."""
+        cached = CachedUser(telegram_id, username, 0, 0, level)
+        self._put(cached)
+        self.writer.register(telegram_id, username)
+        return cached
+
+    def invalidate(self, telegram_id):
+        self._users.pop(telegram_id, None)
+
+    def record_solve(self, telegram_id, rating):
+        cached = self._users.get(telegram_id)
+        if cached is not None:
+            cached.solved_count += 1
+            cached.total_rating += rating
+        self.writer.record_solve(telegram_id, rating)
+
+    def set_level(self, telegram_id, level):
+        cached = self._users.get(telegram_id)
+        if cached is not None:
+            cached.current_level = level
+        self.writer.set_level(telegram_id, level)
+
+    def set_rating(self, telegram_id, rating, deviation):
+        cached = self._users.get(telegram_id)
+        if cached is not None:
+            cached.rating = rating
+            cached.rating_deviation = deviation
+        self.writer.set_rating(telegram_id, rating, deviation)
+
+    def mark_seen(self, user, index):
+        """Задачу показали игроку; user - объект из get()."""
+        if user.seen.add(index):
+            self.writer.set_bitmaps(user.telegram_id, user.seen, user.solved, self.puzzles_fingerprint)
+
+    def mark_solved(self, user, index):
+        added = user.seen.add(index)
+        if user.solved.add(index) or added:
+            self.writer.set_bitmaps(user.telegram_id, user.seen, user.solved, self.puzzles_fingerprint)
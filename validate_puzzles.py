@@ -0,0 +1,99 @@
+"""Проверяет решения всех задач и пишет список карантина.
+
+    python validate_puzzles.py puzzles_data.json
+    python validate_puzzles.py lichess_db_puzzle.csv.zst --workers 8 -o quarantine.txt
+
+Задачи из карантина загрузчик пропускает, так что сломанные данные
+не доходят до пользователей.
+"""
+import argparse
+import os
+import re
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+
+import chess
+
+from puzzle_loader import QUARANTINE_FILE, iter_records
+
+MATE_IN = re.compile(r"^mateIn(\d+)$")
+
+
+def check_record(record):
+    """Возвращает (id, причина) для сломанной задачи или None."""
+    moves = record.moves.split()
+    if not moves:
+        return record.puzzle_id, "нет ходов решения"
+
+    try:
+        board = chess.Board(record.fen)
+    except ValueError:
+        return record.puzzle_id, "неверный FEN"
+
+    for ply, move_uci in enumerate(moves):
+        try:
+            move = chess.Move.from_uci(move_uci)
+        except ValueError:
+            return record.puzzle_id, f"ход {ply + 1} {move_uci}: неверная запись"
+
+        if move not in board.legal_moves:
+            piece = board.piece_at(move.from_square)
+            if piece is not None and piece.color != board.turn:
+                return record.puzzle_id, f"ход {ply + 1} {move_uci}: ходит не та сторона"
+            return record.puzzle_id, f"ход {ply + 1} {move_uci}: невозможен"
+        board.push(move)
+
+    themes = record.themes.split()
+    mate_in = [int(m.group(1)) for m in map(MATE_IN.match, themes) if m]
+    if mate_in or "mate" in themes:
+        if not board.is_checkmate():
+            return record.puzzle_id, "помечена как мат, но решение не матует"
+        # ходы матующей стороны - каждый второй, начиная с последнего
+        mating_moves = (len(moves) + 1) // 2
+        if mate_in and mate_in[0] != mating_moves:
+            return record.puzzle_id, f"помечена как mateIn{mate_in[0]}, а мат в {mating_moves}"
+
+    return None
+
+
+def check_batch(records):
+    return [result for result in map(check_record, records) if result is not None]
+
+
+def validate(sources, workers=None, batch_size=1024):
+    records = (record for source in sources for record in iter_records(source))
+    workers = workers or os.cpu_count()
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        # держим в работе ограниченное число пачек, чтобы не читать весь файл в память
+        pending = deque()
+        while True:
+            while len(pending) < workers * 2:
+                batch = list(islice(records, batch_size))
+                if not batch:
+                    break
+                pending.append(pool.submit(check_batch, batch))
+            if not pending:
+                break
+            yield from pending.popleft().result()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Проверка решений задач")
+    parser.add_argument("sources", nargs="+", help=".json, .jsonl, .csv или .csv.zst")
+    parser.add_argument("-o", "--output", default=QUARANTINE_FILE)
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    args = parser.parse_args()
+
+    bad = 0
+    with open(args.output, "w", encoding="utf-8") as f:
+        for puzzle_id, reason in validate(args.sources, args.workers):
+            f.write(f"{puzzle_id}\t{reason}\n")
+            bad += 1
+
+    print(f"Сломанных задач: {bad}, список в {args.output}")
+
+
+if __name__ == "__main__":
+    main()
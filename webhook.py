@@ -0,0 +1,215 @@
+import asyncio
+import json
+import time
+
+import telegram
+from telegram import Update
+from telegram.error import TelegramError
+from telegram.ext import BaseUpdateProcessor
+
+from metrics import THROTTLED
+
+# PerUserUpdateProcessor переопределяет process_update, помеченный в PTB
+# как @final, и берёт слот из его _semaphore. Проверено на 22.x: в другой
+# мажорной версии это может незаметно сломаться, поэтому она закреплена
+PTB_MAJOR = 22
+if telegram.__version_info__.major != PTB_MAJOR:
+    raise ImportError(f"нужен python-telegram-bot {PTB_MAJOR}.x, установлен {telegram.__version__}")
+
+SECRET_HEADER = b"x-telegram-bot-api-secret-token"
+
+# кнопки, от которых важен только последний нажатый вариант
+COALESCED_CALLBACKS = frozenset({"show_board", "hide_board"})
+
+
+async def _skip(update, coroutine):
+    """Апдейт не обрабатывается; у нажатой кнопки снимаем «часики»."""
+    coroutine.close()
+    query = getattr(update, "callback_query", None)
+    if query is not None:
+        try:
+            await query.answer()
+        except TelegramError:
+            pass
+
+
+def _coalesced(update):
+    query = getattr(update, "callback_query", None)
+    return query is not None and query.data in COALESCED_CALLBACKS
+
+
+class PerUserUpdateProcessor(BaseUpdateProcessor):
+    """Разные пользователи обрабатываются параллельно, апдейты одного - по очереди.
+
+    Иначе два быстрых хода одного пользователя могли бы одновременно
+    менять его задачу в active_games. limiter (throttle.UserRateLimiter)
+    придерживает или отбрасывает апдейты того, кто шлёт их слишком часто.
+    Из очереди нажатий "Показать/Скрыть доску" выполняется только
+    последнее - промежуточные состояния никто не увидит.
+
+    Очередь пользователя и ожидание маркера не занимают слотов
+    max_concurrent_updates: слот берётся, только когда обработчик
+    запускается, так что флуд одного не задерживает остальных.
+    """
+
+    def __init__(self, max_concurrent_updates, limiter=None):
+        super().__init__(max_concurrent_updates)
+        self.limiter = limiter
+        # user_id -> [замок, сколько апдейтов его ждут или держат,
+        #             номер последнего нажатия показать/скрыть]
+        self._locks = {}
+
+    async def process_update(self, update, coroutine):
+        # тот же семафор, что в BaseUpdateProcessor, но слот берётся после
+        # очереди пользователя, а не на всё время ожидания в ней
+        user = getattr(update, "effective_user", None)
+        if user is None:
+            async with self._semaphore:
+                await coroutine
+            return
+
+        ready_at = time.monotonic()
+        if self.limiter is not None:
+            wait = self.limiter.reserve(user.id)
+            if wait is None:
+                await _skip(update, coroutine)
+                return
+            ready_at += wait
+
+        item = self._locks.setdefault(user.id, [asyncio.Lock(), 0, 0])
+        item[1] += 1
+        toggle = _coalesced(update)
+        if toggle:
+            item[2] += 1
+            number = item[2]
+        try:
+            async with item[0]:
+                delay = ready_at - time.monotonic()
+                if delay > 0 and not (toggle and number != item[2]):
+                    await asyncio.sleep(delay)
+                if toggle and number != item[2]:
+                    # за этим нажатием в очереди уже стоит следующее
+                    THROTTLED.inc("coalesced")
+                    if self.limiter is not None:
+                        self.limiter.refund(user.id)
+                    await _skip(update, coroutine)
+                    return
+                async with self._semaphore:
+                    await self.do_process_update(update, coroutine)
+        finally:
+            item[1] -= 1
+            if not item[1]:
+                del self._locks[user.id]
+
+    async def do_process_update(self, update, coroutine):
+        await coroutine
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+
+class WebhookApp:
+    """ASGI-приложение, принимающее апдейты от Telegram по webhook.
+
+    Апдейт кладётся в очередь Application и сразу подтверждается, а
+    обрабатывают очередь до concurrent_updates задач одновременно
+    (настраивается в build_application). Если очередь переполнена,
+    отвечаем 503 - Telegram повторит доставку позже.
+    """
+
+    def __init__(self, application, path="/telegram", secret_token=None,
+                 webhook_url=None, max_queue=10_000):
+        self.application = application
+        self.path = path
+        self.secret_token = secret_token
+        self.webhook_url = webhook_url
+        self.max_queue = max_queue
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            await self._lifespan(receive, send)
+        elif scope["type"] == "http":
+            await self._http(scope, receive, send)
+
+    async def startup(self):
+        app = self.application
+        await app.initialize()
+        if app.post_init:
+            await app.post_init(app)
+        await app.start()
+        if self.webhook_url:
+            await app.bot.set_webhook(
+                self.webhook_url, secret_token=self.secret_token, allowed_updates=Update.ALL_TYPES,
+            )
+
+    async def shutdown(self):
+        app = self.application
+        await app.stop()
+        if app.post_shutdown:
+            await app.post_shutdown(app)
+        await app.shutdown()
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                try:
+                    await self.startup()
+                except Exception as e:
+                    await send({"type": "lifespan.startup.failed", "message": str(e)})
+                    return
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                await self.shutdown()
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    async def _http(self, scope, receive, send):
+        if scope["method"] != "POST" or scope["path"] != self.path:
+            await _respond(send, 404)
+            return
+
+        if self.secret_token is not None:
+            headers = dict(scope["headers"])
+            if headers.get(SECRET_HEADER, b"").decode() != self.secret_token:
+                await _respond(send, 403)
+                return
+
+        body = b""
+        while True:
+            message = await receive()
+            body += message.get("body", b"")
+            if not message.get("more_body"):
+                break
+
+        try:
+            update = Update.de_json(json.loads(body), self.application.bot)
+        except (ValueError, TypeError, KeyError):
+            await _respond(send, 400)
+            return
+
+        queue = self.application.update_queue
+        if queue.qsize() >= self.max_queue:
+            await _respond(send, 503)
+            return
+        await queue.put(update)
+        await _respond(send, 200)
+
+
+async def _respond(send, status):
+    await send({"type": "http.response.start", "status": status,
+                "headers": [(b"content-type", b"text/plain")]})
+    await send({"type": "http.response.body", "body": b""})
+
+
+def run_webhook(application, host="0.0.0.0", port=8443, **kwargs):
+    """Запускает WebhookApp под uvicorn (pip install uvicorn)."""
+    try:
+        import uvicorn
+    except ImportError:
+        raise RuntimeError("для режима webhook нужен пакет uvicorn")
+
+    uvicorn.run(WebhookApp(application, **kwargs), host=host, port=port, lifespan="on", log_level="warning")